@@ -5,14 +5,21 @@ from flask import Flask, send_from_directory, render_template
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager, current_user
+import click
 import os
 from config import config
 from models import init_database, insert_default_content, AdminUser
+from security import PasswordManager
 from routes import register_routes
+from services.database import init_database_pool, get_db_maintenance
+from services.content_export import export_content_snapshot
+from services.uploads import UploadRequest
 
 def create_app(test_config=None):
     """应用工厂函数"""
     app = Flask(__name__)
+    # 上传文件在解析请求体时流式校验，不合法的文件不写入磁盘
+    app.request_class = UploadRequest
     
     # 配置应用
     if test_config is None:
@@ -21,6 +28,26 @@ def create_app(test_config=None):
         app.config['UPLOAD_FOLDER'] = config.UPLOAD_FOLDER
         app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
         app.config['DATABASE_PATH'] = config.DATABASE_PATH
+        app.config['DATABASE_POOL_MODE'] = config.DATABASE_POOL_MODE
+        app.config['DATABASE_POOL_LEAK_THRESHOLD'] = config.DATABASE_POOL_LEAK_THRESHOLD
+        app.config['DATABASE_POOL_TIMEOUT'] = config.DATABASE_POOL_TIMEOUT
+        app.config['DATABASE_POOL_MAX_CONNECTIONS'] = config.DATABASE_POOL_MAX_CONNECTIONS
+        app.config['DATABASE_POOL_MIN_CONNECTIONS'] = config.DATABASE_POOL_MIN_CONNECTIONS
+        app.config['DATABASE_POOL_ADAPTIVE'] = config.DATABASE_POOL_ADAPTIVE
+        app.config['DATABASE_POOL_IDLE_TIMEOUT'] = config.DATABASE_POOL_IDLE_TIMEOUT
+        app.config['DATABASE_POOL_WAIT_THRESHOLD'] = config.DATABASE_POOL_WAIT_THRESHOLD
+        app.config['DATABASE_WRITE_BATCH_SIZE'] = config.DATABASE_WRITE_BATCH_SIZE
+        app.config['DATABASE_WRITE_BATCH_WINDOW'] = config.DATABASE_WRITE_BATCH_WINDOW
+        app.config['DATABASE_MAINTENANCE_INTERVAL'] = config.DATABASE_MAINTENANCE_INTERVAL
+        app.config['DATABASE_WAL_CHECKPOINT_THRESHOLD'] = config.DATABASE_WAL_CHECKPOINT_THRESHOLD
+        app.config['DATABASE_OPTIMIZE_INTERVAL'] = config.DATABASE_OPTIMIZE_INTERVAL
+        app.config['DATABASE_VACUUM_IDLE_SECONDS'] = config.DATABASE_VACUUM_IDLE_SECONDS
+        app.config['DATABASE_VACUUM_PAGES'] = config.DATABASE_VACUUM_PAGES
+        app.config['DATABASE_TRACE_ENABLED'] = config.DATABASE_TRACE_ENABLED
+        app.config['REQUEST_DEADLINE_API'] = config.REQUEST_DEADLINE_API
+        app.config['REQUEST_DEADLINE_ADMIN'] = config.REQUEST_DEADLINE_ADMIN
+        app.config['CONTENT_EXPORT_DIR'] = config.CONTENT_EXPORT_DIR
+        app.config['CONTENT_STREAM_ENABLED'] = config.CONTENT_STREAM_ENABLED
         
         # 会话安全配置
         app.config['SESSION_COOKIE_SECURE'] = False  # 开发环境设为False，生产环境应设为True
@@ -37,6 +64,11 @@ def create_app(test_config=None):
             app.config['UPLOAD_FOLDER'] = config.UPLOAD_FOLDER
         if 'MAX_CONTENT_LENGTH' not in test_config:
             app.config['MAX_CONTENT_LENGTH'] = config.MAX_CONTENT_LENGTH
+        if 'DATABASE_PATH' not in test_config:
+            app.config['DATABASE_PATH'] = config.DATABASE_PATH
+    
+    # 为当前应用创建独立的数据库连接池，模型层的所有数据库访问都经过该连接池
+    init_database_pool(app)
     
     # 启用CORS以支持前后端分离
     CORS(app, supports_credentials=True, origins=['http://localhost:3000', 'http://127.0.0.1:3000'])
@@ -54,11 +86,46 @@ def create_app(test_config=None):
     @login_manager.user_loader
     def load_user(user_id):
         """Flask-Login用户加载回调函数"""
-        return AdminUser.get_by_id(user_id, app.config.get('DATABASE_PATH'))
+        return AdminUser.get_cached(user_id, app.config.get('DATABASE_PATH'))
     
     # 注册路由
     register_routes(app, csrf)
     
+    @app.cli.command('export-content')
+    @click.option('--output-dir', default=None, help='导出目录，默认使用CONTENT_EXPORT_DIR')
+    def export_content_command(output_dir):
+        """导出公开内容静态快照"""
+        output_dir = output_dir or app.config.get('CONTENT_EXPORT_DIR')
+        if not output_dir:
+            raise click.UsageError('请通过--output-dir或CONTENT_EXPORT_DIR指定导出目录')
+        for path in export_content(output_dir):
+            click.echo(path)
+    
+    @app.cli.command('db-maintenance')
+    @click.option('--enable-incremental-vacuum', is_flag=True,
+                  help='将已有数据库转换为auto_vacuum=INCREMENTAL（执行一次完整VACUUM，期间阻塞写入）')
+    def db_maintenance_command(enable_incremental_vacuum):
+        """立即执行一轮数据库维护（检查点、optimize、incremental_vacuum）"""
+        maintenance = get_db_maintenance()
+        if enable_incremental_vacuum:
+            before, after = maintenance.enable_incremental_vacuum()
+            click.echo(f"auto_vacuum: {before} -> {after}")
+        elif not maintenance.get_stats()['vacuum_available']:
+            click.echo("incremental_vacuum不可用：请在维护窗口执行 flask db-maintenance --enable-incremental-vacuum")
+        for task in maintenance.run_once(force=True):
+            stats = maintenance.get_stats()['tasks'][task]
+            click.echo(f"{task}: {stats['last_duration_ms']}ms {stats['last_result']}")
+    
+    @app.cli.command('calibrate-bcrypt')
+    @click.option('--target-ms', type=float, default=None, help='单次哈希的目标耗时（毫秒），默认使用BCRYPT_TARGET_MS')
+    def calibrate_bcrypt_command(target_ms):
+        """测量本机各成本因子的bcrypt耗时，给出满足目标耗时的BCRYPT_ROUNDS"""
+        target_ms = target_ms or config.BCRYPT_TARGET_MS
+        rounds, timings = PasswordManager.calibrate_rounds(target_ms, config.BCRYPT_MIN_ROUNDS, config.BCRYPT_MAX_ROUNDS)
+        for cost, duration_ms in timings.items():
+            click.echo(f"rounds={cost}: {duration_ms:.1f}ms")
+        click.echo(f"BCRYPT_ROUNDS={rounds}")
+    
     # 静态文件服务
     @app.route('/static/uploads/<filename>')
     def uploaded_file(filename):
@@ -101,19 +168,29 @@ def create_app(test_config=None):
     
     return app
 
-def init_app():
+def init_app(app=None):
     """初始化应用数据"""
+    if app is not None:
+        # 在应用上下文中初始化，复用该应用的数据库连接池
+        with app.app_context():
+            return init_app()
+    
     # 初始化数据库
     init_database()
     insert_default_content()
     AdminUser.create_default_admin()
 
+def export_content(output_dir):
+    """将当前公开内容导出为静态文件（含预压缩变体）"""
+    from routes.api import get_public_snapshot
+    return export_content_snapshot(get_public_snapshot(allow_stale=False), output_dir)
+
 if __name__ == '__main__':
     # 创建应用实例
     app = create_app()
     
     # 初始化数据
-    init_app()
+    init_app(app)
     
     print("智护童行后端服务启动中...")
     print(f"管理后台地址: http://{config.HOST}:{config.PORT}/admin")
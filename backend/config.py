@@ -13,6 +13,66 @@ class Config:
     
     # 数据库配置
     DATABASE_PATH: str = os.getenv('DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'zhihu_tongxing.db'))
+    DATABASE_POOL_MODE: str = os.getenv('DATABASE_POOL_MODE', 'queue')  # queue 或 thread（每线程固定连接）
+    DATABASE_POOL_LEAK_THRESHOLD: float = float(os.getenv('DATABASE_POOL_LEAK_THRESHOLD', 5))  # 秒，0表示不检测
+    DATABASE_POOL_TIMEOUT: float = float(os.getenv('DATABASE_POOL_TIMEOUT', 30))  # 秒
+    DATABASE_POOL_MAX_CONNECTIONS: int = int(os.getenv('DATABASE_POOL_MAX_CONNECTIONS', 10))
+    DATABASE_POOL_MIN_CONNECTIONS: int = int(os.getenv('DATABASE_POOL_MIN_CONNECTIONS', 5))  # 预创建的连接数
+    DATABASE_POOL_ADAPTIVE: bool = os.getenv('DATABASE_POOL_ADAPTIVE', 'False').lower() == 'true'
+    DATABASE_POOL_IDLE_TIMEOUT: float = float(os.getenv('DATABASE_POOL_IDLE_TIMEOUT', 60))  # 秒
+    DATABASE_POOL_WAIT_THRESHOLD: float = float(os.getenv('DATABASE_POOL_WAIT_THRESHOLD', 0.02))  # 秒
+    
+    # 写入线程批量提交：每次事务最多合并的写操作数，以及收到首个写操作后额外等待的秒数
+    DATABASE_WRITE_BATCH_SIZE: int = int(os.getenv('DATABASE_WRITE_BATCH_SIZE', 50))
+    DATABASE_WRITE_BATCH_WINDOW: float = float(os.getenv('DATABASE_WRITE_BATCH_WINDOW', 0))
+    
+    # 后台数据库维护：检查间隔（秒，0表示不启动后台线程）、WAL检查点阈值（字节）、
+    # PRAGMA optimize间隔（秒）、空闲多少秒后执行incremental_vacuum及每次回收的页数
+    DATABASE_MAINTENANCE_INTERVAL: float = float(os.getenv('DATABASE_MAINTENANCE_INTERVAL', 60))
+    DATABASE_WAL_CHECKPOINT_THRESHOLD: int = int(os.getenv('DATABASE_WAL_CHECKPOINT_THRESHOLD', 4 * 1024 * 1024))
+    DATABASE_OPTIMIZE_INTERVAL: float = float(os.getenv('DATABASE_OPTIMIZE_INTERVAL', 3600))
+    DATABASE_VACUUM_IDLE_SECONDS: float = float(os.getenv('DATABASE_VACUUM_IDLE_SECONDS', 300))
+    DATABASE_VACUUM_PAGES: int = int(os.getenv('DATABASE_VACUUM_PAGES', 200))
+    
+    # SQL语句跟踪：开启后记录每条语句的耗时、返回行数和所属路由，超过阈值（毫秒）的语句写入慢查询日志
+    DATABASE_TRACE_ENABLED: bool = os.getenv('DATABASE_TRACE_ENABLED', 'False').lower() == 'true'
+    DATABASE_SLOW_QUERY_MS: float = float(os.getenv('DATABASE_SLOW_QUERY_MS', 100))
+    DATABASE_SLOW_QUERY_LOG_SIZE: int = int(os.getenv('DATABASE_SLOW_QUERY_LOG_SIZE', 100))
+    
+    # 请求截止时间（秒，0表示不限制）：超时后中断正在执行的数据库操作并返回503，公共API从严、管理接口从宽
+    REQUEST_DEADLINE_API: float = float(os.getenv('REQUEST_DEADLINE_API', 3))
+    REQUEST_DEADLINE_ADMIN: float = float(os.getenv('REQUEST_DEADLINE_ADMIN', 30))
+    
+    # 密码哈希线程池：工作线程数、允许排队的任务数、等待结果的最长秒数，超出时登录直接返回503
+    PASSWORD_HASH_WORKERS: int = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE_SIZE: int = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 8))
+    PASSWORD_HASH_TIMEOUT: float = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+    
+    # bcrypt成本因子：BCRYPT_ROUNDS为0时启动后在本机校准，选出单次哈希不超过TARGET_MS毫秒的最大值（MIN到MAX之间）
+    BCRYPT_ROUNDS: int = int(os.getenv('BCRYPT_ROUNDS', 0))
+    BCRYPT_TARGET_MS: float = float(os.getenv('BCRYPT_TARGET_MS', 250))
+    BCRYPT_MIN_ROUNDS: int = int(os.getenv('BCRYPT_MIN_ROUNDS', 10))
+    BCRYPT_MAX_ROUNDS: int = int(os.getenv('BCRYPT_MAX_ROUNDS', 15))
+    # 自动校准时已有哈希的成本因子与校准值相差不超过该值则不重新哈希（各worker的校准结果可能相差1）
+    BCRYPT_REHASH_TOLERANCE: int = int(os.getenv('BCRYPT_REHASH_TOLERANCE', 1))
+    
+    # 管理员用户缓存：Flask-Login加载用户时使用，条目过期秒数（0表示不缓存）与最大条目数
+    ADMIN_USER_CACHE_TTL: float = float(os.getenv('ADMIN_USER_CACHE_TTL', 60))
+    ADMIN_USER_CACHE_SIZE: int = int(os.getenv('ADMIN_USER_CACHE_SIZE', 128))
+    
+    # 内容缓存：开启后内容变更时先返回旧版本，并在后台刷新
+    CONTENT_CACHE_STALE_WHILE_REVALIDATE: bool = os.getenv('CONTENT_CACHE_STALE_WHILE_REVALIDATE', 'False').lower() == 'true'
+    
+    # 内容变更日志保留的最大条数，超出部分会被压缩
+    CONTENT_CHANGE_LOG_RETENTION: int = int(os.getenv('CONTENT_CHANGE_LOG_RETENTION', 1000))
+    
+    # 内容变更推送（SSE）配置：每个空闲连接都会占用一个请求线程，只有使用gevent等协程worker部署时才应开启
+    CONTENT_STREAM_ENABLED: bool = os.getenv('CONTENT_STREAM_ENABLED', 'False').lower() == 'true'
+    CONTENT_STREAM_MAX_CLIENTS: int = int(os.getenv('CONTENT_STREAM_MAX_CLIENTS', 100))
+    CONTENT_STREAM_HEARTBEAT: int = int(os.getenv('CONTENT_STREAM_HEARTBEAT', 15))  # 秒
+    
+    # 静态内容导出目录，设置后每次管理员写入都会重新导出（供nginx/CDN直接提供）
+    CONTENT_EXPORT_DIR: str = os.getenv('CONTENT_EXPORT_DIR', '')
     
     # 文件上传配置
     UPLOAD_FOLDER: str = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'static', 'uploads'))
@@ -34,7 +94,7 @@ class Config:
     }
     ALLOWED_VIDEO_MIMES = {
         'video/mp4', 'video/avi', 'video/quicktime',
-        'video/x-msvideo', 'video/x-flv', 'video/webm'
+        'video/x-msvideo', 'video/x-flv', 'video/webm', 'video/x-ms-wmv'
     }
 
 # 创建配置实例
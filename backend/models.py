@@ -3,146 +3,393 @@
 """
 import sqlite3
 import os
+import re
+from collections import namedtuple
 from datetime import datetime
 from flask_login import UserMixin
 from config import config
-from security import PasswordManager
+from services.content_cache import notify_content_changed
+from services.database import get_db_connection, get_read_connection, execute_write, on_commit, get_db_pool, get_db_writer
+from services.password_hashing import PasswordHashingBusy, get_password_hashing
+from services.user_cache import get_user_cache
 
 def init_database(db_path=None):
     """初始化数据库和表结构"""
-    if db_path is None:
-        db_path = config.DATABASE_PATH
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # 创建text_content表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS text_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            element_key TEXT UNIQUE NOT NULL,
-            content TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 创建image_content表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS image_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            image_key TEXT UNIQUE NOT NULL,
-            file_path TEXT NOT NULL,
-            original_filename TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 创建video_content表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS video_content (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            video_key TEXT UNIQUE NOT NULL,
-            file_path TEXT NOT NULL,
-            original_filename TEXT,
-            title TEXT,
-            description TEXT,
-            duration INTEGER,
-            file_size INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 创建管理员表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS admin_users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-def get_db_connection(db_path=None):
-    """获取数据库连接"""
-    try:
-        if db_path is None:
-            db_path = config.DATABASE_PATH
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # 使查询结果可以像字典一样访问
-        return conn
-    except sqlite3.Error as e:
-        raise Exception(f"数据库连接失败: {str(e)}")
+    with get_db_connection(db_path) as conn:
+        cursor = conn.cursor()
+        
+        # 创建text_content表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS text_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                element_key TEXT UNIQUE NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建image_content表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                image_key TEXT UNIQUE NOT NULL,
+                file_path TEXT NOT NULL,
+                original_filename TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建video_content表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS video_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                video_key TEXT UNIQUE NOT NULL,
+                file_path TEXT NOT NULL,
+                original_filename TEXT,
+                title TEXT,
+                description TEXT,
+                duration INTEGER,
+                file_size INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建内容变更日志表，version单调递增，用于增量同步
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS content_changes (
+                version INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_type TEXT NOT NULL,
+                content_key TEXT NOT NULL,
+                action TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建管理员表
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin_users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # 创建上传文件表：文件按内容的SHA-256保存，ref_count为引用该文件的图片和视频记录数
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                sha256 TEXT PRIMARY KEY,
+                file_path TEXT UNIQUE NOT NULL,
+                mime_type TEXT,
+                size INTEGER,
+                ref_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_upload_blobs_unreferenced
+            ON upload_blobs (ref_count) WHERE ref_count <= 0
+        ''')
+        
+        # 引用计数由触发器维护，所有写入路径（包括批量更新）都不需要单独处理
+        for table in ('image_content', 'video_content'):
+            cursor.executescript(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_insert AFTER INSERT ON {table} BEGIN
+                    UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE file_path = NEW.file_path;
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_update AFTER UPDATE OF file_path ON {table}
+                WHEN OLD.file_path IS NOT NEW.file_path BEGIN
+                    UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE file_path = OLD.file_path;
+                    UPDATE upload_blobs SET ref_count = ref_count + 1 WHERE file_path = NEW.file_path;
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_blob_delete AFTER DELETE ON {table} BEGIN
+                    UPDATE upload_blobs SET ref_count = ref_count - 1 WHERE file_path = OLD.file_path;
+                END;
+            ''')
+        
+        conn.commit()
 
 def insert_default_content():
     """插入默认内容数据"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 默认文本内容
-    default_texts = [
-        ('main_title', '智护童行'),
-        ('main_subtitle', '专业的家庭照护教育平台'),
-        ('main_description', '从自我评估到专业学习，我们为您提供一站式家庭照护解决方案'),
-        ('halls_title', '探索五大核心功能展馆'),
-        ('halls_description', '从自我评估到专业学习，我们为您提供一站式家庭照护解决方案。'),
-        ('assessment_title', '自我评估'),
-        ('assessment_description', '了解您当前的照护知识水平'),
-        ('knowledge_title', '知识学习'),
-        ('knowledge_description', '系统学习专业照护知识'),
-        ('experience_title', '体验互动'),
-        ('experience_description', '通过游戏化学习提升技能'),
-        ('support_title', '成长对策室'),
-        ('support_description', '测评反馈、个性化干预、成长奖励'),
-        ('archive_title', '个人档案'),
-        ('archive_description', '记录您的学习历程'),
-        ('wechat_info', '微信号: zhihutongxing')
-    ]
-    
-    # 默认图片内容
-    default_images = [
-        ('hero_banner', '/static/uploads/hero-banner.jpg'),
-        ('assessment_icon', '/static/uploads/assessment-icon.svg'),
-        ('knowledge_icon', '/static/uploads/knowledge-icon.svg'),
-        ('experience_icon', '/static/uploads/experience-icon.svg'),
-        ('support_icon', '/static/uploads/support-icon.svg'),
-        ('archive_icon', '/static/uploads/archive-icon.svg')
-    ]
-    
-    # 默认视频内容
-    default_videos = [
-        ('newborn_care_intro', '/static/uploads/newborn-care-intro.mp4', '新生儿护理基础介绍', '学习新生儿护理的基本知识和技能'),
-        ('feeding_techniques', '/static/uploads/feeding-techniques.mp4', '婴幼儿喂养技巧', '掌握科学的婴幼儿喂养方法'),
-        ('safety_tips', '/static/uploads/safety-tips.mp4', '儿童安全防护要点', '了解家庭环境中的安全防护措施')
-    ]
-    
-    # 插入文本内容（如果不存在）
-    for element_key, content in default_texts:
-        cursor.execute('''
-            INSERT OR IGNORE INTO text_content (element_key, content)
-            VALUES (?, ?)
-        ''', (element_key, content))
+    def write(conn):
+        cursor = conn.cursor()
+        version = None
+        
+        # 默认文本内容
+        default_texts = [
+            ('main_title', '智护童行'),
+            ('main_subtitle', '专业的家庭照护教育平台'),
+            ('main_description', '从自我评估到专业学习，我们为您提供一站式家庭照护解决方案'),
+            ('halls_title', '探索五大核心功能展馆'),
+            ('halls_description', '从自我评估到专业学习，我们为您提供一站式家庭照护解决方案。'),
+            ('assessment_title', '自我评估'),
+            ('assessment_description', '了解您当前的照护知识水平'),
+            ('knowledge_title', '知识学习'),
+            ('knowledge_description', '系统学习专业照护知识'),
+            ('experience_title', '体验互动'),
+            ('experience_description', '通过游戏化学习提升技能'),
+            ('support_title', '成长对策室'),
+            ('support_description', '测评反馈、个性化干预、成长奖励'),
+            ('archive_title', '个人档案'),
+            ('archive_description', '记录您的学习历程'),
+            ('wechat_info', '微信号: zhihutongxing')
+        ]
+        
+        # 默认图片内容
+        default_images = [
+            ('hero_banner', '/static/uploads/hero-banner.jpg'),
+            ('assessment_icon', '/static/uploads/assessment-icon.svg'),
+            ('knowledge_icon', '/static/uploads/knowledge-icon.svg'),
+            ('experience_icon', '/static/uploads/experience-icon.svg'),
+            ('support_icon', '/static/uploads/support-icon.svg'),
+            ('archive_icon', '/static/uploads/archive-icon.svg')
+        ]
+        
+        # 默认视频内容
+        default_videos = [
+            ('newborn_care_intro', '/static/uploads/newborn-care-intro.mp4', '新生儿护理基础介绍', '学习新生儿护理的基本知识和技能'),
+            ('feeding_techniques', '/static/uploads/feeding-techniques.mp4', '婴幼儿喂养技巧', '掌握科学的婴幼儿喂养方法'),
+            ('safety_tips', '/static/uploads/safety-tips.mp4', '儿童安全防护要点', '了解家庭环境中的安全防护措施')
+        ]
+        
+        # 插入文本内容（如果不存在）
+        for element_key, content in default_texts:
+            cursor.execute('''
+                INSERT OR IGNORE INTO text_content (element_key, content)
+                VALUES (?, ?)
+            ''', (element_key, content))
+            if cursor.rowcount > 0:
+                version = _record_change(conn, 'texts', element_key, 'upsert')
+        
+        # 插入图片内容（如果不存在）
+        for image_key, file_path in default_images:
+            cursor.execute('''
+                INSERT OR IGNORE INTO image_content (image_key, file_path, original_filename)
+                VALUES (?, ?, ?)
+            ''', (image_key, file_path, f'{image_key}.jpg'))
+            if cursor.rowcount > 0:
+                version = _record_change(conn, 'images', image_key, 'upsert')
+        
+        # 插入视频内容（如果不存在）
+        for video_key, file_path, title, description in default_videos:
+            cursor.execute('''
+                INSERT OR IGNORE INTO video_content (video_key, file_path, title, description, original_filename)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (video_key, file_path, title, description, f'{video_key}.mp4'))
+            if cursor.rowcount > 0:
+                version = _record_change(conn, 'videos', video_key, 'upsert')
+        return version
     
-    # 插入图片内容（如果不存在）
-    for image_key, file_path in default_images:
-        cursor.execute('''
-            INSERT OR IGNORE INTO image_content (image_key, file_path, original_filename)
-            VALUES (?, ?, ?)
-        ''', (image_key, file_path, f'{image_key}.jpg'))
+    _notify_after_commit(execute_write(write))
+
+# 内容读取结果：content为内容数据，last_updated为最新的修改时间，version为变更日志版本号
+ContentResult = namedtuple('ContentResult', ['content', 'last_updated', 'version'])
+
+# 变更日志中内容类型与数据表、键列的对应关系
+CONTENT_TABLES = {
+    'texts': ('text_content', 'element_key'),
+    'images': ('image_content', 'image_key'),
+    'videos': ('video_content', 'video_key')
+}
+
+def _record_change(conn, content_type, content_key, action):
+    """在当前事务中写入一条内容变更日志，并压缩超出保留数量的旧记录"""
+    return _record_changes(conn, content_type, [content_key], action)
+
+def _record_changes(conn, content_type, content_keys, action):
+    """在当前事务中批量写入内容变更日志，返回最后一条记录的版本号"""
+    conn.executemany('''
+        INSERT INTO content_changes (content_type, content_key, action)
+        VALUES (?, ?, ?)
+    ''', [(content_type, content_key, action) for content_key in content_keys])
+    version = _current_version(conn)
+    conn.execute(
+        'DELETE FROM content_changes WHERE version <= ?',
+        (version - config.CONTENT_CHANGE_LOG_RETENTION,)
+    )
+    return version
+
+def _collect_unreferenced_uploads(conn):
+    """在当前事务中删除不再被引用的上传文件记录，返回这些记录的文件路径
     
-    # 插入视频内容（如果不存在）
-    for video_key, file_path, title, description in default_videos:
-        cursor.execute('''
-            INSERT OR IGNORE INTO video_content (video_key, file_path, title, description, original_filename)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (video_key, file_path, title, description, f'{video_key}.mp4'))
+    文件本身由_remove_unreferenced_uploads在事务提交后删除：事务回滚时记录和引用都会恢复，
+    文件必须仍然存在。
+    """
+    blobs = conn.execute('SELECT file_path FROM upload_blobs WHERE ref_count <= 0').fetchall()
+    if not blobs:
+        return []
+    conn.execute('DELETE FROM upload_blobs WHERE ref_count <= 0')
+    return [blob['file_path'] for blob in blobs]
+
+def _remove_unreferenced_uploads(file_paths):
+    """写入提交后删除已回收记录的上传文件
+    
+    删除时持有写锁，并确认期间没有重新保存同一文件的记录：UploadBlob.store同样在写锁下
+    保存文件并写入记录，提交与删除之间再次上传的相同内容不会被误删。
+    """
+    if not file_paths:
+        return
+    
+    def remove():
+        with get_db_writer().write_lock:
+            with get_read_connection() as conn:
+                for file_path in file_paths:
+                    if conn.execute('SELECT 1 FROM upload_blobs WHERE file_path = ?', (file_path,)).fetchone():
+                        continue
+                    try:
+                        os.remove(UploadBlob.local_path(file_path))
+                    except OSError:
+                        pass
+    
+    on_commit(remove)
+
+def _notify_after_commit(version):
+    """写入提交后使缓存失效并推送新版本；请求级会话中推迟到会话提交之后"""
+    on_commit(lambda: notify_content_changed(version))
+
+def _current_version(conn):
+    """获取当前内容版本号（变更日志中最大的version）"""
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM content_changes').fetchone()[0]
+
+def _to_public_content(texts, images, videos):
+    """将数据行转换为前端友好的映射格式"""
+    return {
+        'texts': {text['element_key']: text['content'] for text in texts},
+        'images': {image['image_key']: image['file_path'] for image in images},
+        'videos': {video['video_key']: {
+            'file_path': video['file_path'],
+            'title': video['title'],
+            'description': video['description'],
+            'duration': video['duration']
+        } for video in videos}
+    }
+
+def _current_change(conn):
+    """获取变更日志中最新的版本号和变更时间"""
+    return conn.execute('SELECT COALESCE(MAX(version), 0), MAX(changed_at) FROM content_changes').fetchone()
+
+def _last_updated(changed_at, *row_groups):
+    """获取多组数据行中最新的updated_at与变更日志中最新的changed_at
+    
+    删除的记录不会留下updated_at，合并变更日志的时间后删除内容也会使最后修改时间前移。
+    """
+    timestamps = [row['updated_at'] for rows in row_groups for row in rows if row['updated_at']]
+    if changed_at:
+        timestamps.append(changed_at)
+    return max(timestamps) if timestamps else None
+
+def _prefix_upper_bound(prefix):
+    """计算前缀范围查询的上界，使前缀匹配可以使用唯一键索引"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def get_all_content(public=False):
+    """在同一连接和事务中读取全部文本、图片和视频内容
+    
+    返回ContentResult：public为True时content为前端友好的映射格式，
+    否则为后台编辑使用的完整记录列表；last_updated为三张表中最新的updated_at
+    与变更日志中最新的changed_at。
+    """
+    with get_read_connection() as conn:
+        # 显式开启读事务，保证三张表读取的是同一个一致性快照
+        conn.execute('BEGIN')
+        texts = conn.execute('SELECT * FROM text_content ORDER BY element_key').fetchall()
+        images = conn.execute('SELECT * FROM image_content ORDER BY image_key').fetchall()
+        videos = conn.execute('SELECT * FROM video_content ORDER BY video_key').fetchall()
+        version, changed_at = _current_change(conn)
+        conn.commit()
+    
+    last_updated = _last_updated(changed_at, texts, images, videos)
+    
+    if not public:
+        return ContentResult({
+            'texts': [dict(text) for text in texts],
+            'images': [dict(image) for image in images],
+            'videos': [dict(video) for video in videos]
+        }, last_updated, version)
+    
+    return ContentResult(_to_public_content(texts, images, videos), last_updated, version)
+
+def get_content_subset(keys=None, prefix=None):
+    """按键列表或键前缀读取公开内容，返回ContentResult
+    
+    查询走element_key、image_key和video_key上的唯一索引，
+    工作量只与命中的键数量相关，而与表的总大小无关。
+    """
+    if keys:
+        placeholders = ','.join('?' for _ in keys)
+        params = tuple(keys)
+        conditions = {column: f'{column} IN ({placeholders})' for column in ('element_key', 'image_key', 'video_key')}
+    elif prefix:
+        params = (prefix, _prefix_upper_bound(prefix))
+        conditions = {column: f'{column} >= ? AND {column} < ?' for column in ('element_key', 'image_key', 'video_key')}
+    else:
+        raise ValueError("keys和prefix不能同时为空")
+    
+    with get_read_connection() as conn:
+        conn.execute('BEGIN')
+        texts = conn.execute(
+            f"SELECT * FROM text_content WHERE {conditions['element_key']} ORDER BY element_key", params
+        ).fetchall()
+        images = conn.execute(
+            f"SELECT * FROM image_content WHERE {conditions['image_key']} ORDER BY image_key", params
+        ).fetchall()
+        videos = conn.execute(
+            f"SELECT * FROM video_content WHERE {conditions['video_key']} ORDER BY video_key", params
+        ).fetchall()
+        version, changed_at = _current_change(conn)
+        conn.commit()
+    
+    return ContentResult(
+        _to_public_content(texts, images, videos), _last_updated(changed_at, texts, images, videos), version
+    )
+
+def get_content_changes(since):
+    """获取版本号since之后的内容变更
     
-    conn.commit()
-    conn.close()
+    返回 (version, changes, deleted)：changes为变更后的公开内容，deleted为各类型下被删除的键。
+    如果变更日志已被压缩到since之后（或since无效），changes为None，调用方应回退到全量快照。
+    """
+    with get_read_connection() as conn:
+        conn.execute('BEGIN')
+        oldest, version = conn.execute(
+            'SELECT MIN(version), COALESCE(MAX(version), 0) FROM content_changes'
+        ).fetchone()
+        
+        if since == version:
+            conn.commit()
+            return version, _to_public_content([], [], []), {content_type: [] for content_type in CONTENT_TABLES}
+        if oldest is None or since > version or since < oldest - 1:
+            conn.commit()
+            return version, None, None
+        
+        changed = {content_type: [] for content_type in CONTENT_TABLES}
+        for content_type, content_key in conn.execute(
+            'SELECT DISTINCT content_type, content_key FROM content_changes WHERE version > ?',
+            (since,)
+        ).fetchall():
+            if content_type in changed:
+                changed[content_type].append(content_key)
+        
+        rows = {}
+        for content_type, (table, key_column) in CONTENT_TABLES.items():
+            keys = changed[content_type]
+            rows[content_type] = conn.execute(
+                f"SELECT * FROM {table} WHERE {key_column} IN ({','.join('?' for _ in keys)}) ORDER BY {key_column}",
+                keys
+            ).fetchall() if keys else []
+        conn.commit()
+    
+    changes = _to_public_content(rows['texts'], rows['images'], rows['videos'])
+    
+    # 变更日志中出现但当前已不存在的键视为已删除
+    deleted = {
+        content_type: sorted(set(keys) - set(changes[content_type]))
+        for content_type, keys in changed.items()
+    }
+    return version, changes, deleted
 
 class TextContent:
     """文本内容模型"""
@@ -150,43 +397,44 @@ class TextContent:
     @staticmethod
     def get_all():
         """获取所有文本内容"""
-        conn = get_db_connection()
-        texts = conn.execute('SELECT * FROM text_content ORDER BY element_key').fetchall()
-        conn.close()
+        with get_read_connection() as conn:
+            texts = conn.execute('SELECT * FROM text_content ORDER BY element_key').fetchall()
         return [dict(text) for text in texts]
     
     @staticmethod
     def get_by_key(element_key):
         """根据element_key获取文本内容"""
-        conn = get_db_connection()
-        text = conn.execute(
-            'SELECT * FROM text_content WHERE element_key = ?', 
-            (element_key,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection() as conn:
+            text = conn.execute(
+                'SELECT * FROM text_content WHERE element_key = ?', 
+                (element_key,)
+            ).fetchone()
         return dict(text) if text else None
     
     @staticmethod
     def update(element_key, content):
-        """更新文本内容"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE text_content 
-            SET content = ?, updated_at = CURRENT_TIMESTAMP 
-            WHERE element_key = ?
-        ''', (content, element_key))
+        """更新文本内容（不存在时插入）"""
+        TextContent.update_many([(element_key, content)])
+        return True
+    
+    @staticmethod
+    def update_many(items):
+        """批量更新文本内容，items为(element_key, content)列表
         
-        # 如果记录不存在，则插入新记录
-        if cursor.rowcount == 0:
-            cursor.execute('''
+        所有条目在同一个事务中以UPSERT写入，只使缓存失效并推送一次变更，返回新的内容版本号。
+        """
+        def write(conn):
+            conn.executemany('''
                 INSERT INTO text_content (element_key, content)
                 VALUES (?, ?)
-            ''', (element_key, content))
+                ON CONFLICT(element_key) DO UPDATE SET
+                    content = excluded.content, updated_at = CURRENT_TIMESTAMP
+            ''', items)
+            return _record_changes(conn, 'texts', [item[0] for item in items], 'upsert')
         
-        conn.commit()
-        conn.close()
-        return cursor.rowcount > 0
+        version = execute_write(write)
+        _notify_after_commit(version)
+        return version
 
 class ImageContent:
     """图片内容模型"""
@@ -194,43 +442,44 @@ class ImageContent:
     @staticmethod
     def get_all():
         """获取所有图片内容"""
-        conn = get_db_connection()
-        images = conn.execute('SELECT * FROM image_content ORDER BY image_key').fetchall()
-        conn.close()
+        with get_read_connection() as conn:
+            images = conn.execute('SELECT * FROM image_content ORDER BY image_key').fetchall()
         return [dict(image) for image in images]
     
     @staticmethod
     def get_by_key(image_key):
         """根据image_key获取图片内容"""
-        conn = get_db_connection()
-        image = conn.execute(
-            'SELECT * FROM image_content WHERE image_key = ?', 
-            (image_key,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection() as conn:
+            image = conn.execute(
+                'SELECT * FROM image_content WHERE image_key = ?', 
+                (image_key,)
+            ).fetchone()
         return dict(image) if image else None
     
     @staticmethod
     def update(image_key, file_path, original_filename=None):
-        """更新图片内容"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE image_content 
-            SET file_path = ?, original_filename = ?, updated_at = CURRENT_TIMESTAMP 
-            WHERE image_key = ?
-        ''', (file_path, original_filename, image_key))
-        
-        # 如果记录不存在，则插入新记录
-        if cursor.rowcount == 0:
-            cursor.execute('''
+        """更新图片内容（不存在时插入）"""
+        ImageContent.update_many([(image_key, file_path, original_filename)])
+        return True
+    
+    @staticmethod
+    def update_many(items):
+        """批量更新图片内容，items为(image_key, file_path, original_filename)列表，返回新的内容版本号"""
+        def write(conn):
+            conn.executemany('''
                 INSERT INTO image_content (image_key, file_path, original_filename)
                 VALUES (?, ?, ?)
-            ''', (image_key, file_path, original_filename))
+                ON CONFLICT(image_key) DO UPDATE SET
+                    file_path = excluded.file_path, original_filename = excluded.original_filename,
+                    updated_at = CURRENT_TIMESTAMP
+            ''', items)
+            removed = _collect_unreferenced_uploads(conn)
+            return _record_changes(conn, 'images', [item[0] for item in items], 'upsert'), removed
         
-        conn.commit()
-        conn.close()
-        return cursor.rowcount > 0
+        version, removed = execute_write(write)
+        _remove_unreferenced_uploads(removed)
+        _notify_after_commit(version)
+        return version
 
 class VideoContent:
     """视频内容模型"""
@@ -238,54 +487,166 @@ class VideoContent:
     @staticmethod
     def get_all():
         """获取所有视频内容"""
-        conn = get_db_connection()
-        videos = conn.execute('SELECT * FROM video_content ORDER BY video_key').fetchall()
-        conn.close()
+        with get_read_connection() as conn:
+            videos = conn.execute('SELECT * FROM video_content ORDER BY video_key').fetchall()
         return [dict(video) for video in videos]
     
     @staticmethod
     def get_by_key(video_key):
         """根据video_key获取视频内容"""
-        conn = get_db_connection()
-        video = conn.execute(
-            'SELECT * FROM video_content WHERE video_key = ?', 
-            (video_key,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection() as conn:
+            video = conn.execute(
+                'SELECT * FROM video_content WHERE video_key = ?', 
+                (video_key,)
+            ).fetchone()
         return dict(video) if video else None
     
     @staticmethod
     def update(video_key, file_path, original_filename=None, title=None, description=None, duration=None, file_size=None):
-        """更新视频内容"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE video_content 
-            SET file_path = ?, original_filename = ?, title = ?, description = ?, 
-                duration = ?, file_size = ?, updated_at = CURRENT_TIMESTAMP 
-            WHERE video_key = ?
-        ''', (file_path, original_filename, title, description, duration, file_size, video_key))
-        
-        # 如果记录不存在，则插入新记录
-        if cursor.rowcount == 0:
-            cursor.execute('''
+        """更新视频内容（不存在时插入）"""
+        def write(conn):
+            conn.execute('''
                 INSERT INTO video_content (video_key, file_path, original_filename, title, description, duration, file_size)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_key) DO UPDATE SET
+                    file_path = excluded.file_path, original_filename = excluded.original_filename,
+                    title = excluded.title, description = excluded.description,
+                    duration = excluded.duration, file_size = excluded.file_size,
+                    updated_at = CURRENT_TIMESTAMP
             ''', (video_key, file_path, original_filename, title, description, duration, file_size))
+            removed = _collect_unreferenced_uploads(conn)
+            return _record_change(conn, 'videos', video_key, 'upsert'), removed
         
-        conn.commit()
-        conn.close()
-        return cursor.rowcount > 0
+        version, removed = execute_write(write)
+        _remove_unreferenced_uploads(removed)
+        _notify_after_commit(version)
+        return True
+    
+    @staticmethod
+    def update_metadata_many(items):
+        """批量更新视频元数据，items为包含video_key及title、description、duration、file_path中任意字段的字典列表
+        
+        未提供的字段保持不变；提供了file_path的条目在视频不存在时会新建记录，
+        没有file_path且视频不存在时抛出KeyError，整批写入回滚。返回新的内容版本号。
+        """
+        fields = ('file_path', 'title', 'description', 'duration')
+        
+        def write(conn):
+            for item in items:
+                values = tuple(item.get(field) for field in fields)
+                if item.get('file_path'):
+                    conn.execute('''
+                        INSERT INTO video_content (video_key, file_path, title, description, duration)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT(video_key) DO UPDATE SET
+                            file_path = excluded.file_path,
+                            title = COALESCE(excluded.title, title),
+                            description = COALESCE(excluded.description, description),
+                            duration = COALESCE(excluded.duration, duration),
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', (item['video_key'],) + values)
+                else:
+                    cursor = conn.execute('''
+                        UPDATE video_content SET
+                            title = COALESCE(?, title),
+                            description = COALESCE(?, description),
+                            duration = COALESCE(?, duration),
+                            updated_at = CURRENT_TIMESTAMP
+                        WHERE video_key = ?
+                    ''', values[1:] + (item['video_key'],))
+                    if cursor.rowcount == 0:
+                        raise KeyError(item['video_key'])
+            removed = _collect_unreferenced_uploads(conn)
+            return _record_changes(conn, 'videos', [item['video_key'] for item in items], 'upsert'), removed
+        
+        version, removed = execute_write(write)
+        _remove_unreferenced_uploads(removed)
+        _notify_after_commit(version)
+        return version
     
     @staticmethod
     def delete(video_key):
-        """删除视频内容"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM video_content WHERE video_key = ?', (video_key,))
-        conn.commit()
-        conn.close()
-        return cursor.rowcount > 0
+        """删除视频内容，返回被删除的记录；视频不存在时返回None"""
+        def write(conn):
+            # 读取和删除在同一个事务中完成
+            video = conn.execute('SELECT * FROM video_content WHERE video_key = ?', (video_key,)).fetchone()
+            if video is None:
+                return None, None, []
+            conn.execute('DELETE FROM video_content WHERE video_key = ?', (video_key,))
+            removed = _collect_unreferenced_uploads(conn)
+            return dict(video), _record_change(conn, 'videos', video_key, 'delete'), removed
+        
+        video, version, removed = execute_write(write)
+        if video is not None:
+            _remove_unreferenced_uploads(removed)
+            _notify_after_commit(version)
+        return video
+
+class UploadBlob:
+    """按内容（SHA-256）保存的上传文件，内容相同的文件只保存一份"""
+    
+    # 按内容保存的文件名：64位十六进制SHA-256加扩展名
+    FILENAME_PATTERN = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]+)?$')
+    
+    @staticmethod
+    def local_path(file_path):
+        """文件记录中的URL路径对应的本地文件路径"""
+        return os.path.join(config.UPLOAD_FOLDER, os.path.basename(file_path))
+    
+    @staticmethod
+    def is_blob_path(file_path):
+        """路径是否指向按内容保存的文件（此类文件由引用计数管理，不能直接删除）"""
+        return bool(file_path) and UploadBlob.FILENAME_PATTERN.match(os.path.basename(file_path)) is not None
+    
+    @staticmethod
+    def get(sha256):
+        """查询已保存的文件，记录不存在或文件已丢失时返回None"""
+        with get_read_connection() as conn:
+            blob = conn.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        if blob is None or not os.path.exists(UploadBlob.local_path(blob['file_path'])):
+            return None
+        return dict(blob)
+    
+    @staticmethod
+    def get_for_update(sha256):
+        """在写事务中查询已保存的文件
+        
+        在请求级会话中调用时，会话持有写锁直到提交，文件在随后的引用写入之前不会被回收。
+        """
+        def write(conn):
+            blob = conn.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            if blob is None or not os.path.exists(UploadBlob.local_path(blob['file_path'])):
+                return None
+            return dict(blob)
+        
+        return execute_write(write)
+    
+    @staticmethod
+    def store(upload, original_filename):
+        """保存通过校验的上传文件（UploadIngestStream），返回(文件记录, 是否已存在相同内容)
+        
+        已保存过相同内容时不再写入文件，接收时的临时文件在请求结束时删除。
+        新文件的引用计数为0，需要在同一会话中写入引用它的图片或视频记录，否则会被回收。
+        """
+        sha256 = upload.hexdigest()
+        extension = os.path.splitext(original_filename)[1].lower()
+        
+        def write(conn):
+            blob = conn.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            file_path = blob['file_path'] if blob else f"/static/uploads/{sha256}{extension}"
+            local_path = UploadBlob.local_path(file_path)
+            existed = blob is not None and os.path.exists(local_path)
+            if not existed:
+                upload.save(local_path)
+            if blob is None:
+                conn.execute(
+                    'INSERT INTO upload_blobs (sha256, file_path, mime_type, size) VALUES (?, ?, ?, ?)',
+                    (sha256, file_path, upload.mime_type, upload.size)
+                )
+                blob = conn.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            return dict(blob), existed
+        
+        return execute_write(write)
 
 class AdminUser(UserMixin):
     """管理员用户模型 - 兼容 Flask-Login"""
@@ -316,26 +677,64 @@ class AdminUser(UserMixin):
     @staticmethod
     def get_by_id(user_id, db_path=None):
         """根据用户ID获取用户对象"""
-        conn = get_db_connection(db_path)
-        user = conn.execute(
-            'SELECT * FROM admin_users WHERE id = ?',
-            (user_id,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection(db_path) as conn:
+            user = conn.execute(
+                'SELECT * FROM admin_users WHERE id = ?',
+                (user_id,)
+            ).fetchone()
         
         if user:
             return AdminUser(user['id'], user['username'])
         return None
     
+    @staticmethod
+    def get_cached(user_id, db_path=None):
+        """根据用户ID获取用户对象，优先使用缓存（Flask-Login的user_loader使用）"""
+        database_path = get_db_pool(db_path, read_only=True).database_path
+        return get_user_cache().get_or_load(database_path, user_id, lambda: AdminUser.get_by_id(user_id, db_path))
+    
+    @staticmethod
+    def _invalidate_cached(user_id, db_path=None):
+        """提交后使该用户的缓存失效"""
+        database_path = get_db_pool(db_path, read_only=True).database_path
+        on_commit(lambda: get_user_cache().invalidate(database_path, user_id), db_path)
+    
+    @staticmethod
+    def update_password(user_id, password, db_path=None):
+        """修改管理员密码，返回是否找到该用户"""
+        password_hash = get_password_hashing().hash_password(password)
+        
+        def write(conn):
+            cursor = conn.execute(
+                'UPDATE admin_users SET password_hash = ? WHERE id = ?',
+                (password_hash, user_id)
+            )
+            return cursor.rowcount > 0
+        
+        updated = execute_write(write, db_path)
+        if updated:
+            AdminUser._invalidate_cached(user_id, db_path)
+        return updated
+    
+    @staticmethod
+    def delete(user_id, db_path=None):
+        """删除管理员，返回是否找到该用户；已登录的会话在下一次请求时失效"""
+        deleted = execute_write(
+            lambda conn: conn.execute('DELETE FROM admin_users WHERE id = ?', (user_id,)).rowcount > 0,
+            db_path
+        )
+        if deleted:
+            AdminUser._invalidate_cached(user_id, db_path)
+        return deleted
+    
     @staticmethod
     def get_by_username(username, db_path=None):
         """根据用户名获取用户对象"""
-        conn = get_db_connection(db_path)
-        user = conn.execute(
-            'SELECT * FROM admin_users WHERE username = ?',
-            (username,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection(db_path) as conn:
+            user = conn.execute(
+                'SELECT * FROM admin_users WHERE username = ?',
+                (username,)
+            ).fetchone()
         
         if user:
             return AdminUser(user['id'], user['username'])
@@ -344,46 +743,76 @@ class AdminUser(UserMixin):
     @staticmethod
     def create_default_admin(db_path=None):
         """创建默认管理员账户"""
-        conn = get_db_connection(db_path)
-        cursor = conn.cursor()
-        
         # 检查是否已存在管理员
-        existing_admin = cursor.execute(
-            'SELECT COUNT(*) as count FROM admin_users WHERE username = ?',
-            ('admin',)
-        ).fetchone()
+        with get_read_connection(db_path) as conn:
+            existing_admin = conn.execute(
+                'SELECT COUNT(*) as count FROM admin_users WHERE username = ?',
+                ('admin',)
+            ).fetchone()
+        if existing_admin['count'] > 0:
+            return
         
-        if existing_admin['count'] == 0:
-            # 默认管理员：用户名admin，密码admin123
-            password_hash = PasswordManager.hash_password('admin123')
-            
-            cursor.execute('''
+        # 默认管理员：用户名admin，密码admin123
+        # 耗时的密码哈希在写入线程之外完成，避免阻塞其他写操作
+        password_hash = get_password_hashing().hash_password('admin123')
+        
+        def write(conn):
+            # 并发初始化时只有第一个写入生效
+            cursor = conn.execute('''
                 INSERT INTO admin_users (username, password_hash)
-                VALUES (?, ?)
-            ''', ('admin', password_hash))
-            
-            conn.commit()
-            print("默认管理员账户已创建: admin / admin123")
+                SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM admin_users WHERE username = ?)
+            ''', ('admin', password_hash, 'admin'))
+            return cursor.rowcount > 0
         
-        conn.close()
+        if execute_write(write, db_path):
+            print("默认管理员账户已创建: admin / admin123")
     
     @staticmethod
     def verify_login(username, password, db_path=None):
-        """验证管理员登录，返回用户对象"""
+        """验证管理员登录，返回用户对象
+        
+        bcrypt校验在密码哈希线程池中执行，线程池已满时抛出PasswordHashingBusy。
+        登录成功且已有哈希的成本因子超出当前成本因子的允许范围时，用本次的明文密码重新生成哈希。
+        """
         if not username or not password:
             return None
         
-        conn = get_db_connection(db_path)
-        user = conn.execute(
-            'SELECT * FROM admin_users WHERE username = ?',
-            (username,)
-        ).fetchone()
-        conn.close()
+        with get_read_connection(db_path) as conn:
+            user = conn.execute(
+                'SELECT * FROM admin_users WHERE username = ?',
+                (username,)
+            ).fetchone()
         
-        if user and PasswordManager.verify_password(password, user['password_hash']):
+        hashing = get_password_hashing()
+        if user and hashing.verify_password(password, user['password_hash']):
+            try:
+                needs_rehash = hashing.needs_rehash(user['password_hash'])
+            except PasswordHashingBusy:
+                # 尚未校准且线程池繁忙：密码已经验证通过，本次跳过重新哈希
+                needs_rehash = False
+            if needs_rehash:
+                AdminUser._rehash_password(user['id'], password, user['password_hash'], db_path)
             return AdminUser(user['id'], user['username'])
         
         return None
+    
+    @staticmethod
+    def _rehash_password(user_id, password, old_hash, db_path=None):
+        """按当前成本因子重新哈希密码；线程池繁忙时跳过，下次登录再试"""
+        try:
+            password_hash = get_password_hashing().hash_password(password)
+        except PasswordHashingBusy:
+            return False
+        
+        def write(conn):
+            # 只替换本次验证过的哈希，期间密码被修改时保留新密码
+            cursor = conn.execute(
+                'UPDATE admin_users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (password_hash, user_id, old_hash)
+            )
+            return cursor.rowcount > 0
+        
+        return execute_write(write, db_path)
 
 if __name__ == '__main__':
     # 初始化数据库
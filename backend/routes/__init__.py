@@ -1,11 +1,36 @@
 """
 路由模块初始化
 """
-from flask import Flask
+from flask import Flask, current_app, jsonify, request
 from flask_wtf.csrf import CSRFProtect
+from config import config
+from services.database import set_deadline, clear_deadline, deadline_expired
 from .api import api_bp
 from .admin import admin_bp
 
+# 各蓝图的请求截止时间对应的配置项
+DEADLINE_SETTINGS = {
+    api_bp.name: 'REQUEST_DEADLINE_API',
+    admin_bp.name: 'REQUEST_DEADLINE_ADMIN'
+}
+
+def _start_request_deadline():
+    """按请求所属蓝图设置截止时间，数据库层据此中断超时的查询和写操作"""
+    name = DEADLINE_SETTINGS.get(request.blueprint)
+    set_deadline(current_app.config.get(name, getattr(config, name)) if name else None)
+
+def _deadline_response(response):
+    """数据库操作因截止时间被中止时，统一返回503（视图可能已将异常转换为500）"""
+    if not deadline_expired():
+        return response
+    response = jsonify({'success': False, 'error': '请求处理超时，请稍后重试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def _clear_request_deadline(exc):
+    clear_deadline()
+
 def register_routes(app: Flask, csrf: CSRFProtect):
     """注册所有路由"""
     
@@ -16,4 +41,9 @@ def register_routes(app: Flask, csrf: CSRFProtect):
     app.register_blueprint(api_bp)
     app.register_blueprint(admin_bp)
     
+    # 请求截止时间；after_request逆序执行，503在数据库会话提交之前确定，超时的请求会回滚
+    app.before_request(_start_request_deadline)
+    app.after_request(_deadline_response)
+    app.teardown_request(_clear_request_deadline)
+    
     return app
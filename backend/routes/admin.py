@@ -1,18 +1,60 @@
 """
 管理员API路由模块
 """
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, g, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 import os
+import re
 from config import config
 from security import FileValidator, SecurityUtils
-from models import TextContent, ImageContent, VideoContent, AdminUser
+from models import TextContent, ImageContent, VideoContent, AdminUser, UploadBlob, get_all_content
+from routes.api import get_public_snapshot
+from services.content_cache import get_content_cache
+from services.content_events import get_content_events
+from services.database import get_db_pool, get_db_writer, get_db_session, get_db_maintenance
+from services.content_export import export_content_snapshot
+from services.query_trace import get_query_tracer
+from services.password_hashing import PasswordHashingBusy, get_password_hashing
+from services.user_cache import get_user_cache
+from services.uploads import upload_policy
 
 # 创建蓝图
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
 
+# 批量更新接口单次允许的最大条目数
+MAX_BULK_ITEMS = 500
+
+# 上传文件的SHA-256（64位小写十六进制）
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+
 # 注意：现在使用 Flask-Login 的 @login_required 装饰器替代自定义的 require_admin_login
 
+@admin_bp.before_request
+def remember_content_version():
+    """记录请求开始时的内容缓存版本，用于判断本次请求是否修改了内容"""
+    g.content_cache_version = get_content_cache().version
+
+def _export_if_changed():
+    """内容版本在本次请求中发生变化时重新导出静态内容快照"""
+    export_dir = current_app.config.get('CONTENT_EXPORT_DIR')
+    if export_dir and get_content_cache().version != g.get('content_cache_version'):
+        try:
+            export_content_snapshot(get_public_snapshot(allow_stale=False), export_dir)
+        except Exception as e:
+            # 导出失败不影响本次写入结果，静态文件会在下一次写入时重新生成
+            print(f"Content export error: {str(e)}")
+
+@admin_bp.after_request
+def export_content_after_write(response):
+    """内容发生变更后重新导出静态内容快照"""
+    db_session = g.get('db_session')
+    if db_session is not None and db_session.active:
+        # 数据库会话在本钩子之后才提交，导出推迟到提交之后
+        db_session.on_commit(_export_if_changed)
+    else:
+        _export_if_changed()
+    return response
+
 @admin_bp.route('/login', methods=['POST'])
 def admin_login():
     """管理员登录 - 使用 Flask-Login"""
@@ -50,6 +92,15 @@ def admin_login():
                 'error': '用户名或密码错误'
             }), 401
             
+    except PasswordHashingBusy:
+        # 登录请求过多时快速拒绝，不占用worker等待bcrypt计算
+        response = jsonify({
+            'success': False,
+            'error': '登录请求过多，请稍后重试'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
     except Exception as e:
         print(f"Login error: {str(e)}")  # 调试信息
         import traceback
@@ -121,77 +172,248 @@ def update_text():
             'error': '更新过程中发生错误'
         }), 500
 
+def _get_bulk_items():
+    """读取批量更新的条目列表，请求体可以是数组或{"items": [...]}，格式不正确时返回None"""
+    data = request.get_json(silent=True)
+    items = data.get('items') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items or len(items) > MAX_BULK_ITEMS:
+        return None
+    if not all(isinstance(item, dict) for item in items):
+        return None
+    return items
+
+def _invalid_bulk_request(message):
+    return jsonify({
+        'success': False,
+        'error': message
+    }), 400
+
+@admin_bp.route('/update_texts', methods=['POST'])
+@login_required
+def update_texts():
+    """批量更新文本内容，所有条目在一个事务中写入"""
+    try:
+        items = _get_bulk_items()
+        if items is None:
+            return _invalid_bulk_request(f'请提交1到{MAX_BULK_ITEMS}个条目')
+        
+        rows = []
+        for item in items:
+            element_key = item.get('element_key')
+            content = item.get('content')
+            if not isinstance(element_key, str) or not element_key or not isinstance(content, str):
+                return _invalid_bulk_request('每个条目都需要element_key和content')
+            rows.append((element_key, content))
+        
+        version = TextContent.update_many(rows)
+        return jsonify({
+            'success': True,
+            'message': '文本批量更新成功',
+            'updated': len(rows),
+            'version': version
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '更新过程中发生错误'
+        }), 500
+
+@admin_bp.route('/update_images', methods=['POST'])
+@login_required
+def update_images():
+    """批量更新图片路径，所有条目在一个事务中写入"""
+    try:
+        items = _get_bulk_items()
+        if items is None:
+            return _invalid_bulk_request(f'请提交1到{MAX_BULK_ITEMS}个条目')
+        
+        rows = []
+        for item in items:
+            image_key = item.get('image_key')
+            file_path = item.get('file_path')
+            original_filename = item.get('original_filename')
+            if not isinstance(image_key, str) or not image_key or not isinstance(file_path, str) or not file_path:
+                return _invalid_bulk_request('每个条目都需要image_key和file_path')
+            if original_filename is not None and not isinstance(original_filename, str):
+                return _invalid_bulk_request('original_filename必须是字符串')
+            rows.append((image_key, file_path, original_filename))
+        
+        version = ImageContent.update_many(rows)
+        return jsonify({
+            'success': True,
+            'message': '图片批量更新成功',
+            'updated': len(rows),
+            'version': version
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '更新过程中发生错误'
+        }), 500
+
+@admin_bp.route('/update_videos', methods=['POST'])
+@login_required
+def update_videos():
+    """批量更新视频元数据（标题、描述、时长、文件路径），所有条目在一个事务中写入"""
+    try:
+        items = _get_bulk_items()
+        if items is None:
+            return _invalid_bulk_request(f'请提交1到{MAX_BULK_ITEMS}个条目')
+        
+        rows = []
+        for item in items:
+            video_key = item.get('video_key')
+            if not isinstance(video_key, str) or not video_key:
+                return _invalid_bulk_request('每个条目都需要video_key')
+            for field in ('file_path', 'title', 'description'):
+                if item.get(field) is not None and not isinstance(item[field], str):
+                    return _invalid_bulk_request(f'{field}必须是字符串')
+            duration = item.get('duration')
+            if duration is not None and (not isinstance(duration, int) or isinstance(duration, bool) or duration < 0):
+                return _invalid_bulk_request('duration必须是非负整数')
+            rows.append({
+                'video_key': video_key,
+                'file_path': item.get('file_path'),
+                'title': item.get('title'),
+                'description': item.get('description'),
+                'duration': duration
+            })
+        
+        try:
+            version = VideoContent.update_metadata_many(rows)
+        except KeyError as e:
+            return jsonify({
+                'success': False,
+                'error': f'视频不存在: {e.args[0]}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'message': '视频批量更新成功',
+            'updated': len(rows),
+            'version': version
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '更新过程中发生错误'
+        }), 500
+
+def _store_upload(allowed_extensions, allowed_mimes, label, unsupported_message):
+    """保存本次请求上传的文件，或按表单中的sha256引用已保存的相同文件
+    
+    返回(上传结果, 错误响应)。需要在请求级会话中调用，保存文件与写入引用在同一事务中完成。
+    """
+    sha256 = request.form.get('sha256', '').lower()
+    if 'file' not in request.files and sha256:
+        # 客户端已通过预检确认文件已保存，不再上传文件内容
+        if not SHA256_PATTERN.fullmatch(sha256):
+            return None, (jsonify({
+                'success': False,
+                'error': 'sha256格式无效'
+            }), 400)
+        blob = UploadBlob.get_for_update(sha256)
+        if blob is None:
+            return None, (jsonify({
+                'success': False,
+                'stored': False,
+                'error': '文件尚未保存，请上传文件内容'
+            }), 404)
+        if blob['mime_type'] not in allowed_mimes:
+            return None, (jsonify({
+                'success': False,
+                'error': f'文件内容验证失败，可能不是有效的{label}文件'
+            }), 400)
+        original_filename = SecurityUtils.sanitize_filename(request.form.get('filename', ''))
+        return {'blob': blob, 'original_filename': original_filename or os.path.basename(blob['file_path']),
+                'deduplicated': True}, None
+    
+    # 检查是否有文件上传
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return None, (jsonify({
+            'success': False,
+            'error': '没有选择文件'
+        }), 400)
+    
+    if not FileValidator.validate_file_extension(file.filename, allowed_extensions):
+        return None, (jsonify({
+            'success': False,
+            'error': unsupported_message
+        }), 400)
+    
+    # 文件内容在接收请求体时已按文件头校验，未通过的文件没有写入磁盘
+    if not file.stream.accepted:
+        return None, (jsonify({
+            'success': False,
+            'error': f'文件内容验证失败，可能不是有效的{label}文件'
+        }), 400)
+    
+    # 按内容哈希保存，已保存过相同内容时直接复用
+    original_filename = SecurityUtils.sanitize_filename(file.filename)
+    blob, existed = UploadBlob.store(file.stream, original_filename)
+    return {'blob': blob, 'original_filename': original_filename, 'deduplicated': existed}, None
+
+@admin_bp.route('/upload_preflight', methods=['POST'])
+@login_required
+def upload_preflight():
+    """上传前按SHA-256查询文件是否已保存，已保存时上传接口只需提交sha256"""
+    data = request.get_json(silent=True) or {}
+    sha256 = str(data.get('sha256', '')).lower()
+    if not SHA256_PATTERN.fullmatch(sha256):
+        return jsonify({
+            'success': False,
+            'error': 'sha256格式无效'
+        }), 400
+    
+    try:
+        blob = UploadBlob.get(sha256)
+        return jsonify({
+            'success': True,
+            'stored': blob is not None,
+            'file_path': blob['file_path'] if blob else None,
+            'size': blob['size'] if blob else None
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '查询文件失败'
+        }), 500
+
 @admin_bp.route('/upload_image', methods=['POST'])
+@upload_policy(config.ALLOWED_IMAGE_MIMES)
 @login_required
 def upload_image():
-    """上传图片"""
+    """上传图片（上传文件内容，或通过sha256引用已保存的文件）"""
     # Flask-Login 已经处理了登录检查
     
     try:
-        # 检查是否有文件上传
-        if 'file' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': '没有选择文件'
-            }), 400
-        
-        file = request.files['file']
         image_key = request.form.get('image_key')
-        
         if not image_key:
             return jsonify({
                 'success': False,
                 'error': 'image_key不能为空'
             }), 400
         
-        if file.filename == '':
-            return jsonify({
-                'success': False,
-                'error': '没有选择文件'
-            }), 400
+        # 在请求级会话中保存文件并更新数据库，两者一起提交
+        get_db_session()
+        upload, error = _store_upload(config.ALLOWED_EXTENSIONS, config.ALLOWED_IMAGE_MIMES, '图片', '不支持的文件格式')
+        if error:
+            return error
         
-        if file and FileValidator.validate_file_extension(file.filename, config.ALLOWED_EXTENSIONS):
-            # 生成安全的文件名
-            original_filename = SecurityUtils.sanitize_filename(file.filename)
-            new_filename = SecurityUtils.generate_secure_filename(original_filename)
-            
-            # 确保上传目录存在
-            os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
-            
-            # 保存文件
-            file_path = os.path.join(config.UPLOAD_FOLDER, new_filename)
-            file.save(file_path)
-            
-            # 验证文件内容
-            if not FileValidator.validate_image_file(original_filename, file_path):
-                os.remove(file_path)  # 删除无效文件
-                return jsonify({
-                    'success': False,
-                    'error': '文件内容验证失败，可能不是有效的图片文件'
-                }), 400
-            
-            # 更新数据库
-            relative_path = f"/static/uploads/{new_filename}"
-            success = ImageContent.update(image_key, relative_path, original_filename)
-            
-            if success:
-                return jsonify({
-                    'success': True,
-                    'message': '图片上传成功',
-                    'file_path': relative_path
-                })
-            else:
-                # 如果数据库更新失败，删除已上传的文件
-                os.remove(file_path)
-                return jsonify({
-                    'success': False,
-                    'error': '数据库更新失败'
-                }), 500
-        else:
-            return jsonify({
-                'success': False,
-                'error': '不支持的文件格式'
-            }), 400
+        relative_path = upload['blob']['file_path']
+        ImageContent.update(image_key, relative_path, upload['original_filename'])
+        
+        return jsonify({
+            'success': True,
+            'message': '图片上传成功',
+            'file_path': relative_path,
+            'sha256': upload['blob']['sha256'],
+            'deduplicated': upload['deduplicated']
+        })
             
     except Exception as e:
         return jsonify({
@@ -200,20 +422,13 @@ def upload_image():
         }), 500
 
 @admin_bp.route('/upload_video', methods=['POST'])
+@upload_policy(config.ALLOWED_VIDEO_MIMES)
 @login_required
 def upload_video():
-    """上传视频"""
+    """上传视频（上传文件内容，或通过sha256引用已保存的文件）"""
     # Flask-Login 已经处理了登录检查
     
     try:
-        # 检查是否有文件上传
-        if 'file' not in request.files:
-            return jsonify({
-                'success': False,
-                'error': '没有选择文件'
-            }), 400
-        
-        file = request.files['file']
         video_key = request.form.get('video_key')
         title = request.form.get('title', '')
         description = request.form.get('description', '')
@@ -224,57 +439,24 @@ def upload_video():
                 'error': 'video_key不能为空'
             }), 400
         
-        if file.filename == '':
-            return jsonify({
-                'success': False,
-                'error': '没有选择文件'
-            }), 400
+        # 在请求级会话中保存文件并更新数据库，两者一起提交
+        get_db_session()
+        upload, error = _store_upload(
+            config.ALLOWED_VIDEO_EXTENSIONS, config.ALLOWED_VIDEO_MIMES, '视频', '不支持的视频文件格式'
+        )
+        if error:
+            return error
         
-        if file and FileValidator.validate_file_extension(file.filename, config.ALLOWED_VIDEO_EXTENSIONS):
-            # 生成安全的文件名
-            original_filename = SecurityUtils.sanitize_filename(file.filename)
-            new_filename = SecurityUtils.generate_secure_filename(original_filename)
-            
-            # 确保上传目录存在
-            os.makedirs(config.UPLOAD_FOLDER, exist_ok=True)
-            
-            # 保存文件
-            file_path = os.path.join(config.UPLOAD_FOLDER, new_filename)
-            file.save(file_path)
-            
-            # 验证文件内容
-            if not FileValidator.validate_video_file(original_filename, file_path):
-                os.remove(file_path)  # 删除无效文件
-                return jsonify({
-                    'success': False,
-                    'error': '文件内容验证失败，可能不是有效的视频文件'
-                }), 400
-            
-            # 获取文件大小
-            file_size = os.path.getsize(file_path)
-            
-            # 更新数据库
-            relative_path = f"/static/uploads/{new_filename}"
-            success = VideoContent.update(video_key, relative_path, original_filename, title, description, None, file_size)
-            
-            if success:
-                return jsonify({
-                    'success': True,
-                    'message': '视频上传成功',
-                    'file_path': relative_path
-                })
-            else:
-                # 如果数据库更新失败，删除已上传的文件
-                os.remove(file_path)
-                return jsonify({
-                    'success': False,
-                    'error': '数据库更新失败'
-                }), 500
-        else:
-            return jsonify({
-                'success': False,
-                'error': '不支持的视频文件格式'
-            }), 400
+        blob = upload['blob']
+        VideoContent.update(video_key, blob['file_path'], upload['original_filename'], title, description, None, blob['size'])
+        
+        return jsonify({
+            'success': True,
+            'message': '视频上传成功',
+            'file_path': blob['file_path'],
+            'sha256': blob['sha256'],
+            'deduplicated': upload['deduplicated']
+        })
             
     except Exception as e:
         return jsonify({
@@ -298,33 +480,26 @@ def delete_video():
                 'error': 'video_key不能为空'
             }), 400
         
-        # 获取视频信息
-        video = VideoContent.get_by_key(video_key)
+        # 在请求级会话中读取并删除数据库记录
+        db_session = get_db_session()
+        video = VideoContent.delete(video_key)
         if not video:
             return jsonify({
                 'success': False,
                 'error': '视频不存在'
             }), 404
         
-        # 删除文件
+        # 数据库删除提交后再删除文件，提交失败时文件保持不变；
+        # 按内容保存的文件可能被其他记录引用，由引用计数回收，文件在删除记录的事务提交后删除
         file_path = video['file_path']
-        if file_path and file_path.startswith('/static/uploads/'):
+        if file_path and file_path.startswith('/static/uploads/') and not UploadBlob.is_blob_path(file_path):
             full_path = os.path.join(config.UPLOAD_FOLDER, os.path.basename(file_path))
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            db_session.on_commit(lambda: os.path.exists(full_path) and os.remove(full_path))
         
-        # 删除数据库记录
-        success = VideoContent.delete(video_key)
-        if success:
-            return jsonify({
-                'success': True,
-                'message': '视频删除成功'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '删除失败'
-            }), 500
+        return jsonify({
+            'success': True,
+            'message': '视频删除成功'
+        })
             
     except Exception as e:
         return jsonify({
@@ -339,20 +514,62 @@ def get_admin_content():
     # Flask-Login 已经处理了登录检查
     
     try:
-        texts = TextContent.get_all()
-        images = ImageContent.get_all()
-        videos = VideoContent.get_all()
+        result = get_all_content()
         
+        return jsonify({
+            'success': True,
+            'data': result.content,
+            'version': result.version
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '获取内容失败'
+        }), 500
+
+@admin_bp.route('/db_stats', methods=['GET'])
+@login_required
+def get_db_stats():
+    """获取数据库连接池与内容缓存的运行指标"""
+    try:
         return jsonify({
             'success': True,
             'data': {
-                'texts': texts,
-                'images': images,
-                'videos': videos
+                'pool': get_db_pool().get_stats(),
+                'read_pool': get_db_pool(read_only=True).get_stats(),
+                'writer': get_db_writer().get_stats(),
+                'maintenance': get_db_maintenance().get_stats(),
+                'content_cache': get_content_cache().get_stats(),
+                'content_stream': get_content_events().get_stats(),
+                'password_hashing': get_password_hashing().get_stats(),
+                'admin_user_cache': get_user_cache().get_stats()
             }
         })
     except Exception as e:
         return jsonify({
             'success': False,
-            'error': '获取内容失败'
+            'error': '获取统计信息失败'
         }), 500
+
+@admin_bp.route('/query_stats', methods=['GET'])
+@login_required
+def get_query_stats():
+    """获取SQL语句统计（按总耗时等排序的前N条）和最近的慢查询"""
+    order_by = request.args.get('order_by', 'total_ms')
+    if order_by not in ('total_ms', 'count', 'max_ms', 'rows', 'vm_steps'):
+        return jsonify({
+            'success': False,
+            'error': 'order_by参数无效'
+        }), 400
+    limit = request.args.get('limit', 20, type=int)
+    
+    tracer = get_query_tracer()
+    return jsonify({
+        'success': True,
+        'data': {
+            'enabled': bool(current_app.config.get('DATABASE_TRACE_ENABLED', config.DATABASE_TRACE_ENABLED)),
+            'slow_threshold_ms': tracer.slow_threshold,
+            'statements': tracer.top(max(1, min(limit, 100)), order_by),
+            'slow_queries': tracer.slow_queries()
+        }
+    })
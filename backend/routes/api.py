@@ -1,37 +1,213 @@
 """
 公共API路由模块
 """
-from flask import Blueprint, jsonify
+import json
+from flask import Blueprint, jsonify, request, current_app
 from flask_wtf.csrf import CSRFProtect
-from models import TextContent, ImageContent, VideoContent
+from models import get_all_content, get_content_subset, get_content_changes
+from config import config
+from services.content_cache import ContentSnapshot, get_content_cache, parse_db_timestamp, sync_content_version
+from services.content_events import TooManySubscribers, get_content_events
 
 # 创建蓝图
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# 单次请求允许查询的最大键数量
+MAX_CONTENT_KEYS = 100
+
+def _load_public_snapshot():
+    """从数据库加载公开内容并生成快照"""
+    result = get_all_content(public=True)
+    return ContentSnapshot(result.content, parse_db_timestamp(result.last_updated), result.version)
+
+def _get_snapshot(key, loader, allow_stale=True):
+    """获取缓存的内容快照，读取前先检测其他worker进程的内容写入"""
+    sync_content_version()
+    app = current_app._get_current_object()
+    
+    def load_in_app_context():
+        # 后台刷新线程中也要使用当前应用的数据库连接池
+        with app.app_context():
+            return loader()
+    
+    return get_content_cache().get_or_load(key, load_in_app_context, allow_stale)
+
+def get_public_snapshot(allow_stale=True):
+    """获取当前版本的全量公开内容快照（优先使用缓存）
+    
+    allow_stale为False时不返回后台刷新期间的旧版本快照。
+    """
+    return _get_snapshot('public', _load_public_snapshot, allow_stale)
+
+def _load_subset_snapshot(keys=None, prefix=None):
+    """返回按键或前缀加载内容快照的loader"""
+    def loader():
+        result = get_content_subset(keys=keys, prefix=prefix)
+        return ContentSnapshot(result.content, parse_db_timestamp(result.last_updated), result.version)
+    return loader
+
+def _load_changes_snapshot(since):
+    """返回加载增量变更快照的loader，变更日志已被压缩时回退到全量快照"""
+    def loader():
+        version, changes, deleted = get_content_changes(since)
+        if changes is None:
+            result = get_all_content(public=True)
+            return ContentSnapshot(result.content, version=result.version, extra={'full': True})
+        return ContentSnapshot(changes, version=version, extra={'full': False, 'deleted': deleted})
+    return loader
+
+def _snapshot_response(snapshot):
+    """直接写出快照的预压缩字节，并附带验证与缓存控制头"""
+    encoding = snapshot.select_encoding(request)
+    
+    # 客户端缓存仍然有效时直接返回304，无需访问数据库
+    if snapshot.is_not_modified(request):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(snapshot.variants[encoding], mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    
+    response.set_etag(snapshot.variant_etag(encoding))
+    last_modified = snapshot.validator_last_modified()
+    if last_modified:
+        response.last_modified = last_modified
+    response.vary.add('Accept-Encoding')
+    # 允许浏览器缓存，但每次使用前都需重新验证
+    response.cache_control.no_cache = True
+    return response
+
 @api_bp.route('/content', methods=['GET'])
 def get_content():
-    """获取所有公开内容"""
+    """获取公开内容，支持 ?keys=a,b,c 或 ?prefix=xxx 只获取页面需要的部分"""
+    keys_param = request.args.get('keys')
+    prefix = request.args.get('prefix')
+    
+    if keys_param is not None and prefix is not None:
+        return jsonify({
+            'success': False,
+            'error': 'keys和prefix不能同时使用'
+        }), 400
+    
     try:
-        texts = TextContent.get_all()
-        images = ImageContent.get_all()
-        videos = VideoContent.get_all()
-        
-        # 转换为前端友好的格式
-        content = {
-            'texts': {text['element_key']: text['content'] for text in texts},
-            'images': {image['image_key']: image['file_path'] for image in images},
-            'videos': {video['video_key']: {
-                'file_path': video['file_path'],
-                'title': video['title'],
-                'description': video['description'],
-                'duration': video['duration']
-            } for video in videos}
-        }
+        if keys_param is not None:
+            keys = tuple(sorted({key.strip() for key in keys_param.split(',') if key.strip()}))
+            if not keys or len(keys) > MAX_CONTENT_KEYS:
+                return jsonify({
+                    'success': False,
+                    'error': f'keys数量必须在1到{MAX_CONTENT_KEYS}之间'
+                }), 400
+            snapshot = _get_snapshot(('keys', keys), _load_subset_snapshot(keys=keys))
+        elif prefix is not None:
+            if not prefix:
+                return jsonify({
+                    'success': False,
+                    'error': 'prefix不能为空'
+                }), 400
+            snapshot = _get_snapshot(('prefix', prefix), _load_subset_snapshot(prefix=prefix))
+        else:
+            # 内容快照按版本缓存，仅在内容变更后回源数据库
+            snapshot = get_public_snapshot()
         
+        return _snapshot_response(snapshot)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '获取内容失败'
+        }), 500
+
+@api_bp.route('/content/changes', methods=['GET'])
+def get_content_changes_since():
+    """获取指定版本之后的增量内容变更"""
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({
+            'success': False,
+            'error': 'since必须是非负整数'
+        }), 400
+    
+    try:
+        snapshot = _get_snapshot(('changes', since), _load_changes_snapshot(since))
+        return _snapshot_response(snapshot)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '获取内容变更失败'
+        }), 500
+
+def _version_event(version):
+    """格式化SSE版本变更事件"""
+    return f"id: {version}\nevent: version\ndata: {json.dumps({'version': version})}\n\n"
+
+@api_bp.route('/content/stream', methods=['GET'])
+def stream_content_versions():
+    """通过Server-Sent Events推送内容版本变更
+    
+    每个连接在整个生命周期内阻塞一个请求线程，只有在协程worker（如gevent）下部署并开启
+    CONTENT_STREAM_ENABLED时才提供；未开启时返回404，客户端应改用 /api/content/changes 轮询。
+    """
+    if not current_app.config.get('CONTENT_STREAM_ENABLED', config.CONTENT_STREAM_ENABLED):
         return jsonify({
-            'success': True,
-            'data': content
-        })
+            'success': False,
+            'error': '内容变更推送未开启，请使用 /api/content/changes 获取增量变更'
+        }), 404
+    
+    try:
+        # 从内容快照缓存获取当前版本，不单独占用数据库连接；旧版本快照会让客户端错过最近的变更
+        version = get_public_snapshot(allow_stale=False).version
+        subscription = get_content_events().subscribe()
+    except TooManySubscribers:
+        return jsonify({
+            'success': False,
+            'error': '推送连接数已达上限，请稍后重试'
+        }), 503
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': '获取内容失败'
+        }), 500
+    
+    heartbeat = config.CONTENT_STREAM_HEARTBEAT
+    # 生成器在视图返回、应用上下文弹出之后才迭代，检测其他worker写入时需要重新进入本应用的上下文
+    app = current_app._get_current_object()
+    
+    def generate():
+        try:
+            # 连接建立后先推送当前版本，客户端据此判断是否需要增量同步
+            yield f'retry: {heartbeat * 1000}\n' + _version_event(version)
+            while True:
+                new_version = subscription.wait(timeout=heartbeat)
+                if new_version is None:
+                    # 空闲时检测其他worker进程的写入，检测到变更会唤醒本进程的所有订阅者
+                    with app.app_context():
+                        sync_content_version()
+                    yield ': keep-alive\n\n'
+                else:
+                    yield _version_event(new_version)
+        finally:
+            # 客户端断开时WSGI服务器会关闭生成器，在此释放订阅
+            subscription.close()
+    
+    response = current_app.response_class(generate(), mimetype='text/event-stream')
+    # 生成器尚未开始迭代时客户端就断开的情况下也要释放订阅
+    response.call_on_close(subscription.close)
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁用nginx响应缓冲
+    return response
+
+@api_bp.route('/content/<key>', methods=['GET'])
+def get_content_by_key(key):
+    """获取单个键对应的公开内容"""
+    try:
+        snapshot = _get_snapshot(('key', key), _load_subset_snapshot(keys=(key,)))
+        
+        if not any(snapshot.data.values()):
+            return jsonify({
+                'success': False,
+                'error': '内容不存在'
+            }), 404
+        
+        return _snapshot_response(snapshot)
     except Exception as e:
         return jsonify({
             'success': False,
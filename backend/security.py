@@ -4,22 +4,80 @@
 import bcrypt
 import os
 import mimetypes
+import time
 from config import config
 
+# 文件签名（魔数）登记表：(MIME类型, ((偏移量, 字节串), ...))，全部片段匹配时判定为该类型，
+# 按顺序匹配，更具体的签名放在前面
+FILE_SIGNATURES = (
+    ('image/jpeg', ((0, b'\xff\xd8\xff'),)),
+    ('image/png', ((0, b'\x89PNG\r\n\x1a\n'),)),
+    ('image/gif', ((0, b'GIF87a'),)),
+    ('image/gif', ((0, b'GIF89a'),)),
+    ('image/webp', ((0, b'RIFF'), (8, b'WEBP'))),
+    ('image/svg+xml', ((0, b'<svg'),)),
+    ('image/svg+xml', ((0, b'<?xml'),)),
+    ('video/x-msvideo', ((0, b'RIFF'), (8, b'AVI '))),
+    ('video/quicktime', ((4, b'ftypqt'),)),
+    ('video/quicktime', ((4, b'moov'),)),
+    ('video/mp4', ((4, b'ftyp'),)),
+    ('video/webm', ((0, b'\x1a\x45\xdf\xa3'),)),
+    ('video/x-flv', ((0, b'FLV'),)),
+    ('video/x-ms-wmv', ((0, b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'),)),
+)
+
+# 识别文件类型需要读取的头部字节数
+SIGNATURE_HEADER_SIZE = 16
+
+def detect_file_type(header: bytes):
+    """根据文件头部字节识别MIME类型，无法识别时返回None"""
+    for mime_type, parts in FILE_SIGNATURES:
+        if all(header[offset:offset + len(magic)] == magic for offset, magic in parts):
+            return mime_type
+    return None
+
 class PasswordManager:
     """密码管理器"""
     
     @staticmethod
-    def hash_password(password: str) -> str:
-        """使用bcrypt哈希密码"""
+    def hash_password(password: str, rounds: int = None) -> str:
+        """使用bcrypt哈希密码，rounds为成本因子（不指定时使用bcrypt默认值）"""
         if not password:
             raise ValueError("密码不能为空")
         
         # 生成盐并哈希密码
-        salt = bcrypt.gensalt()
+        salt = bcrypt.gensalt(rounds) if rounds else bcrypt.gensalt()
         hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed.decode('utf-8')
     
+    @staticmethod
+    def get_rounds(hashed: str):
+        """从哈希值（$2b$12$...）中解析成本因子，格式无效时返回None"""
+        try:
+            return int(hashed.split('$')[2])
+        except (AttributeError, IndexError, ValueError):
+            return None
+    
+    @staticmethod
+    def calibrate_rounds(target_ms: float, min_rounds: int = 10, max_rounds: int = 15):
+        """测量本机的哈希耗时，选出耗时不超过target_ms的最大成本因子
+        
+        成本因子每加一耗时翻倍：从min_rounds起逐级测量，预计下一级仍在预算内才继续，
+        实测超出预算时退回上一级（不低于min_rounds）。返回(成本因子, {成本因子: 耗时毫秒})。
+        """
+        timings = {}
+        rounds = min_rounds
+        while True:
+            started = time.perf_counter()
+            bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+            timings[rounds] = (time.perf_counter() - started) * 1000
+            if rounds >= max_rounds or timings[rounds] * 2 > target_ms:
+                break
+            rounds += 1
+        if timings[rounds] > target_ms and rounds > min_rounds:
+            rounds -= 1
+        return rounds, timings
+    
     @staticmethod
     def verify_password(password: str, hashed: str) -> bool:
         """验证密码"""
@@ -124,19 +182,12 @@ class SecurityUtils:
         """检查文件签名（魔数）"""
         try:
             with open(file_path, 'rb') as f:
-                header = f.read(16)  # 读取16字节头部
+                header = f.read(SIGNATURE_HEADER_SIZE)
             
-            # 常见文件签名检查
-            if header.startswith(b'\xff\xd8\xff'):  # JPEG
-                return 'image/jpeg' in allowed_mimes
-            elif header.startswith(b'\x89PNG\r\n\x1a\n'):  # PNG
-                return 'image/png' in allowed_mimes
-            elif header.startswith(b'GIF87a') or header.startswith(b'GIF89a'):  # GIF
-                return 'image/gif' in allowed_mimes
-            elif header.startswith(b'\x00\x00\x00 ftypmp4') or b'mp4' in header[:16]:  # MP4
-                return 'video/mp4' in allowed_mimes
-            elif header.startswith(b'RIFF') and b'WEBP' in header:  # WebP
-                return 'image/webp' in allowed_mimes
+            # 按文件签名登记表检查
+            mime_type = detect_file_type(header)
+            if mime_type:
+                return mime_type in allowed_mimes
             
             # 如果没有匹配到特定签名，返回True（容错处理）
             return True
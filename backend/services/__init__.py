@@ -1,6 +1,32 @@
 """
 服务模块初始化
 """
-from .database import get_db_connection, init_database_pool, close_database_pool, get_db_pool
+from .database import (
+    get_db_connection, get_read_connection, execute_write, on_commit, init_database_pool, close_database_pool,
+    get_db_pool, get_db_writer, get_db_session, DeadlineExceeded, set_deadline, clear_deadline, deadline_remaining,
+    deadline_expired, get_app_resource
+)
+from .content_cache import (
+    ContentCache, ContentSnapshot, ContentVersionWatcher, get_content_cache, invalidate_content_cache,
+    get_content_watcher, notify_content_changed, sync_content_version
+)
+from .content_events import ContentEventBroadcaster, TooManySubscribers, get_content_events, publish_content_version
+from .content_export import export_content_snapshot
+from .query_trace import QueryTracer, get_query_tracer, normalize_sql
+from .password_hashing import PasswordHashingPool, PasswordHashingBusy, get_password_hashing
+from .user_cache import UserCache, get_user_cache
+from .uploads import UploadIngestStream, UploadRequest, upload_policy
 
-__all__ = ['get_db_connection', 'init_database_pool', 'close_database_pool', 'get_db_pool']
+__all__ = [
+    'get_db_connection', 'get_read_connection', 'execute_write', 'on_commit', 'init_database_pool', 'close_database_pool',
+    'get_db_pool', 'get_db_writer', 'get_db_session', 'DeadlineExceeded', 'set_deadline', 'clear_deadline',
+    'deadline_remaining', 'deadline_expired', 'get_app_resource',
+    'ContentCache', 'ContentSnapshot', 'ContentVersionWatcher', 'get_content_cache', 'invalidate_content_cache',
+    'get_content_watcher', 'notify_content_changed', 'sync_content_version',
+    'ContentEventBroadcaster', 'TooManySubscribers', 'get_content_events', 'publish_content_version',
+    'export_content_snapshot',
+    'QueryTracer', 'get_query_tracer', 'normalize_sql',
+    'PasswordHashingPool', 'PasswordHashingBusy', 'get_password_hashing',
+    'UserCache', 'get_user_cache',
+    'UploadIngestStream', 'UploadRequest', 'upload_policy'
+]
@@ -0,0 +1,315 @@
+"""
+内容快照缓存服务
+"""
+import gzip
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from config import config
+from .content_events import publish_content_version
+from .database import DeadlineExceeded, _deadline_exceeded, deadline_remaining, get_app_resource
+
+try:
+    import brotli  # 可选依赖，未安装时仅提供gzip压缩
+except ImportError:
+    brotli = None
+
+def parse_db_timestamp(value):
+    """解析SQLite CURRENT_TIMESTAMP格式（UTC）的时间字符串"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+class ContentSnapshot:
+    """某一内容版本的不可变快照，附带预序列化、预压缩的响应体"""
+    
+    # 按优先级排列的可选编码
+    ENCODINGS = ('br', 'gzip', 'identity')
+    
+    def __init__(self, data, last_modified=None, version=None, extra=None):
+        self.data = data
+        self.last_modified = last_modified
+        self.version = version
+        
+        # 每个版本只序列化一次完整的响应体
+        envelope = {'success': True, 'data': data}
+        if version is not None:
+            envelope['version'] = version
+        envelope.update(extra or {})
+        self.body = json.dumps(
+            envelope, sort_keys=True, ensure_ascii=False, separators=(',', ':')
+        ).encode('utf-8')
+        
+        # 基于响应体哈希生成强ETag，内容不变则ETag不变
+        self.etag = hashlib.sha256(self.body).hexdigest()
+        
+        # 同时生成压缩版本，只保留比原文更小的变体
+        self.variants = {'identity': self.body}
+        compressed = {'gzip': gzip.compress(self.body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(self.body, quality=11)
+        for encoding, body in compressed.items():
+            if len(body) < len(self.body):
+                self.variants[encoding] = body
+    
+    def variant_etag(self, encoding):
+        """不同编码的响应体使用不同的强ETag"""
+        return self.etag if encoding == 'identity' else f'{self.etag}-{encoding}'
+    
+    def select_encoding(self, request):
+        """根据Accept-Encoding选择最合适的预压缩变体"""
+        available = [encoding for encoding in self.ENCODINGS if encoding in self.variants]
+        return request.accept_encodings.best_match(available, default='identity')
+    
+    def validator_last_modified(self):
+        """在响应时可以作为验证器的Last-Modified
+        
+        修改时间只精确到秒：当前时间与其仍在同一秒内时，同一秒的后续修改不会改变Last-Modified，
+        此时返回None，只使用ETag；快照保留原始时间，稍后的响应照常带上Last-Modified。
+        """
+        if self.last_modified and datetime.now(timezone.utc) - self.last_modified >= timedelta(seconds=1):
+            return self.last_modified
+        return None
+    
+    def is_not_modified(self, request):
+        """根据If-None-Match/If-Modified-Since判断客户端缓存是否仍然有效"""
+        if request.if_none_match:
+            return any(
+                request.if_none_match.contains(self.variant_etag(encoding))
+                for encoding in self.variants
+            )
+        last_modified = self.validator_last_modified()
+        if request.if_modified_since and last_modified:
+            return last_modified <= request.if_modified_since
+        return False
+
+class _Flight:
+    """一次正在进行的缓存加载，并发请求在此等待同一个加载结果"""
+
+    def __init__(self, version):
+        self.version = version
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class ContentCache:
+    """带版本号的进程内内容快照缓存
+
+    每次内容写入都会递增版本号并使缓存失效，读取时只有在缓存为空或版本号
+    变化后才会回源数据库，因此每次内容变更最多只会触发一次数据库读取。
+    同一个键的并发未命中会合并为一次加载（single-flight），其余请求等待该结果；
+    开启stale_while_revalidate后，存在旧版本条目时直接返回旧值并在后台刷新。
+    按键或前缀查询的条目数量由max_entries限制，超出时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_entries=256, stale_while_revalidate=False):
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self._lock = threading.Lock()
+        self._version = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'stale_served': 0}
+
+    @property
+    def version(self):
+        """当前内容版本号"""
+        return self._version
+
+    def get_or_load(self, key, loader, allow_stale=True):
+        """获取缓存条目，缓存未命中时调用loader加载并写入缓存
+        
+        allow_stale为False时即使开启了stale_while_revalidate也不返回旧版本条目，
+        而是等待当前版本加载完成（用于导出静态文件等必须反映最新写入的场景）。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self._version:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            
+            stale = entry is not None and self.stale_while_revalidate and allow_stale
+            flight = self._flights.get(key)
+            if flight is not None and flight.version == self._version:
+                leader = False
+            else:
+                flight = _Flight(self._version)
+                self._flights[key] = flight
+                leader = True
+            
+            if stale:
+                self._stats['stale_served'] += 1
+            elif leader:
+                self._stats['misses'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if stale:
+            # 先返回旧版本，由首个请求在后台刷新
+            if leader:
+                threading.Thread(target=self._refresh, args=(key, loader, flight), daemon=True).start()
+            return entry[1]
+
+        if not leader:
+            # 等待时间不超过本请求自己的截止时间；加载方因截止时间失败时本请求同样按超时处理（返回503）
+            remaining = deadline_remaining()
+            if not flight.event.wait(max(0, remaining) if remaining is not None else None):
+                raise _deadline_exceeded("等待内容加载超过请求截止时间")
+            if isinstance(flight.error, DeadlineExceeded):
+                raise _deadline_exceeded()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        return self._load(key, loader, flight)
+
+    def _load(self, key, loader, flight):
+        """执行加载并唤醒等待同一结果的请求"""
+        try:
+            # 在锁外加载，避免数据库读取阻塞其他缓存命中
+            value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            flight.value = value
+            with self._lock:
+                # 加载期间如果内容已变更，则不写入过期数据
+                if self._version == flight.version:
+                    self._entries[key] = (flight.version, value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.event.set()
+
+    def _refresh(self, key, loader, flight):
+        """后台刷新旧版本条目"""
+        try:
+            self._load(key, loader, flight)
+        except Exception as e:
+            # 刷新失败时保留旧值，下一次请求会重新尝试
+            print(f"内容缓存后台刷新失败: {e}")
+
+    def invalidate(self):
+        """递增版本号并使所有缓存条目失效"""
+        with self._lock:
+            self._version += 1
+            # 开启stale_while_revalidate时保留旧条目，用于在刷新期间继续提供服务
+            if not self.stale_while_revalidate:
+                self._entries.clear()
+            return self._version
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'loading': len(self._flights),
+                **self._stats
+            }
+
+class ContentVersionWatcher:
+    """跨进程内容变更检测器
+
+    在一个长连接上执行 PRAGMA data_version：只有其他连接（包括其他worker进程）
+    提交写入后该值才会变化，检查开销只有几微秒。值变化时再读取变更日志的最大版本号，
+    从而在不依赖外部消息中间件、也不轮询内容表的情况下发现其他进程的内容写入。
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._data_version = None
+        self._content_version = None
+
+    def _get_connection(self):
+        if self._conn is None:
+            # 自动提交模式，避免长连接持有读事务而阻止WAL检查点
+            self._conn = sqlite3.connect(self.database_path, check_same_thread=False, isolation_level=None)
+        return self._conn
+
+    def check(self):
+        """检查是否有其他连接提交了内容变更，有则返回新的内容版本号，否则返回None"""
+        with self._lock:
+            try:
+                conn = self._get_connection()
+                data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+                if data_version == self._data_version:
+                    return None
+                self._data_version = data_version
+                
+                version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM content_changes').fetchone()[0]
+            except sqlite3.Error:
+                # 连接异常或表尚未创建时重置状态，下次请求重新检测
+                self.close()
+                return None
+            
+            previous, self._content_version = self._content_version, version
+            if previous is None or version == previous:
+                return None
+            return version
+
+    def mark_seen(self, version):
+        """记录本进程已知的内容版本，避免对本进程自己的写入重复失效缓存"""
+        with self._lock:
+            if self._content_version is None or version > self._content_version:
+                self._content_version = version
+
+    def close(self):
+        """关闭长连接"""
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+        self._data_version = None
+
+def _setting(app, name):
+    """读取应用配置，未设置时使用全局配置"""
+    return app.config.get(name, getattr(config, name)) if app is not None else getattr(config, name)
+
+def get_content_cache():
+    """获取当前应用的内容缓存实例"""
+    return get_app_resource('content_cache', lambda app: ContentCache(
+        stale_while_revalidate=_setting(app, 'CONTENT_CACHE_STALE_WHILE_REVALIDATE')
+    ))
+
+def invalidate_content_cache():
+    """内容变更后调用，递增版本号并使缓存失效"""
+    return get_content_cache().invalidate()
+
+def get_content_watcher():
+    """获取当前应用数据库的内容变更检测器实例"""
+    return get_app_resource('content_watcher', lambda app: ContentVersionWatcher(
+        _setting(app, 'DATABASE_PATH') or config.DATABASE_PATH
+    ))
+
+def notify_content_changed(version=None):
+    """本进程提交内容变更后调用：使缓存失效并向订阅者推送新版本"""
+    invalidate_content_cache()
+    if version is not None:
+        get_content_watcher().mark_seen(version)
+        publish_content_version(version)
+
+def sync_content_version():
+    """检测其他进程的内容写入，有变更时使本进程缓存失效并推送新版本"""
+    version = get_content_watcher().check()
+    if version is not None:
+        invalidate_content_cache()
+        publish_content_version(version)
+    return version
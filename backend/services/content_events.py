@@ -0,0 +1,94 @@
+"""
+内容变更事件广播服务
+"""
+import threading
+from config import config
+from .database import get_app_resource
+
+class TooManySubscribers(Exception):
+    """订阅连接数已达上限"""
+
+class ContentEventBroadcaster:
+    """内容版本变更广播器
+
+    订阅者在条件变量上阻塞等待，空闲连接不轮询数据库、也不持有数据库连接。
+    等待会阻塞调用线程，因此推送接口默认关闭（CONTENT_STREAM_ENABLED）；
+    使用gevent等协程worker部署时，每个空闲连接只占用一个协程而不是一个线程。
+    """
+
+    def __init__(self, max_subscribers=100):
+        self.max_subscribers = max_subscribers
+        self._condition = threading.Condition()
+        self._sequence = 0
+        self._version = None
+        self._subscribers = 0
+
+    def publish(self, version):
+        """发布新的内容版本并唤醒所有订阅者"""
+        with self._condition:
+            self._sequence += 1
+            self._version = version
+            self._condition.notify_all()
+
+    def subscribe(self):
+        """订阅内容变更，超过最大订阅数时抛出TooManySubscribers"""
+        with self._condition:
+            if self._subscribers >= self.max_subscribers:
+                raise TooManySubscribers()
+            self._subscribers += 1
+            return _Subscription(self, self._sequence)
+
+    def _unsubscribe(self):
+        """释放一个订阅名额"""
+        with self._condition:
+            self._subscribers -= 1
+
+    def get_stats(self):
+        """获取广播器统计信息"""
+        with self._condition:
+            return {
+                'subscribers': self._subscribers,
+                'max_subscribers': self.max_subscribers,
+                'version': self._version
+            }
+
+class _Subscription:
+    """单个订阅者的等待状态，使用完毕后需调用close释放订阅名额"""
+
+    def __init__(self, broadcaster, sequence):
+        self._broadcaster = broadcaster
+        self._sequence = sequence
+        self._closed = False
+
+    def wait(self, timeout):
+        """等待下一次版本变更，返回新版本号；超时返回None"""
+        condition = self._broadcaster._condition
+        with condition:
+            changed = condition.wait_for(lambda: self._broadcaster._sequence != self._sequence, timeout)
+            if not changed:
+                return None
+            self._sequence = self._broadcaster._sequence
+            return self._broadcaster._version
+
+    def close(self):
+        """取消订阅，可重复调用"""
+        if not self._closed:
+            self._closed = True
+            self._broadcaster._unsubscribe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def get_content_events():
+    """获取当前应用的内容事件广播器实例"""
+    return get_app_resource('content_events', lambda app: ContentEventBroadcaster(
+        app.config.get('CONTENT_STREAM_MAX_CLIENTS', config.CONTENT_STREAM_MAX_CLIENTS)
+        if app is not None else config.CONTENT_STREAM_MAX_CLIENTS
+    ))
+
+def publish_content_version(version):
+    """内容变更提交后调用，通知所有订阅者"""
+    get_content_events().publish(version)
@@ -0,0 +1,73 @@
+"""
+公开内容静态导出服务
+"""
+import glob
+import os
+import re
+import tempfile
+
+# 各编码变体对应的文件后缀，nginx的gzip_static/brotli_static会自动识别
+VARIANT_SUFFIXES = {
+    'identity': '',
+    'gzip': '.gz',
+    'br': '.br'
+}
+
+def _atomic_write(path, data):
+    """先写临时文件再替换，保证读取方不会看到写了一半的文件"""
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.content-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _remove_old_versions(output_dir, keep):
+    """只保留最近keep个版本的导出文件"""
+    pattern = re.compile(r'^content\.v(\d+)\.json')
+    versions = set()
+    for path in glob.glob(os.path.join(output_dir, 'content.v*.json*')):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            versions.add(int(match.group(1)))
+
+    for version in sorted(versions)[:-keep]:
+        for path in glob.glob(os.path.join(output_dir, f'content.v{version}.json*')):
+            os.remove(path)
+
+def export_content_snapshot(snapshot, output_dir, keep=5):
+    """将内容快照导出为静态JSON文件及预压缩变体
+
+    写出 content.v{version}.json（带版本号，可长期缓存）和 content.json（始终指向最新版本），
+    以及对应的 .gz/.br 文件，供nginx或CDN直接以静态文件形式提供 /api/content。
+    返回写出的文件路径列表。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    version = snapshot.version or 0
+
+    written = []
+    for encoding, body in snapshot.variants.items():
+        suffix = VARIANT_SUFFIXES[encoding]
+        versioned_path = os.path.join(output_dir, f'content.v{version}.json{suffix}')
+        _atomic_write(versioned_path, body)
+        written.append(versioned_path)
+
+    # 版本化文件全部写完后再切换最新指针
+    for encoding, body in snapshot.variants.items():
+        latest_path = os.path.join(output_dir, f'content.json{VARIANT_SUFFIXES[encoding]}')
+        _atomic_write(latest_path, body)
+        written.append(latest_path)
+
+    # 清理已不存在的压缩变体，避免nginx返回旧版本
+    for encoding, suffix in VARIANT_SUFFIXES.items():
+        stale_path = os.path.join(output_dir, f'content.json{suffix}')
+        if encoding not in snapshot.variants and os.path.exists(stale_path):
+            os.remove(stale_path)
+
+    _remove_old_versions(output_dir, keep)
+    return written
@@ -1,85 +1,400 @@
 """
 数据库连接池服务
 """
+import os
 import sqlite3
+import sys
 import threading
 import queue
 import time
+import traceback
+import weakref
+from collections import deque
 from contextlib import contextmanager
+from urllib.parse import quote
+from flask import current_app, g, has_app_context, has_request_context
 from config import config
+from .query_trace import PROGRESS_INTERVAL, TracedCursor, current_route, get_query_tracer
+
+class PoolTimeout(Exception):
+    """等待可用连接超时"""
+
+class DeadlineExceeded(Exception):
+    """请求的数据库时间预算已用完"""
+
+# 当前线程（请求）的截止时间，由请求钩子设置
+_deadline = threading.local()
+
+def set_deadline(seconds):
+    """为当前线程设置从现在起seconds秒的截止时间，None或不大于0表示不限制"""
+    _deadline.expires_at = time.monotonic() + seconds if seconds and seconds > 0 else None
+    _deadline.expired = False
+
+def clear_deadline():
+    """清除当前线程的截止时间"""
+    _deadline.expires_at = None
+    _deadline.expired = False
+
+def deadline_remaining():
+    """距截止时间的剩余秒数（可能为负），没有设置截止时间时返回None"""
+    expires_at = getattr(_deadline, 'expires_at', None)
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+def deadline_expired():
+    """当前请求是否因截止时间到达而中止过数据库操作"""
+    return getattr(_deadline, 'expired', False)
+
+def _deadline_exceeded(message='数据库操作超过请求截止时间'):
+    """标记截止时间已到达并返回对应的异常"""
+    _deadline.expired = True
+    return DeadlineExceeded(message)
+
+def _check_deadline():
+    """截止时间已过时抛出DeadlineExceeded，否则返回剩余秒数（未设置时为None）"""
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        raise _deadline_exceeded()
+    return remaining
+
+class Histogram:
+    """固定分桶的耗时直方图（单位：毫秒）"""
+    
+    BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.BUCKETS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+    
+    def observe(self, value_ms):
+        """记录一次耗时"""
+        index = len(self.BUCKETS)
+        for i, bound in enumerate(self.BUCKETS):
+            if value_ms <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._total += value_ms
+            if value_ms > self._max:
+                self._max = value_ms
+    
+    def snapshot(self):
+        """导出直方图数据"""
+        with self._lock:
+            labels = [f'<={bound}ms' for bound in self.BUCKETS] + [f'>{self.BUCKETS[-1]}ms']
+            return {
+                'count': self._count,
+                'avg_ms': round(self._total / self._count, 3) if self._count else 0,
+                'max_ms': round(self._max, 3),
+                'buckets': dict(zip(labels, self._counts))
+            }
+
+class PoolMetrics:
+    """连接池运行指标：签出等待时间、持有时间、超时、重连以及长时间持有的连接"""
+    
+    def __init__(self, leak_threshold: float = 5.0, history_size: int = 20):
+        self.leak_threshold = leak_threshold
+        self.wait_time = Histogram()
+        self.hold_time = Histogram()
+        self._lock = threading.Lock()
+        self._counters = {'checkouts': 0, 'timeouts': 0, 'reconnects': 0, 'long_held': 0, 'grows': 0, 'shrinks': 0}
+        self._active = {}
+        self._long_held = deque(maxlen=history_size)
+    
+    def increment(self, name):
+        with self._lock:
+            self._counters[name] += 1
+    
+    def checkout_started(self, wait_seconds):
+        """连接签出成功时调用，返回用于结束记录的标记"""
+        self.wait_time.observe(wait_seconds * 1000)
+        token = object()
+        thread = threading.current_thread()
+        with self._lock:
+            self._counters['checkouts'] += 1
+            self._active[token] = (thread.ident, thread.name, time.perf_counter())
+        return token
+    
+    def checkout_finished(self, token):
+        """连接归还时调用，记录持有时间并检测长时间持有"""
+        with self._lock:
+            active = self._active.pop(token, None)
+        if active is None:
+            return
+        held = time.perf_counter() - active[2]
+        self.hold_time.observe(held * 1000)
+        
+        if self.leak_threshold and held > self.leak_threshold:
+            # 归还发生在获取连接的with语句退出时，此时的调用栈即为获取连接的位置
+            with self._lock:
+                self._counters['long_held'] += 1
+                self._long_held.append({
+                    'thread': active[1],
+                    'held_seconds': round(held, 3),
+                    'released_at': time.time(),
+                    'stack': traceback.format_stack()[:-2]
+                })
+    
+    def get_leaks(self):
+        """列出当前持有时间超过阈值的连接及持有线程当前的调用栈"""
+        now = time.perf_counter()
+        with self._lock:
+            active = list(self._active.values())
+        frames = sys._current_frames()
+        leaks = []
+        for ident, name, started in active:
+            held = now - started
+            if self.leak_threshold and held > self.leak_threshold:
+                frame = frames.get(ident)
+                leaks.append({
+                    'thread': name,
+                    'held_seconds': round(held, 3),
+                    'stack': traceback.format_stack(frame) if frame is not None else []
+                })
+        return leaks
+    
+    def snapshot(self):
+        """导出全部指标"""
+        with self._lock:
+            counters = dict(self._counters)
+            in_use = len(self._active)
+            long_held = list(self._long_held)
+        return {
+            **counters,
+            'in_use': in_use,
+            'leak_threshold_seconds': self.leak_threshold,
+            'wait_time': self.wait_time.snapshot(),
+            'hold_time': self.hold_time.snapshot(),
+            'long_held_history': long_held,
+            'long_held_now': self.get_leaks()
+        }
+
+class PooledConnection(sqlite3.Connection):
+    """连接池使用的连接类型（子类支持弱引用，便于跟踪线程本地连接）
+    
+    设置了tracer的连接使用TracedCursor执行语句，并通过进度回调统计虚拟机指令数。
+    进度回调同时检查执行线程的截止时间，超时后中断正在执行的语句。
+    """
+    
+    tracer = None
+    # 签出时为适应截止时间而临时缩短的busy_timeout，归还时恢复
+    busy_timeout_override = False
+    
+    def enable_tracing(self, tracer):
+        """开启语句跟踪"""
+        self.tracer = tracer
+        self.set_trace_callback(tracer.on_statement)
+    
+    def _on_progress(self):
+        if self.tracer is not None:
+            self.tracer.on_progress()
+        expires_at = getattr(_deadline, 'expires_at', None)
+        if expires_at is not None and time.monotonic() >= expires_at:
+            # 返回非0值使SQLite中断当前语句（抛出OperationalError: interrupted）
+            _deadline.expired = True
+            return 1
+        return 0
+    
+    def apply_deadline(self, default_timeout):
+        """签出时按剩余时间缩短busy_timeout，避免等锁超出截止时间"""
+        remaining = _check_deadline()
+        if remaining is not None and remaining < default_timeout:
+            # 直接调用基类方法，配置语句不计入跟踪统计
+            sqlite3.Connection.execute(self, f'PRAGMA busy_timeout={max(1, int(remaining * 1000))}')
+            self.busy_timeout_override = True
+    
+    def restore_busy_timeout(self, default_timeout):
+        """归还时恢复连接的busy_timeout"""
+        if self.busy_timeout_override:
+            sqlite3.Connection.execute(self, f'PRAGMA busy_timeout={int(default_timeout * 1000)}')
+            self.busy_timeout_override = False
+    
+    def cursor(self, factory=None):
+        if factory is None and self.tracer is not None:
+            factory = TracedCursor
+        return super().cursor(factory) if factory is not None else super().cursor()
+    
+    def execute(self, sql, parameters=()):
+        if self.tracer is None:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        if self.tracer is None:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connect(database_path, timeout=30, read_only=False, isolation_level='', tracer=None):
+    """创建并配置一个数据库连接
+    
+    read_only为True时以mode=ro的URI打开并设置query_only，连接既不能写入，
+    也不会争抢写锁；WAL模式由读写连接负责开启。传入tracer时开启语句跟踪。
+    """
+    if read_only:
+        conn = sqlite3.connect(
+            f'file:{quote(os.path.abspath(database_path))}?mode=ro',
+            uri=True,
+            check_same_thread=False,  # 允许多线程使用
+            timeout=timeout,
+            factory=PooledConnection
+        )
+        conn.execute('PRAGMA query_only=ON')
+    else:
+        conn = sqlite3.connect(
+            database_path,
+            check_same_thread=False,
+            timeout=timeout,
+            isolation_level=isolation_level,
+            factory=PooledConnection
+        )
+        # 只对尚未建表的新数据库生效，必须在切换WAL之前设置
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')  # 启用WAL模式
+    conn.row_factory = sqlite3.Row  # 使查询结果可以像字典一样访问
+    
+    # 设置一些性能优化选项
+    conn.execute('PRAGMA synchronous=NORMAL')  # 平衡性能和安全性
+    conn.execute('PRAGMA cache_size=10000')  # 增加缓存大小
+    conn.execute('PRAGMA temp_store=MEMORY')  # 临时表存储在内存中
+    
+    # 进度回调负责截止时间检查和虚拟机指令统计；连接配置语句不计入跟踪统计
+    conn.set_progress_handler(conn._on_progress, PROGRESS_INTERVAL)
+    if tracer is not None:
+        conn.enable_tracing(tracer)
+    return conn
 
 class DatabasePool:
-    """SQLite连接池"""
+    """SQLite连接池
+    
+    支持两种模式：
+    - queue：连接放在共享队列中，每次签出时校验连接有效性（默认）
+    - thread：每个工作线程固定使用一个连接，签出几乎没有开销，
+      只有在执行出错时才检查连接健康状况并按需重建
+    
+    queue模式下开启adaptive后，连接数上限从min_connections起步：签出等待超过
+    wait_threshold秒时上限加一（不超过max_connections）；空闲超过idle_timeout秒的
+    连接会被关闭（不少于min_connections），上限随之回落。
+    """
     
-    def __init__(self, database_path: str, max_connections: int = 10, timeout: int = 30):
+    MODES = ('queue', 'thread')
+    
+    def __init__(self, database_path: str, max_connections: int = 10, timeout: int = 30, mode: str = 'queue',
+                 leak_threshold: float = 5.0, min_connections: int = None, adaptive: bool = False,
+                 idle_timeout: float = 60.0, wait_threshold: float = 0.02, read_only: bool = False,
+                 trace: bool = False):
+        if mode not in self.MODES:
+            raise ValueError(f"不支持的连接池模式: {mode}")
+        if min_connections is None:
+            min_connections = max_connections // 2
         self.database_path = database_path
         self.max_connections = max_connections
+        self.min_connections = max(1, min(min_connections, max_connections))
         self.timeout = timeout
-        self._pool = queue.Queue(maxsize=max_connections)
+        self.mode = mode
+        self.read_only = read_only
+        self.tracer = get_query_tracer() if trace else None
+        self.adaptive = adaptive
+        self.idle_timeout = idle_timeout
+        self.wait_threshold = wait_threshold
+        # 后进先出：热点连接被反复复用，多余的连接才会真正空闲下来并被回收
+        self._pool = queue.LifoQueue(maxsize=max_connections)
         self._lock = threading.Lock()
         self._created_connections = 0
+        # 当前允许创建的连接数上限，固定模式下即为max_connections
+        self._limit = self.min_connections if adaptive else max_connections
+        self._next_shrink_check = time.monotonic() + idle_timeout
+        self.metrics = PoolMetrics(leak_threshold)
+        
+        # 线程模式下的线程本地连接；线程结束后连接随线程本地数据一起释放
+        self._local = threading.local()
+        self._thread_connections = weakref.WeakSet()
         
         # 预创建一些连接
         self._initialize_pool()
     
     def _initialize_pool(self):
         """初始化连接池"""
-        # 创建初始连接（池大小的一半）
-        initial_size = max(1, self.max_connections // 2)
-        for _ in range(initial_size):
+        if self.mode == 'thread':
+            # 线程模式按需为每个线程创建连接
+            return
+        if self.read_only and not os.path.exists(self.database_path):
+            # 只读连接无法创建数据库文件，等数据库初始化后再按需创建
+            return
+        
+        # 预创建min_connections个连接
+        for _ in range(self.min_connections):
             conn = self._create_connection()
             if conn:
+                conn.returned_at = time.monotonic()
                 self._pool.put(conn)
     
-    def _create_connection(self):
-        """创建新的数据库连接"""
+    def _create_connection(self, reserved=False):
+        """创建新的数据库连接
+        
+        reserved为True表示调用方已在锁内预占了连接计数，创建失败时会释放该名额。
+        """
         try:
-            conn = sqlite3.connect(
-                self.database_path,
-                check_same_thread=False,  # 允许多线程使用
-                timeout=self.timeout
-            )
-            conn.row_factory = sqlite3.Row  # 使查询结果可以像字典一样访问
-            
-            # 设置一些性能优化选项
-            conn.execute('PRAGMA journal_mode=WAL')  # 启用WAL模式
-            conn.execute('PRAGMA synchronous=NORMAL')  # 平衡性能和安全性
-            conn.execute('PRAGMA cache_size=10000')  # 增加缓存大小
-            conn.execute('PRAGMA temp_store=MEMORY')  # 临时表存储在内存中
+            conn = connect(self.database_path, self.timeout, read_only=self.read_only, tracer=self.tracer)
             
-            with self._lock:
-                self._created_connections += 1
+            if not reserved:
+                with self._lock:
+                    self._created_connections += 1
             
             return conn
         except sqlite3.Error as e:
             print(f"创建数据库连接失败: {e}")
+            if reserved:
+                with self._lock:
+                    self._created_connections -= 1
             return None
     
     @contextmanager
     def get_connection(self):
         """获取数据库连接的上下文管理器"""
+        if self.mode == 'thread':
+            with self._get_thread_connection() as conn:
+                yield conn
+            return
+        
+        started = time.perf_counter()
         conn = None
+        token = None
         try:
-            # 尝试从池中获取连接
+            # 尝试从池中获取空闲连接，没有空闲连接时不等待，直接按需创建
             try:
-                conn = self._pool.get(timeout=5)
+                conn = self._pool.get_nowait()
             except queue.Empty:
-                # 池中没有可用连接，创建新连接
-                if self._created_connections < self.max_connections:
-                    conn = self._create_connection()
+                # 池中没有可用连接，在锁内预占名额后创建新连接，避免并发请求超出上限
+                with self._lock:
+                    can_create = self._created_connections < self._limit
+                    if can_create:
+                        self._created_connections += 1
+                if can_create:
+                    conn = self._create_connection(reserved=True)
                     if not conn:
                         raise Exception("无法创建新的数据库连接")
                 else:
-                    # 等待连接可用
-                    conn = self._pool.get(timeout=self.timeout)
+                    conn = self._wait_for_connection()
             
             # 检查连接是否仍然有效
             if not self._is_connection_valid(conn):
-                conn.close()
-                conn = self._create_connection()
+                self.metrics.increment('reconnects')
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+                conn = self._create_connection(reserved=True)
                 if not conn:
                     raise Exception("无法创建有效的数据库连接")
             
+            conn.apply_deadline(self.timeout)
+            token = self.metrics.checkout_started(time.perf_counter() - started)
             yield conn
             
         except Exception as e:
@@ -88,13 +403,21 @@ class DatabasePool:
                     conn.rollback()  # 回滚任何未提交的事务
                 except:
                     pass
+            if isinstance(e, sqlite3.OperationalError) and deadline_expired():
+                # 语句被进度回调中断
+                raise DeadlineExceeded("数据库查询超过请求截止时间") from e
             raise e
         finally:
+            if token is not None:
+                self.metrics.checkout_finished(token)
             # 将连接返回池中
             if conn:
                 try:
-                    # 确保没有未提交的事务
-                    conn.rollback()
+                    # 确保没有未提交的事务（没有打开的事务时无需回滚）
+                    if conn.in_transaction:
+                        conn.rollback()
+                    conn.restore_busy_timeout(self.timeout)
+                    conn.returned_at = time.monotonic()
                     self._pool.put(conn, timeout=1)
                 except (queue.Full, sqlite3.Error):
                     # 池已满或连接有问题，关闭连接
@@ -104,6 +427,136 @@ class DatabasePool:
                         pass
                     with self._lock:
                         self._created_connections -= 1
+                if self.adaptive and time.monotonic() >= self._next_shrink_check:
+                    self.shrink_idle()
+    
+    def _wait_for_connection(self):
+        """连接数已达当前上限时等待其他请求归还连接
+        
+        自适应模式下先只等待wait_threshold秒，仍未拿到连接说明出现了排队，
+        此时在max_connections范围内提高上限并直接创建新连接。
+        设置了截止时间时最多等到截止时间，到期抛出DeadlineExceeded。
+        """
+        _check_deadline()
+        if self.adaptive:
+            try:
+                return self._pool.get(timeout=self.wait_threshold)
+            except queue.Empty:
+                with self._lock:
+                    can_grow = self._created_connections < self.max_connections
+                    if can_grow:
+                        self._created_connections += 1
+                        self._limit = max(self._limit, self._created_connections)
+                if can_grow:
+                    self.metrics.increment('grows')
+                    conn = self._create_connection(reserved=True)
+                    if not conn:
+                        raise Exception("无法创建新的数据库连接")
+                    return conn
+        
+        remaining = _check_deadline()
+        by_deadline = remaining is not None and remaining < self.timeout
+        try:
+            return self._pool.get(timeout=remaining if by_deadline else self.timeout)
+        except queue.Empty:
+            self.metrics.increment('timeouts')
+            if by_deadline:
+                raise _deadline_exceeded("等待数据库连接超过请求截止时间")
+            raise PoolTimeout("获取数据库连接超时")
+    
+    def shrink_idle(self):
+        """关闭空闲超过idle_timeout的连接（保留min_connections个），返回关闭的连接数"""
+        now = time.monotonic()
+        self._next_shrink_check = now + self.idle_timeout / 2
+        
+        idle = []
+        while True:
+            try:
+                idle.append(self._pool.get_nowait())
+            except queue.Empty:
+                break
+        
+        closed = 0
+        keep = []
+        for conn in idle:
+            with self._lock:
+                expired = (now - getattr(conn, 'returned_at', now) > self.idle_timeout
+                           and self._created_connections > self.min_connections)
+                if expired:
+                    self._created_connections -= 1
+            if expired:
+                closed += 1
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            else:
+                keep.append(conn)
+        
+        # 按原顺序放回，最近使用的连接仍在栈顶
+        for conn in reversed(keep):
+            self._pool.put_nowait(conn)
+        
+        with self._lock:
+            if self.adaptive:
+                self._limit = max(self.min_connections, self._created_connections)
+        for _ in range(closed):
+            self.metrics.increment('shrinks')
+        return closed
+    
+    @contextmanager
+    def _get_thread_connection(self):
+        """线程模式：签出当前线程固定使用的连接，不做逐次校验"""
+        started = time.perf_counter()
+        local = self._local
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = self._create_connection()
+            if not conn:
+                raise Exception("无法创建新的数据库连接")
+            local.conn = conn
+            local.depth = 0
+            with self._lock:
+                self._thread_connections.add(conn)
+        
+        if local.depth == 0:
+            conn.apply_deadline(self.timeout)
+        local.depth += 1
+        token = self.metrics.checkout_started(time.perf_counter() - started)
+        try:
+            yield conn
+        except sqlite3.Error as e:
+            if isinstance(e, sqlite3.OperationalError) and deadline_expired():
+                # 语句被进度回调中断，连接本身没有问题
+                raise DeadlineExceeded("数据库查询超过请求截止时间") from e
+            # 只有在出错时才检查连接健康状况，失效的连接在下次签出时重建
+            if not self._is_connection_valid(conn):
+                self.metrics.increment('reconnects')
+                self._discard_thread_connection(local, conn)
+            raise
+        finally:
+            self.metrics.checkout_finished(token)
+            local.depth -= 1
+            # 嵌套签出时由最外层负责回滚未提交的事务并恢复busy_timeout
+            if local.depth == 0 and getattr(local, 'conn', None) is conn:
+                try:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    conn.restore_busy_timeout(self.timeout)
+                except sqlite3.Error:
+                    self._discard_thread_connection(local, conn)
+    
+    def _discard_thread_connection(self, local, conn):
+        """丢弃当前线程的失效连接"""
+        local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            if conn in self._thread_connections:
+                self._thread_connections.discard(conn)
+                self._created_connections -= 1
     
     def _is_connection_valid(self, conn):
         """检查连接是否有效"""
@@ -123,44 +576,737 @@ class DatabasePool:
                 break
         
         with self._lock:
+            thread_connections = list(self._thread_connections)
+            self._thread_connections = weakref.WeakSet()
             self._created_connections = 0
+        for conn in thread_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        # 其他线程的线程本地引用在下次签出时发现连接已关闭会自动重建
+        self._local = threading.local()
     
     def get_stats(self):
         """获取连接池统计信息"""
+        with self._lock:
+            created_connections = self._created_connections
         return {
+            'mode': self.mode,
+            'read_only': self.read_only,
+            'adaptive': self.adaptive,
             'pool_size': self._pool.qsize(),
+            'min_connections': self.min_connections,
             'max_connections': self.max_connections,
-            'created_connections': self._created_connections,
-            'available_connections': self._pool.qsize()
+            'connection_limit': self._limit,
+            'created_connections': created_connections,
+            'available_connections': self._pool.qsize(),
+            'metrics': self.metrics.snapshot()
+        }
+
+class _WriteJob:
+    """提交给写入线程的一次写操作"""
+    
+    def __init__(self, func, route=None):
+        self.func = func
+        self.route = route
+        # started/cancelled在写入线程的锁内修改：尚未开始的写操作可由等待超时的调用方取消
+        self.started = False
+        self.cancelled = False
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+# 通知写入线程退出的标记
+_STOP = object()
+
+class DatabaseWriter:
+    """单写入线程
+    
+    SQLite同一时间只允许一个写事务，所有写操作都交给一个专用线程和一个专用连接串行执行，
+    请求线程之间不再争抢写锁，也就不会在busy_timeout后遇到SQLITE_BUSY。
+    写入线程每次取出队列中已积压的写操作（最多batch_size个，可再等待batch_window秒），
+    每个写操作在各自的SAVEPOINT中执行、失败时只回滚自身，整批只提交一次（group commit）。
+    """
+    
+    def __init__(self, database_path: str, batch_size: int = 50, batch_window: float = 0.0, timeout: int = 30,
+                 trace: bool = False):
+        self.database_path = database_path
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.tracer = get_query_tracer() if trace else None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._conn = None
+        # 写入线程提交批次时持有；请求级会话持有该锁时直接在请求线程中写入
+        self.write_lock = threading.Lock()
+        self._stats = {'writes': 0, 'failed': 0, 'cancelled': 0, 'commits': 0, 'largest_batch': 0}
+    
+    def execute(self, func):
+        """在写入线程中执行func(conn)并返回其结果，func抛出的异常会在调用方重新抛出
+        
+        func在写入线程的事务中运行，不能自行commit或rollback，提交由写入线程统一完成；
+        函数返回时写入已经提交。调用线程设置了截止时间时，写操作在截止时间前仍未被
+        写入线程取出则取消并抛出DeadlineExceeded；已经开始执行的写操作会等待其完成。
+        """
+        if self._thread is not None and threading.current_thread() is self._thread:
+            # 写操作内部再次写入时直接并入当前事务
+            return func(self._conn)
+        
+        _check_deadline()
+        job = _WriteJob(func, current_route() if self.tracer is not None else None)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+            self._queue.put(job)
+        remaining = deadline_remaining()
+        if not job.event.wait(max(0, remaining) if remaining is not None else None):
+            with self._lock:
+                if not job.started:
+                    job.cancelled = True
+            if job.cancelled:
+                raise _deadline_exceeded("写操作排队超过请求截止时间")
+            job.event.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+    
+    def _run(self):
+        """写入线程主循环"""
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+            batch = [job]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.batch_size:
+                try:
+                    remaining = deadline - time.monotonic()
+                    job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stopping = True
+                    break
+                batch.append(job)
+            with self.write_lock:
+                self._commit_batch(batch)
+        
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+    
+    def _commit_batch(self, batch):
+        """在一个事务中执行一批写操作并提交一次"""
+        with self._lock:
+            # 整批一起标记为已开始，之后调用方不再取消其中的写操作
+            live = [job for job in batch if not job.cancelled]
+            for job in live:
+                job.started = True
+            self._stats['cancelled'] += len(batch) - len(live)
+        batch = live
+        if not batch:
+            return
+        try:
+            if self._conn is None:
+                # 自动提交模式，事务边界完全由写入线程显式控制
+                self._conn = connect(self.database_path, self.timeout, isolation_level=None, tracer=self.tracer)
+            conn = self._conn
+            conn.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                if self.tracer is not None:
+                    # 写操作中的语句归属到提交它的请求
+                    self.tracer.bind_route(job.route)
+                conn.execute('SAVEPOINT write_job')
+                try:
+                    job.result = job.func(conn)
+                except Exception as e:
+                    job.error = e
+                    conn.execute('ROLLBACK TO write_job')
+                conn.execute('RELEASE write_job')
+            if self.tracer is not None:
+                self.tracer.bind_route(None)
+            conn.execute('COMMIT')
+        except Exception as e:
+            # 提交失败时整批写入都未生效
+            for job in batch:
+                if job.error is None:
+                    job.error = e
+            if self._conn is not None:
+                try:
+                    if self._conn.in_transaction:
+                        self._conn.execute('ROLLBACK')
+                except sqlite3.Error:
+                    self._conn.close()
+                    self._conn = None
+        else:
+            with self._lock:
+                self._stats['commits'] += 1
+                self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        finally:
+            failed = sum(1 for job in batch if job.error is not None)
+            with self._lock:
+                self._stats['writes'] += len(batch) - failed
+                self._stats['failed'] += failed
+            for job in batch:
+                job.event.set()
+    
+    def close(self):
+        """处理完已提交的写操作后停止写入线程"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join(self.timeout)
+    
+    def get_stats(self):
+        """获取写入线程统计信息"""
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'batch_size': self.batch_size,
+                'batch_window_seconds': self.batch_window,
+                **self._stats
+            }
+
+class DatabaseSession:
+    """请求级数据库会话（unit of work）
+    
+    第一次写入时持有写入线程的锁并从读写连接池签出一个连接、开启事务，
+    本次请求中的所有写操作都在该事务中执行，请求结束时统一提交或回滚。
+    on_commit注册的回调（如缓存失效、删除旧文件）只在提交成功后执行，
+    on_rollback注册的回调（如删除刚上传的文件）只在回滚后执行。
+    """
+    
+    def __init__(self, pool, writer):
+        self.database_path = pool.database_path
+        self._pool = pool
+        self._writer = writer
+        self._checkout = None
+        self._conn = None
+        self._on_commit = []
+        self._on_rollback = []
+    
+    @property
+    def active(self):
+        """是否已开启事务"""
+        return self._conn is not None
+    
+    def connection(self):
+        """获取会话连接，第一次调用时开启写事务（等待写锁不超过截止时间）"""
+        if self._conn is None:
+            remaining = _check_deadline()
+            if not self._writer.write_lock.acquire(timeout=remaining if remaining is not None else -1):
+                raise _deadline_exceeded("等待写锁超过请求截止时间")
+            try:
+                self._checkout = self._pool.get_connection()
+                conn = self._checkout.__enter__()
+                conn.execute('BEGIN IMMEDIATE')
+            except Exception:
+                self._release()
+                raise
+            self._conn = conn
+        return self._conn
+    
+    def execute(self, func):
+        """在会话事务中执行func(conn)，func失败时只回滚其自身的修改"""
+        conn = self.connection()
+        conn.execute('SAVEPOINT session_write')
+        try:
+            result = func(conn)
+        except Exception:
+            conn.execute('ROLLBACK TO session_write')
+            conn.execute('RELEASE session_write')
+            raise
+        conn.execute('RELEASE session_write')
+        return result
+    
+    def on_commit(self, callback):
+        """注册提交成功后执行的回调，没有未提交的事务时立即执行"""
+        if self.active:
+            self._on_commit.append(callback)
+        else:
+            callback()
+    
+    def on_rollback(self, callback):
+        """注册回滚后执行的回调"""
+        self._on_rollback.append(callback)
+    
+    def commit(self):
+        """提交会话事务并执行提交回调，提交失败时回滚并抛出异常"""
+        if self._conn is not None:
+            try:
+                self._conn.commit()
+            except Exception:
+                self.rollback()
+                raise
+            self._release()
+        callbacks, self._on_commit, self._on_rollback = self._on_commit, [], []
+        self._run_callbacks(callbacks)
+    
+    def rollback(self):
+        """回滚会话事务并执行回滚回调"""
+        if self._conn is not None:
+            try:
+                self._conn.rollback()
+            except sqlite3.Error:
+                pass
+            self._release()
+        callbacks, self._on_commit, self._on_rollback = self._on_rollback, [], []
+        self._run_callbacks(callbacks)
+    
+    def _release(self):
+        """归还连接并释放写锁"""
+        checkout, self._checkout, self._conn = self._checkout, None, None
+        try:
+            if checkout is not None:
+                checkout.__exit__(None, None, None)
+        finally:
+            self._writer.write_lock.release()
+    
+    def _run_callbacks(self, callbacks):
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"数据库会话回调执行失败: {e}")
+
+class DatabaseMaintenance:
+    """后台数据库维护
+    
+    后台线程每隔interval秒检查一次：
+    - WAL文件超过wal_threshold字节时执行 wal_checkpoint(TRUNCATE)，WAL不会无限增长，
+      读取也不必扫描越来越长的WAL；
+    - 每隔optimize_interval秒执行 PRAGMA optimize，按需更新查询规划器的统计信息；
+    - 数据库连续vacuum_idle秒没有写入时执行 incremental_vacuum，每次最多回收vacuum_pages页
+      （需要auto_vacuum=INCREMENTAL，只有新建的数据库默认开启，已有数据库需通过
+      enable_incremental_vacuum转换一次）。
+    维护操作持有写入线程的锁，与应用写入互不争抢；拿不到锁时跳过本轮。
+    """
+    
+    TASKS = ('checkpoint', 'optimize', 'vacuum')
+    
+    # PRAGMA auto_vacuum的取值
+    AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+    
+    def __init__(self, database_path: str, writer: 'DatabaseWriter', interval: float = 60,
+                 wal_threshold: int = 4 * 1024 * 1024, optimize_interval: float = 3600,
+                 vacuum_idle: float = 300, vacuum_pages: int = 200):
+        self.database_path = database_path
+        self.writer = writer
+        self.interval = interval
+        self.wal_threshold = wal_threshold
+        self.optimize_interval = optimize_interval
+        self.vacuum_idle = vacuum_idle
+        self.vacuum_pages = vacuum_pages
+        # 等待写锁的最长秒数，超过则跳过本次任务
+        self.lock_timeout = 1.0
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._run_lock = threading.Lock()
+        self._data_version = None
+        self._auto_vacuum = None
+        self._last_activity = time.monotonic()
+        self._next_optimize = time.monotonic() + optimize_interval
+        self._lock = threading.Lock()
+        self._tasks = {
+            name: {'runs': 0, 'skipped': 0, 'errors': 0, 'last_run_at': None,
+                   'last_duration_ms': None, 'last_result': None, 'duration': Histogram()}
+            for name in self.TASKS
         }
+    
+    def start(self):
+        """启动后台维护线程"""
+        if self._thread is None and self.interval > 0:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='db-maintenance', daemon=True)
+            self._thread.start()
+    
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"数据库维护失败: {e}")
+    
+    def _get_connection(self):
+        if self._conn is None:
+            # 自动提交模式，维护语句不能在事务中执行
+            self._conn = connect(self.database_path, isolation_level=None)
+        return self._conn
+    
+    def wal_size(self):
+        """当前WAL文件大小（字节）"""
+        try:
+            return os.path.getsize(self.database_path + '-wal')
+        except OSError:
+            return 0
+    
+    def run_once(self, force=False):
+        """执行一轮维护检查，force为True时忽略阈值执行全部任务，返回本轮执行的任务名"""
+        with self._run_lock:
+            now = time.monotonic()
+            conn = self._get_connection()
+            
+            # data_version只在其他连接提交写入后变化，用来判断数据库是否处于空闲期
+            data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._last_activity = now
+            
+            executed = []
+            if force or self.wal_size() > self.wal_threshold:
+                if self._run('checkpoint', lambda: tuple(conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone())):
+                    executed.append('checkpoint')
+            
+            if force or now >= self._next_optimize:
+                if self._run('optimize', lambda: conn.execute('PRAGMA optimize').fetchall()):
+                    executed.append('optimize')
+                    self._next_optimize = now + self.optimize_interval
+            
+            if force or now - self._last_activity >= self.vacuum_idle:
+                auto_vacuum = self._auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+                if auto_vacuum == 2 and conn.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+                    if self._run('vacuum', lambda: self._incremental_vacuum(conn)):
+                        executed.append('vacuum')
+            return executed
+    
+    def enable_incremental_vacuum(self):
+        """把数据库转换为auto_vacuum=INCREMENTAL，返回(转换前模式, 转换后模式)
+        
+        已有数据库修改auto_vacuum后需要执行一次完整的VACUUM才会生效。VACUUM会重写整个数据库文件，
+        期间持有写入线程的锁、阻塞所有写入，只应在维护窗口通过 flask db-maintenance 执行。
+        """
+        with self._run_lock:
+            conn = self._get_connection()
+            before = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            if before != 2:
+                with self.writer.write_lock:
+                    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                    conn.execute('VACUUM')
+            after = self._auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        return self.AUTO_VACUUM_MODES.get(before, before), self.AUTO_VACUUM_MODES.get(after, after)
+    
+    def _read_auto_vacuum(self):
+        """读取auto_vacuum模式，维护正在执行时不等待，返回None"""
+        if self._auto_vacuum is None and self._run_lock.acquire(blocking=False):
+            try:
+                self._auto_vacuum = self._get_connection().execute('PRAGMA auto_vacuum').fetchone()[0]
+            except sqlite3.Error:
+                pass
+            finally:
+                self._run_lock.release()
+        return self._auto_vacuum
+    
+    def _incremental_vacuum(self, conn):
+        """回收空闲页，返回回收的页数"""
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # incremental_vacuum需要逐步执行到结束，executescript会一次执行完毕
+        conn.executescript(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})')
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    
+    def _run(self, name, task):
+        """持有写锁执行一个维护任务并记录耗时，成功返回True"""
+        stats = self._tasks[name]
+        if not self.writer.write_lock.acquire(timeout=self.lock_timeout):
+            with self._lock:
+                stats['skipped'] += 1
+            return False
+        
+        started = time.perf_counter()
+        try:
+            result = task()
+            error = None
+        except sqlite3.Error as e:
+            result = None
+            error = str(e)
+        finally:
+            self.writer.write_lock.release()
+        duration_ms = (time.perf_counter() - started) * 1000
+        
+        stats['duration'].observe(duration_ms)
+        with self._lock:
+            stats['runs'] += 1
+            stats['last_run_at'] = time.time()
+            stats['last_duration_ms'] = round(duration_ms, 3)
+            stats['last_result'] = error or result
+            if error:
+                stats['errors'] += 1
+        return error is None
+    
+    def close(self):
+        """停止后台线程并关闭维护连接"""
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(self.interval)
+        with self._run_lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except sqlite3.Error:
+                    pass
+                self._conn = None
+    
+    def get_stats(self):
+        """获取维护任务统计信息"""
+        with self._lock:
+            tasks = {
+                name: {**{key: value for key, value in stats.items() if key != 'duration'},
+                       'duration': stats['duration'].snapshot()}
+                for name, stats in self._tasks.items()
+            }
+        auto_vacuum = self._read_auto_vacuum()
+        return {
+            'running': self._thread is not None,
+            'interval_seconds': self.interval,
+            'wal_size_bytes': self.wal_size(),
+            'wal_checkpoint_threshold_bytes': self.wal_threshold,
+            'auto_vacuum': self.AUTO_VACUUM_MODES.get(auto_vacuum, auto_vacuum),
+            # auto_vacuum不是INCREMENTAL时incremental_vacuum任务不会执行
+            'vacuum_available': auto_vacuum == 2,
+            'tasks': tasks
+        }
+
+# DatabasePool参数与配置项的对应关系
+POOL_SETTINGS = {
+    'mode': 'DATABASE_POOL_MODE',
+    'timeout': 'DATABASE_POOL_TIMEOUT',
+    'max_connections': 'DATABASE_POOL_MAX_CONNECTIONS',
+    'min_connections': 'DATABASE_POOL_MIN_CONNECTIONS',
+    'adaptive': 'DATABASE_POOL_ADAPTIVE',
+    'idle_timeout': 'DATABASE_POOL_IDLE_TIMEOUT',
+    'wait_threshold': 'DATABASE_POOL_WAIT_THRESHOLD',
+    'leak_threshold': 'DATABASE_POOL_LEAK_THRESHOLD',
+    'trace': 'DATABASE_TRACE_ENABLED'
+}
+
+def _pool_options(app=None):
+    """从app.config（未设置时回退到全局配置）读取连接池参数"""
+    options = {}
+    for argument, name in POOL_SETTINGS.items():
+        default = getattr(config, name)
+        options[argument] = app.config.get(name, default) if app is not None else default
+    return options
+
+def _writer_options(app=None):
+    """读取写入线程的批量提交参数"""
+    settings = app.config if app is not None else {}
+    return {
+        'batch_size': settings.get('DATABASE_WRITE_BATCH_SIZE', config.DATABASE_WRITE_BATCH_SIZE),
+        'batch_window': settings.get('DATABASE_WRITE_BATCH_WINDOW', config.DATABASE_WRITE_BATCH_WINDOW),
+        'timeout': settings.get('DATABASE_POOL_TIMEOUT', config.DATABASE_POOL_TIMEOUT),
+        'trace': settings.get('DATABASE_TRACE_ENABLED', config.DATABASE_TRACE_ENABLED)
+    }
+
+def _maintenance_options(app=None):
+    """读取后台维护参数"""
+    settings = app.config if app is not None else {}
+    return {
+        'interval': settings.get('DATABASE_MAINTENANCE_INTERVAL', config.DATABASE_MAINTENANCE_INTERVAL),
+        'wal_threshold': settings.get('DATABASE_WAL_CHECKPOINT_THRESHOLD', config.DATABASE_WAL_CHECKPOINT_THRESHOLD),
+        'optimize_interval': settings.get('DATABASE_OPTIMIZE_INTERVAL', config.DATABASE_OPTIMIZE_INTERVAL),
+        'vacuum_idle': settings.get('DATABASE_VACUUM_IDLE_SECONDS', config.DATABASE_VACUUM_IDLE_SECONDS),
+        'vacuum_pages': settings.get('DATABASE_VACUUM_PAGES', config.DATABASE_VACUUM_PAGES)
+    }
+
+def _create_resource(kind, database_path, app=None, writer=None):
+    """创建读写连接池（pool）、只读连接池（read_pool）、写入线程（writer）或后台维护（maintenance）"""
+    if kind == 'writer':
+        return DatabaseWriter(database_path, **_writer_options(app))
+    if kind == 'maintenance':
+        return DatabaseMaintenance(database_path, writer, **_maintenance_options(app))
+    return DatabasePool(database_path, read_only=(kind == 'read_pool'), **_pool_options(app))
+
+# 应用扩展中保存各类资源使用的键（按创建顺序排列，关闭时逆序）
+APP_EXTENSIONS = {'pool': 'db_pool', 'read_pool': 'db_read_pool', 'writer': 'db_writer', 'maintenance': 'db_maintenance'}
+
+# 未绑定应用时使用的全局连接池和写入线程，按(类型, 数据库路径)区分
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+
+def _get_global_resource(kind, database_path):
+    """获取（必要时创建）指定数据库路径的全局资源"""
+    with _db_pools_lock:
+        return _get_global_resource_locked(kind, database_path)
 
-# 全局连接池实例
-_db_pool = None
-
-def get_db_pool():
-    """获取数据库连接池实例"""
-    global _db_pool
-    if _db_pool is None:
-        _db_pool = DatabasePool(config.DATABASE_PATH)
-    return _db_pool
-
-def init_database_pool():
-    """初始化数据库连接池"""
-    global _db_pool
-    if _db_pool is None:
-        _db_pool = DatabasePool(config.DATABASE_PATH)
-    return _db_pool
-
-def close_database_pool():
-    """关闭数据库连接池"""
-    global _db_pool
-    if _db_pool:
-        _db_pool.close_all()
-        _db_pool = None
+def _get_global_resource_locked(kind, database_path):
+    resource = _db_pools.get((kind, database_path))
+    if resource is None:
+        writer = _get_global_resource_locked('writer', database_path) if kind == 'maintenance' else None
+        resource = _create_resource(kind, database_path, writer=writer)
+        _db_pools[(kind, database_path)] = resource
+    return resource
+
+def _get_resource(kind, db_path=None):
+    """在应用上下文中优先返回当前应用的资源，否则返回对应数据库路径的全局资源"""
+    if has_app_context():
+        resource = current_app.extensions.get(APP_EXTENSIONS[kind])
+        if resource is not None and (db_path is None or db_path == resource.database_path):
+            return resource
+        if db_path is None:
+            db_path = current_app.config.get('DATABASE_PATH')
+    return _get_global_resource(kind, db_path or config.DATABASE_PATH)
+
+def get_db_pool(db_path=None, read_only=False):
+    """获取数据库连接池实例
+    
+    在应用上下文中优先返回当前应用的连接池（由init_database_pool(app)创建），
+    否则（命令行脚本、后台线程等）返回对应数据库路径的全局连接池。
+    read_only为True时返回只读连接池。
+    """
+    return _get_resource('read_pool' if read_only else 'pool', db_path)
+
+def get_db_writer(db_path=None):
+    """获取数据库写入线程实例"""
+    return _get_resource('writer', db_path)
+
+def get_db_maintenance(db_path=None):
+    """获取数据库后台维护实例"""
+    return _get_resource('maintenance', db_path)
+
+# 未绑定应用时使用的其他全局实例（内容缓存等），按(名称, 数据库路径)区分
+_app_resources = {}
+
+def get_app_resource(name, factory):
+    """获取与当前应用绑定的实例，不存在时调用factory(app)创建
+
+    在应用上下文中实例保存在app.extensions[name]中，同一进程中的多个应用（以及各个测试）
+    互不共享；不在应用上下文中时按全局配置的数据库路径返回全局实例，factory的参数为None。
+    """
+    if has_app_context():
+        app = current_app._get_current_object()
+        resource = app.extensions.get(name)
+        if resource is None:
+            with _db_pools_lock:
+                resource = app.extensions.get(name)
+                if resource is None:
+                    resource = app.extensions[name] = factory(app)
+        return resource
+
+    key = (name, config.DATABASE_PATH)
+    with _db_pools_lock:
+        resource = _app_resources.get(key)
+        if resource is None:
+            resource = _app_resources[key] = factory(None)
+    return resource
+
+def init_database_pool(app=None):
+    """初始化数据库连接池
+    
+    传入app时根据app.config['DATABASE_PATH']为该应用创建独立的读写连接池、只读连接池、写入线程
+    和后台维护，测试和同一进程中的多个应用因此各自使用自己的连接池。后台维护线程不在测试中启动。
+    """
+    if app is None:
+        return _get_global_resource('pool', config.DATABASE_PATH)
+    
+    for kind, name in APP_EXTENSIONS.items():
+        if app.extensions.get(name) is None:
+            app.extensions[name] = _create_resource(
+                kind, app.config['DATABASE_PATH'], app, writer=app.extensions.get('db_writer')
+            )
+    if not app.testing:
+        app.extensions['db_maintenance'].start()
+    
+    if not app.extensions.get('db_session_hooks'):
+        app.after_request(_finish_db_session)
+        app.teardown_request(_teardown_db_session)
+        app.extensions['db_session_hooks'] = True
+    return app.extensions['db_pool']
+
+def _close_resource(resource):
+    """关闭连接池，或停止写入线程、后台维护"""
+    if isinstance(resource, DatabasePool):
+        resource.close_all()
+    else:
+        resource.close()
+
+def close_database_pool(app=None):
+    """关闭数据库连接池、写入线程和后台维护，未传入app时关闭所有全局资源"""
+    if app is not None:
+        for name in reversed(list(APP_EXTENSIONS.values())):
+            resource = app.extensions.pop(name, None)
+            if resource:
+                _close_resource(resource)
+        return
+    
+    with _db_pools_lock:
+        resources = list(_db_pools.values())
+        _db_pools.clear()
+    for resource in reversed(resources):
+        _close_resource(resource)
+
+@contextmanager
+def get_db_connection(db_path=None):
+    """获取读写数据库连接的便捷函数（用于初始化和维护脚本，应用内的写入应使用execute_write）"""
+    pool = get_db_pool(db_path)
+    with pool.get_connection() as conn:
+        yield conn
 
 @contextmanager
-def get_db_connection():
-    """获取数据库连接的便捷函数"""
-    pool = get_db_pool()
+def get_read_connection(db_path=None):
+    """获取只读数据库连接的便捷函数"""
+    pool = get_db_pool(db_path, read_only=True)
     with pool.get_connection() as conn:
         yield conn
+
+def get_db_session():
+    """获取当前请求的数据库会话，不存在时创建"""
+    session = g.get('db_session')
+    if session is None:
+        session = DatabaseSession(get_db_pool(), get_db_writer())
+        g.db_session = session
+    return session
+
+def _current_session(db_path=None):
+    """返回当前请求中针对db_path的数据库会话（如果有）"""
+    if not has_request_context():
+        return None
+    session = g.get('db_session')
+    if session is not None and (db_path is None or db_path == session.database_path):
+        return session
+    return None
+
+def execute_write(func, db_path=None):
+    """执行写操作func(conn)
+    
+    当前请求开启了数据库会话时在会话事务中执行，提交推迟到请求结束；
+    否则交给写入线程执行，返回时写入已提交。
+    """
+    session = _current_session(db_path)
+    if session is not None:
+        return session.execute(func)
+    return get_db_writer(db_path).execute(func)
+
+def on_commit(callback, db_path=None):
+    """写入提交后执行callback：会话事务未提交时推迟到提交之后，否则立即执行"""
+    session = _current_session(db_path)
+    if session is not None:
+        session.on_commit(callback)
+    else:
+        callback()
+
+def _finish_db_session(response):
+    """请求成功时提交数据库会话，返回错误状态码时回滚"""
+    session = g.pop('db_session', None)
+    if session is not None:
+        if response.status_code < 400:
+            session.commit()
+        else:
+            session.rollback()
+    return response
+
+def _teardown_db_session(exc):
+    """请求因异常中断、未经过after_request时回滚数据库会话"""
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.rollback()
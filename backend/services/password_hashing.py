@@ -0,0 +1,151 @@
+"""
+密码哈希工作线程池服务
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from config import config
+from security import PasswordManager
+
+class PasswordHashingBusy(Exception):
+    """密码哈希线程池已满或等待超时"""
+
+class PasswordHashingPool:
+    """限制并发与排队长度的密码哈希线程池
+
+    bcrypt每次计算耗时数百毫秒且会释放GIL，交给固定数量的工作线程执行后，
+    同时进行的哈希计算最多占用max_workers个CPU核心，其余请求（如公共API读取）不受影响。
+    正在执行和排队的任务总数超过max_workers + max_queue时直接拒绝，
+    调用方应快速返回503，而不是让登录请求堆积占满所有WSGI worker。
+
+    rounds为新哈希使用的bcrypt成本因子；不指定时第一次需要时在本机校准，
+    选出单次哈希耗时不超过target_ms的最大成本因子（在min_rounds与max_rounds之间），
+    使不同配置的服务器上登录耗时保持一致。成本因子超出允许范围的已有哈希在下次登录成功时重新生成：
+    指定了rounds时要求完全一致；自动校准受计时误差影响，各worker进程（以及每次重启）的结果
+    可能相差1，与校准值相差不超过rehash_tolerance的哈希保持不变，避免登录落到不同worker时反复重新生成。
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=10.0, rounds=None, target_ms=250.0,
+                 min_rounds=10, max_rounds=15, rehash_tolerance=1):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.target_ms = target_ms
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.rehash_tolerance = 0 if rounds else rehash_tolerance
+        self._rounds = rounds
+        self._calibration = {'source': 'configured', 'rounds': rounds} if rounds else None
+        self._calibrate_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'completed': 0, 'rejected': 0, 'timeouts': 0}
+
+    def run(self, func, *args):
+        """在工作线程中执行func(*args)并返回结果，线程池已满或等待超时时抛出PasswordHashingBusy"""
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise PasswordHashingBusy("密码验证请求过多")
+            self._in_flight += 1
+
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._task_done(None)
+            raise
+        future.add_done_callback(self._task_done)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # 仍在排队的任务直接取消，已经开始的任务由工作线程执行完毕
+            future.cancel()
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PasswordHashingBusy("等待密码验证超时")
+
+    def _task_done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+            if future is not None and not future.cancelled():
+                self._stats['completed'] += 1
+
+    @property
+    def rounds(self):
+        """新哈希使用的成本因子，尚未校准时先执行校准"""
+        if self._rounds is None:
+            with self._calibrate_lock:
+                if self._rounds is None:
+                    self._calibrate()
+        return self._rounds
+
+    def calibrate(self):
+        """在工作线程中测量哈希耗时并重新选择成本因子，返回校准结果"""
+        with self._calibrate_lock:
+            return self._calibrate()
+
+    def _calibrate(self):
+        rounds, timings = self.run(PasswordManager.calibrate_rounds, self.target_ms, self.min_rounds, self.max_rounds)
+        self._calibration = {
+            'source': 'calibrated',
+            'rounds': rounds,
+            'target_ms': self.target_ms,
+            'timings_ms': {cost: round(ms, 3) for cost, ms in timings.items()},
+            'calibrated_at': time.time()
+        }
+        self._rounds = rounds
+        return self._calibration
+
+    def needs_rehash(self, hashed):
+        """已有哈希的成本因子与当前成本因子相差超过rehash_tolerance时需要重新生成
+        
+        尚未校准时先执行校准，线程池繁忙时抛出PasswordHashingBusy。
+        """
+        return abs(PasswordManager.get_rounds(hashed) - self.rounds) > self.rehash_tolerance
+
+    def hash_password(self, password):
+        """在工作线程中按当前成本因子哈希密码"""
+        return self.run(PasswordManager.hash_password, password, self.rounds)
+
+    def verify_password(self, password, hashed):
+        """在工作线程中验证密码"""
+        return self.run(PasswordManager.verify_password, password, hashed)
+
+    def close(self):
+        """停止工作线程，排队中的任务被取消"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self):
+        """获取线程池统计信息"""
+        with self._lock:
+            return {
+                'in_flight': self._in_flight,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'calibration': self._calibration,
+                **self._stats
+            }
+
+# 全局密码哈希线程池实例
+_password_hashing = None
+_password_hashing_lock = threading.Lock()
+
+def get_password_hashing():
+    """获取密码哈希线程池实例"""
+    global _password_hashing
+    if _password_hashing is None:
+        with _password_hashing_lock:
+            if _password_hashing is None:
+                _password_hashing = PasswordHashingPool(
+                    max_workers=config.PASSWORD_HASH_WORKERS,
+                    max_queue=config.PASSWORD_HASH_QUEUE_SIZE,
+                    timeout=config.PASSWORD_HASH_TIMEOUT,
+                    rounds=config.BCRYPT_ROUNDS or None,
+                    target_ms=config.BCRYPT_TARGET_MS,
+                    min_rounds=config.BCRYPT_MIN_ROUNDS,
+                    max_rounds=config.BCRYPT_MAX_ROUNDS,
+                    rehash_tolerance=config.BCRYPT_REHASH_TOLERANCE
+                )
+    return _password_hashing
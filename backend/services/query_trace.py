@@ -0,0 +1,245 @@
+"""
+SQL语句跟踪与慢查询日志服务
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from flask import has_request_context, request
+from config import config
+
+# 规范化SQL时使用的正则：字符串和数字字面量替换为?，IN列表合并，空白折叠
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(sql):
+    """将SQL规范化为不含具体参数的模板，用于按语句聚合统计"""
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('(?, ...)', sql)
+
+def current_route():
+    """当前语句所属的路由（请求端点），请求之外返回线程名"""
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+class _StatementTrace:
+    """一条正在执行的语句"""
+
+    __slots__ = ('sql', 'route', 'elapsed', 'rows', 'vm_steps')
+
+    def __init__(self, sql, route):
+        self.sql = sql
+        self.route = route
+        self.elapsed = 0.0
+        self.rows = 0
+        self.vm_steps = 0
+
+class QueryTracer:
+    """SQL语句跟踪器
+
+    TracedCursor记录每条语句的耗时（执行及取回结果）和返回行数，进度回调统计虚拟机指令数，
+    以区分大范围扫描（指令多）和等待锁或磁盘（指令少但耗时长）。
+    set_trace_callback捕获不经过游标的语句（sqlite3模块隐式执行的BEGIN/COMMIT、executescript），
+    这些语句只计数。超过slow_threshold毫秒的语句写入慢查询日志。
+    """
+
+    def __init__(self, slow_threshold: float = 100, slow_log_size: int = 100, max_statements: int = 500):
+        self.slow_threshold = slow_threshold
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self._statements = OrderedDict()
+        self._slow_log = deque(maxlen=slow_log_size)
+        self._local = threading.local()
+
+    def bind_route(self, route):
+        """将当前线程后续的语句归属到指定路由（写入线程代替提交写操作的请求记录），None表示取消"""
+        self._local.route = route
+
+    def _route(self):
+        return getattr(self._local, 'route', None) or current_route()
+
+    def begin(self, sql):
+        """游标开始执行语句"""
+        trace = _StatementTrace(sql, self._route())
+        self._local.current = trace
+        return trace
+
+    def resume(self, trace):
+        """游标继续处理语句（取回结果），期间的虚拟机指令计入该语句"""
+        self._local.current = trace
+
+    def suspend(self):
+        """游标本次调用结束，之后的虚拟机指令不再计入该语句"""
+        self._local.current = None
+
+    def on_statement(self, sql):
+        """set_trace_callback回调：记录不经过游标执行的语句"""
+        if getattr(self._local, 'current', None) is None:
+            self.finish(_StatementTrace(sql, self._route()))
+
+    def on_progress(self):
+        """进度回调：累计当前语句执行的虚拟机指令数（以进度回调间隔为单位）"""
+        trace = getattr(self._local, 'current', None)
+        if trace is not None:
+            trace.vm_steps += PROGRESS_INTERVAL
+
+    def finish(self, trace):
+        """语句执行完毕，更新聚合统计，超过阈值时写入慢查询日志"""
+        duration_ms = trace.elapsed * 1000
+        key = normalize_sql(trace.sql)
+        with self._lock:
+            stats = self._statements.get(key)
+            if stats is None:
+                stats = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'vm_steps': 0, 'routes': {}}
+                self._statements[key] = stats
+                while len(self._statements) > self.max_statements:
+                    self._statements.popitem(last=False)
+            stats['count'] += 1
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+            stats['rows'] += trace.rows
+            stats['vm_steps'] += trace.vm_steps
+            stats['routes'][trace.route] = stats['routes'].get(trace.route, 0) + 1
+
+            slow = self.slow_threshold and duration_ms > self.slow_threshold
+            if slow:
+                self._slow_log.append({
+                    'sql': key,
+                    'duration_ms': round(duration_ms, 3),
+                    'rows': trace.rows,
+                    'vm_steps': trace.vm_steps,
+                    'route': trace.route,
+                    'at': time.time()
+                })
+        if slow:
+            print(f"慢查询 {duration_ms:.1f}ms [{trace.route}] rows={trace.rows}: {key}")
+
+    def top(self, n=20, order_by='total_ms'):
+        """按总耗时（或count、max_ms、rows）排序的前n条语句统计"""
+        with self._lock:
+            items = [(sql, dict(stats, routes=dict(stats['routes']))) for sql, stats in self._statements.items()]
+        items.sort(key=lambda item: item[1][order_by], reverse=True)
+        return [{
+            'sql': sql,
+            'count': stats['count'],
+            'total_ms': round(stats['total_ms'], 3),
+            'avg_ms': round(stats['total_ms'] / stats['count'], 3),
+            'max_ms': round(stats['max_ms'], 3),
+            'rows': stats['rows'],
+            'vm_steps': stats['vm_steps'],
+            'routes': stats['routes']
+        } for sql, stats in items[:n]]
+
+    def slow_queries(self):
+        """最近的慢查询记录，最新的在前"""
+        with self._lock:
+            return list(reversed(self._slow_log))
+
+    def reset(self):
+        """清空统计"""
+        with self._lock:
+            self._statements.clear()
+            self._slow_log.clear()
+
+# 进度回调的调用间隔（虚拟机指令数）
+PROGRESS_INTERVAL = 1000
+
+class TracedCursor(sqlite3.Cursor):
+    """记录语句耗时和返回行数的游标，由开启跟踪的连接自动使用"""
+
+    _trace = None
+
+    def execute(self, sql, parameters=()):
+        self._finish_trace()
+        return self._timed(self.connection.tracer.begin(sql), super().execute, sql, parameters, done=True)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish_trace()
+        return self._timed(self.connection.tracer.begin(sql), super().executemany, sql, seq_of_parameters, done=True)
+
+    def fetchone(self):
+        row = self._timed(self._trace, super().fetchone)
+        if self._trace is not None:
+            if row is None:
+                self._finish_trace()
+            else:
+                self._trace.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._trace, super().fetchmany, *(() if size is None else (size,)))
+        if self._trace is not None:
+            self._trace.rows += len(rows)
+            if not rows:
+                self._finish_trace()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._trace, super().fetchall)
+        if self._trace is not None:
+            self._trace.rows += len(rows)
+            self._finish_trace()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finish_trace()
+        super().close()
+
+    def __del__(self):
+        self._finish_trace()
+
+    def _timed(self, trace, func, *args, done=False):
+        """执行一次游标调用并把耗时计入trace"""
+        if trace is None:
+            return func(*args)
+        tracer = self.connection.tracer
+        tracer.resume(trace)
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception:
+            # 执行失败的语句同样计入统计
+            trace.elapsed += time.perf_counter() - started
+            tracer.suspend()
+            self._trace = None
+            tracer.finish(trace)
+            raise
+        trace.elapsed += time.perf_counter() - started
+        tracer.suspend()
+        if done:
+            self._trace = trace
+            if self.description is None:
+                # 非查询语句执行完即结束，返回行数记为受影响的行数
+                trace.rows = max(self.rowcount, 0)
+                self._finish_trace()
+        return result
+
+    def _finish_trace(self):
+        trace, self._trace = self._trace, None
+        if trace is not None:
+            self.connection.tracer.finish(trace)
+
+# 全局SQL跟踪器实例
+_query_tracer = None
+_query_tracer_lock = threading.Lock()
+
+def get_query_tracer():
+    """获取SQL跟踪器实例"""
+    global _query_tracer
+    if _query_tracer is None:
+        with _query_tracer_lock:
+            if _query_tracer is None:
+                _query_tracer = QueryTracer(
+                    slow_threshold=config.DATABASE_SLOW_QUERY_MS,
+                    slow_log_size=config.DATABASE_SLOW_QUERY_LOG_SIZE
+                )
+    return _query_tracer
@@ -0,0 +1,127 @@
+"""
+上传文件流式接收服务
+"""
+import hashlib
+import os
+import tempfile
+from flask import Request, current_app
+from config import config
+from security import SIGNATURE_HEADER_SIZE, detect_file_type
+
+class UploadIngestStream:
+    """边接收边校验的上传文件流
+
+    werkzeug解析multipart请求体时把文件数据分块写入本对象：收到的前SIGNATURE_HEADER_SIZE字节
+    按文件签名登记表识别类型，不在allowed_mimes中的文件直接标记为rejected，之后的数据全部丢弃，
+    不会写入磁盘；通过校验的文件写入上传目录中的临时文件，同时计算SHA-256和大小。
+    save()把临时文件原子地移动到最终路径，未保存的临时文件在close()时删除。
+    """
+
+    def __init__(self, directory, allowed_mimes):
+        self.directory = directory
+        self.allowed_mimes = allowed_mimes
+        self.mime_type = None
+        self.rejected = False
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self._header = b''
+        self._file = None
+        self._path = None
+
+    @property
+    def accepted(self):
+        """文件是否通过了内容校验"""
+        return self._file is not None
+
+    def write(self, data):
+        if self.rejected:
+            return len(data)
+        if self._file is None:
+            # 凑满文件头后再识别类型
+            self._header += data
+            if len(self._header) >= SIGNATURE_HEADER_SIZE:
+                self._sniff()
+            return len(data)
+        self._append(data)
+        return len(data)
+
+    def _sniff(self):
+        """识别文件类型，通过后创建临时文件并写入已缓冲的头部"""
+        header, self._header = self._header, b''
+        self.mime_type = detect_file_type(header[:SIGNATURE_HEADER_SIZE])
+        if self.mime_type not in self.allowed_mimes:
+            self.rejected = True
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, self._path = tempfile.mkstemp(dir=self.directory, prefix='.upload-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._append(header)
+
+    def _append(self, data):
+        self._file.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def seek(self, offset, whence=0):
+        # werkzeug写完文件后调用seek(0)，不足一个文件头的小文件在此时识别
+        if self._file is None and not self.rejected:
+            self._sniff()
+        if self._file is None:
+            return 0
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell() if self._file is not None else 0
+
+    def read(self, size=-1):
+        return self._file.read(size) if self._file is not None else b''
+
+    def readline(self, size=-1):
+        return self._file.readline(size) if self._file is not None else b''
+
+    def hexdigest(self):
+        """文件内容的SHA-256"""
+        return self.sha256.hexdigest()
+
+    def save(self, path):
+        """将临时文件移动到path（与临时文件在同一目录下时不复制数据）"""
+        if self._file is None:
+            raise ValueError("上传文件未通过校验")
+        self._file.close()
+        os.chmod(self._path, 0o644)
+        os.replace(self._path, path)
+        self._file = None
+        self._path = None
+
+    def close(self):
+        """关闭并删除未保存的临时文件，可重复调用"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+def upload_policy(allowed_mimes):
+    """视图装饰器：声明该视图接收的上传文件允许的类型，请求体解析时据此流式校验
+
+    CSRF保护等before_request钩子会在视图执行前解析请求体，因此校验规则挂在视图函数上，
+    由UploadRequest在解析时按请求的端点查找。
+    """
+    def decorator(view):
+        view.upload_mimes = frozenset(allowed_mimes)
+        return view
+    return decorator
+
+class UploadRequest(Request):
+    """为声明了upload_policy的端点使用UploadIngestStream接收上传文件的请求类"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        view = current_app.view_functions.get(self.endpoint) if self.endpoint else None
+        allowed_mimes = getattr(view, 'upload_mimes', None)
+        if allowed_mimes is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return UploadIngestStream(config.UPLOAD_FOLDER, allowed_mimes)
@@ -0,0 +1,82 @@
+"""
+管理员用户缓存服务
+"""
+import threading
+import time
+from collections import OrderedDict
+from config import config
+
+class UserCache:
+    """按(数据库路径, 用户ID)缓存用户对象
+
+    Flask-Login每个已登录请求都会调用user_loader，缓存后管理接口不必为了认证
+    再读一次数据库。条目在ttl秒后过期，其他进程对用户的修改最多延迟ttl秒生效；
+    本进程修改或删除用户后调用invalidate立即失效。条目数量由max_entries限制，
+    超出时淘汰最久未使用的条目。不存在的用户不缓存。
+    """
+
+    def __init__(self, max_entries=128, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get_or_load(self, database_path, user_id, loader):
+        """获取缓存的用户对象，未命中或已过期时调用loader加载"""
+        key = (database_path, str(user_id))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+
+        user = loader()
+        if user is not None and self.ttl > 0:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, user)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, database_path=None, user_id=None):
+        """使指定用户的缓存失效，不指定用户时清空该数据库（或全部）的缓存"""
+        with self._lock:
+            if user_id is not None:
+                self._entries.pop((database_path, str(user_id)), None)
+            elif database_path is not None:
+                for key in [key for key in self._entries if key[0] == database_path]:
+                    del self._entries[key]
+            else:
+                self._entries.clear()
+            self._stats['invalidations'] += 1
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                **self._stats
+            }
+
+# 全局管理员用户缓存实例
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+def get_user_cache():
+    """获取管理员用户缓存实例"""
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(
+                    max_entries=config.ADMIN_USER_CACHE_SIZE,
+                    ttl=config.ADMIN_USER_CACHE_TTL
+                )
+    return _user_cache
@@ -3,7 +3,10 @@ import json
 import os
 import tempfile
 from app import create_app
+from config import config
 from models import init_database
+from services.content_cache import invalidate_content_cache
+from services.database import close_database_pool
 
 @pytest.fixture
 def app():
@@ -27,9 +30,17 @@ def app():
     yield app
     
     # Clean up
+    close_database_pool(app)
+    close_database_pool()
     os.close(db_fd)
     os.unlink(db_path)
 
+@pytest.fixture
+def app_context(app):
+    """Run the test inside an app context so direct model calls use the test database."""
+    with app.app_context():
+        yield
+
 @pytest.fixture
 def client(app):
     """A test client for the app."""
@@ -52,6 +63,7 @@ class TestHealthEndpoint:
         assert data['status'] == 'healthy'
         assert 'timestamp' in data
 
+@pytest.mark.usefixtures('app_context')
 class TestContentEndpoint:
     """Test the content API endpoint."""
     
@@ -66,6 +78,304 @@ class TestContentEndpoint:
         assert 'texts' in data['data']
         assert 'images' in data['data']
 
+    def test_content_endpoint_is_cached(self, client, monkeypatch):
+        """Test that repeated reads are served from the content cache."""
+        import routes.api
+        calls = []
+        original = routes.api.get_all_content
+        monkeypatch.setattr(routes.api, 'get_all_content', lambda **kw: calls.append(1) or original(**kw))
+        
+        client.get('/api/content')
+        client.get('/api/content')
+        assert len(calls) == 1
+    
+    def test_content_update_invalidates_cache(self, client):
+        """Test that a text update is visible on the next read."""
+        from models import TextContent
+        client.get('/api/content')
+        TextContent.update('main_title', '新标题')
+        
+        data = json.loads(client.get('/api/content').data)
+        assert data['data']['texts']['main_title'] == '新标题'
+
+    def test_content_etag_not_modified(self, client):
+        """Test that a matching If-None-Match gets a 304 without a body."""
+        response = client.get('/api/content')
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'] == 'no-cache'
+        
+        response = client.get('/api/content', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+    
+    def _backdate_content(self):
+        """Move all modification times a minute into the past."""
+        from services.database import get_db_connection
+        with get_db_connection() as conn:
+            for table in ('text_content', 'image_content', 'video_content'):
+                conn.execute(f"UPDATE {table} SET updated_at = datetime('now', '-1 minute')")
+            conn.execute("UPDATE content_changes SET changed_at = datetime('now', '-1 minute')")
+            conn.commit()
+        invalidate_content_cache()
+    
+    def test_content_last_modified(self, client):
+        """Test Last-Modified and If-Modified-Since handling."""
+        from models import TextContent
+        TextContent.update('main_title', '智护童行')
+        self._backdate_content()
+        
+        response = client.get('/api/content')
+        last_modified = response.headers['Last-Modified']
+        
+        response = client.get('/api/content', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 304
+    
+    def test_content_last_modified_moves_on_delete(self, client):
+        """Test that deleting a row moves Last-Modified forward."""
+        import time
+        from models import VideoContent
+        VideoContent.update('clip', '/static/uploads/clip.mp4')
+        VideoContent.update('intro', '/static/uploads/intro.mp4')
+        self._backdate_content()
+        last_modified = client.get('/api/content').headers['Last-Modified']
+        
+        VideoContent.delete('clip')
+        time.sleep(1.1)
+        response = client.get('/api/content', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+        assert 'clip' not in json.loads(response.data)['data']['videos']
+    
+    def test_content_same_second_not_validator(self, client):
+        """Test that a Last-Modified within the current second is not sent or trusted until it settles."""
+        import time
+        from models import TextContent
+        TextContent.update('main_title', '智护童行')
+        
+        response = client.get('/api/content')
+        assert 'Last-Modified' not in response.headers
+        response = client.get('/api/content', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        assert response.status_code == 200
+        
+        # 同一个缓存快照稍后照常提供Last-Modified
+        time.sleep(1.1)
+        assert 'Last-Modified' in client.get('/api/content').headers
+    
+    def test_content_etag_changes_after_update(self, client):
+        """Test that a content update changes the ETag."""
+        from models import TextContent
+        etag = client.get('/api/content').headers['ETag']
+        TextContent.update('main_title', '新标题')
+        
+        response = client.get('/api/content', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_content_gzip_variant(self, client):
+        """Test that gzip clients get the precompressed body."""
+        import gzip
+        from models import insert_default_content
+        insert_default_content()
+        identity = client.get('/api/content')
+        response = client.get('/api/content', headers={'Accept-Encoding': 'gzip'})
+        
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == identity.data
+        assert response.headers['ETag'] != identity.headers['ETag']
+
+@pytest.mark.usefixtures('app_context')
+class TestCrossWorkerInvalidation:
+    """Test that writes committed by another process invalidate the cache."""
+    
+    def test_write_from_other_connection_is_visible(self, client):
+        """Test that a write through a separate connection is picked up on the next read."""
+        import sqlite3
+        from models import TextContent
+        TextContent.update('main_title', '旧标题')
+        client.get('/api/content')
+        
+        # Simulate another worker process writing to the same database
+        conn = sqlite3.connect(client.application.config['DATABASE_PATH'])
+        conn.execute("UPDATE text_content SET content = '新标题' WHERE element_key = 'main_title'")
+        conn.execute("INSERT INTO content_changes (content_type, content_key, action) VALUES ('texts', 'main_title', 'upsert')")
+        conn.commit()
+        conn.close()
+        
+        data = json.loads(client.get('/api/content').data)
+        assert data['data']['texts']['main_title'] == '新标题'
+        assert data['version'] == 2
+    
+    def test_apps_do_not_share_content_cache(self, app, client, tmp_path):
+        """Test that two apps in one process each serve their own database."""
+        from models import TextContent
+        TextContent.update('main_title', '应用一')
+        client.get('/api/content')
+        
+        other_path = str(tmp_path / 'other.db')
+        other = create_app({'TESTING': True, 'DATABASE_PATH': other_path, 'SECRET_KEY': 'other'})
+        try:
+            with other.app_context():
+                init_database(other_path)
+                TextContent.update('main_title', '应用二')
+            data = json.loads(other.test_client().get('/api/content').data)
+            assert data['data']['texts']['main_title'] == '应用二'
+            assert json.loads(client.get('/api/content').data)['data']['texts']['main_title'] == '应用一'
+        finally:
+            close_database_pool(other)
+
+@pytest.mark.usefixtures('app_context')
+class TestScopedContentEndpoints:
+    """Test the key- and prefix-scoped content endpoints."""
+    
+    @pytest.fixture(autouse=True)
+    def default_content(self, app_context):
+        from models import insert_default_content
+        insert_default_content()
+    
+    def test_content_by_keys(self, client):
+        """Test that only the requested keys are returned."""
+        data = json.loads(client.get('/api/content?keys=main_title,hero_banner,missing').data)
+        assert data['data']['texts'] == {'main_title': '智护童行'}
+        assert list(data['data']['images']) == ['hero_banner']
+        assert data['data']['videos'] == {}
+    
+    def test_content_by_prefix(self, client):
+        """Test that prefix lookups match only keys starting with the prefix."""
+        data = json.loads(client.get('/api/content?prefix=knowledge_').data)
+        assert set(data['data']['texts']) == {'knowledge_title', 'knowledge_description'}
+        assert list(data['data']['images']) == ['knowledge_icon']
+    
+    def test_content_single_key(self, client):
+        """Test the single key endpoint and its own ETag."""
+        response = client.get('/api/content/safety_tips')
+        data = json.loads(response.data)
+        assert data['data']['videos']['safety_tips']['title'] == '儿童安全防护要点'
+        assert response.headers['ETag'] != client.get('/api/content').headers['ETag']
+        
+        response = client.get('/api/content/safety_tips', headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+    
+    def test_content_single_key_missing(self, client):
+        """Test that an unknown key returns 404."""
+        assert client.get('/api/content/missing').status_code == 404
+    
+    def test_content_invalid_scope(self, client):
+        """Test that keys and prefix cannot be combined."""
+        assert client.get('/api/content?keys=a&prefix=b').status_code == 400
+        assert client.get('/api/content?keys=,').status_code == 400
+
+@pytest.mark.usefixtures('app_context')
+class TestContentChangesEndpoint:
+    """Test the delta sync endpoint."""
+    
+    @pytest.fixture(autouse=True)
+    def default_content(self, app_context):
+        from models import insert_default_content
+        insert_default_content()
+    
+    def test_changes_since_version(self, client):
+        """Test that only changed and deleted keys are returned."""
+        from models import TextContent, VideoContent
+        version = json.loads(client.get('/api/content').data)['version']
+        TextContent.update('main_title', '新标题')
+        VideoContent.delete('safety_tips')
+        
+        data = json.loads(client.get(f'/api/content/changes?since={version}').data)
+        assert data['full'] is False
+        assert data['version'] == version + 2
+        assert data['data']['texts'] == {'main_title': '新标题'}
+        assert data['data']['videos'] == {}
+        assert data['deleted']['videos'] == ['safety_tips']
+    
+    def test_changes_up_to_date(self, client):
+        """Test that a current client gets an empty delta."""
+        version = json.loads(client.get('/api/content').data)['version']
+        data = json.loads(client.get(f'/api/content/changes?since={version}').data)
+        assert data['full'] is False
+        assert data['data']['texts'] == {}
+    
+    def test_changes_fall_back_after_compaction(self, client, monkeypatch):
+        """Test the full snapshot fallback once the log is compacted past since."""
+        from models import TextContent
+        monkeypatch.setattr(config, 'CONTENT_CHANGE_LOG_RETENTION', 1)
+        version = json.loads(client.get('/api/content').data)['version']
+        TextContent.update('main_title', '标题一')
+        TextContent.update('main_subtitle', '标题二')
+        
+        data = json.loads(client.get(f'/api/content/changes?since={version}').data)
+        assert data['full'] is True
+        assert data['data']['texts']['main_title'] == '标题一'
+    
+    def test_changes_invalid_since(self, client):
+        """Test that since is required."""
+        assert client.get('/api/content/changes').status_code == 400
+        assert client.get('/api/content/changes?since=abc').status_code == 400
+
+class TestRequestDeadline:
+    """Test the per-blueprint request deadline."""
+    
+    def test_expired_deadline_returns_503(self, app, client):
+        """Test that database work aborted by the deadline is reported as 503."""
+        app.config['REQUEST_DEADLINE_API'] = 1e-9
+        response = client.get('/api/content')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert json.loads(response.data)['success'] is False
+        
+        app.config['REQUEST_DEADLINE_API'] = 0
+        assert client.get('/api/content').status_code == 200
+
+class TestContentStreamEndpoint:
+    """Test the Server-Sent Events content version stream."""
+    
+    @pytest.fixture(autouse=True)
+    def stream_enabled(self, app):
+        app.config['CONTENT_STREAM_ENABLED'] = True
+    
+    def test_stream_disabled_by_default(self, app, client):
+        """Test that the stream is off unless a cooperative worker setup enables it."""
+        app.config.pop('CONTENT_STREAM_ENABLED')
+        response = client.get('/api/content/stream')
+        assert response.status_code == 404
+        assert json.loads(response.data)['success'] is False
+    
+    def test_stream_pushes_version_changes(self, client, app_context):
+        """Test that the stream sends the current version and then each change."""
+        from models import TextContent
+        response = client.get('/api/content/stream', buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        
+        events = iter(response.response)
+        assert 'event: version' in next(events).decode()
+        
+        TextContent.update('main_title', '新标题')
+        assert 'data: {"version": 1}' in next(events).decode()
+        response.close()
+    
+    def test_stream_heartbeat_detects_other_worker_writes(self, app, client, monkeypatch):
+        """Test that the idle heartbeat checks the app's own database for other workers' writes."""
+        import sqlite3
+        monkeypatch.setattr(config, 'CONTENT_STREAM_HEARTBEAT', 0.05)
+        response = client.get('/api/content/stream', buffered=False)
+        events = iter(response.response)
+        assert 'event: version' in next(events).decode()
+        
+        conn = sqlite3.connect(app.config['DATABASE_PATH'])
+        conn.execute("INSERT INTO content_changes (content_type, content_key, action) VALUES ('texts', 'main_title', 'upsert')")
+        conn.commit()
+        conn.close()
+        
+        received = [next(events).decode() for _ in range(2)]
+        assert any('data: {"version": 1}' in event for event in received)
+        response.close()
+    
+    def test_stream_subscriber_limit(self, client, app_context, monkeypatch):
+        """Test that subscribers over the limit get a fast 503."""
+        from services.content_events import get_content_events
+        monkeypatch.setattr(get_content_events(), 'max_subscribers', 0)
+        assert client.get('/api/content/stream').status_code == 503
+
 class TestAdminEndpoints:
     """Test admin-related endpoints."""
     
@@ -97,6 +407,306 @@ class TestAdminEndpoints:
         assert data['success'] is True
         assert data['message'] == '登录成功'
 
+    def test_admin_login_busy(self, client, monkeypatch):
+        """Test that login is rejected with 503 when the hashing pool is full."""
+        from services.password_hashing import PasswordHashingBusy, get_password_hashing
+        def busy(*args):
+            raise PasswordHashingBusy()
+        monkeypatch.setattr(get_password_hashing(), 'verify_password', busy)
+        response = client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+
+    def test_admin_login_busy_during_rehash_check(self, client, monkeypatch):
+        """Test that a verified login succeeds even if calibration for the rehash check is busy."""
+        from services.password_hashing import PasswordHashingBusy, get_password_hashing
+        def busy(*args):
+            raise PasswordHashingBusy()
+        monkeypatch.setattr(get_password_hashing(), 'needs_rehash', busy)
+        response = client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        assert response.status_code == 200
+
+    def test_user_loader_cached(self, app, client, monkeypatch):
+        """Test that authenticated requests reuse the cached user until it is removed."""
+        from models import AdminUser
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        assert client.get('/api/admin/db_stats').status_code == 200
+        
+        def fail(*args):
+            raise AssertionError('user loader should not hit the database')
+        monkeypatch.setattr(AdminUser, 'get_by_id', fail)
+        assert client.get('/api/admin/db_stats').status_code == 200
+        monkeypatch.undo()
+        
+        with app.app_context():
+            assert AdminUser.delete(1) is True
+        assert client.get('/api/admin/db_stats').status_code in (302, 401)
+
+    def test_login_rehashes_password(self, app, client, monkeypatch):
+        """Test that a successful login upgrades a hash with a stale cost factor."""
+        from services.database import get_read_connection
+        from services.password_hashing import get_password_hashing
+        from security import PasswordManager
+        hashing = get_password_hashing()
+        monkeypatch.setattr(hashing, '_rounds', 4)
+        
+        def stored_rounds():
+            with app.app_context(), get_read_connection() as conn:
+                row = conn.execute("SELECT password_hash FROM admin_users WHERE username = 'admin'").fetchone()
+            return PasswordManager.get_rounds(row['password_hash'])
+        
+        assert stored_rounds() != 4
+        response = client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        assert response.status_code == 200
+        assert stored_rounds() == 4
+        assert client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'}).status_code == 200
+
+    def test_admin_content_single_loader(self, client, app_context):
+        """Test that admin content returns full records for every content type."""
+        from models import insert_default_content
+        insert_default_content()
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        
+        data = json.loads(client.get('/api/admin/content').data)
+        assert data['success'] is True
+        assert any(text['element_key'] == 'main_title' for text in data['data']['texts'])
+        assert 'updated_at' in data['data']['images'][0]
+        assert len(data['data']['videos']) == 3
+
+    def test_db_stats_requires_login(self, client):
+        """Test that pool statistics are admin-only."""
+        assert client.get('/api/admin/db_stats').status_code in (302, 401)
+        
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        data = json.loads(client.get('/api/admin/db_stats').data)
+        assert data['success'] is True
+        assert 'wait_time' in data['data']['pool']['metrics']
+    
+    def test_query_stats(self, client):
+        """Test the statement statistics endpoint."""
+        assert client.get('/api/admin/query_stats').status_code in (302, 401)
+        
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        data = json.loads(client.get('/api/admin/query_stats?order_by=count&limit=5').data)
+        assert data['success'] is True
+        assert isinstance(data['data']['statements'], list)
+        assert client.get('/api/admin/query_stats?order_by=bogus').status_code == 400
+
+@pytest.mark.usefixtures('app_context')
+class TestBulkUpdateEndpoints:
+    """Test the bulk admin content update endpoints."""
+    
+    def test_update_texts_single_notification(self, client):
+        """Test that a batch of texts is upserted with one cache invalidation."""
+        from services.content_cache import get_content_cache
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        cache_version = get_content_cache().version
+        
+        response = client.post('/api/admin/update_texts', json=[
+            {'element_key': 'main_title', 'content': '标题'},
+            {'element_key': 'main_subtitle', 'content': '副标题'}
+        ])
+        data = json.loads(response.data)
+        assert data['success'] is True
+        assert data['updated'] == 2
+        assert get_content_cache().version == cache_version + 1
+        
+        client.post('/api/admin/update_texts', json={'items': [{'element_key': 'main_title', 'content': '新标题'}]})
+        texts = json.loads(client.get('/api/content').data)['data']['texts']
+        assert texts == {'main_title': '新标题', 'main_subtitle': '副标题'}
+    
+    def test_update_texts_validation(self, client):
+        """Test that malformed batches are rejected without writing."""
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        assert client.post('/api/admin/update_texts', json=[]).status_code == 400
+        assert client.post('/api/admin/update_texts', json=[
+            {'element_key': 'main_title', 'content': '标题'},
+            {'element_key': 'main_subtitle'}
+        ]).status_code == 400
+        assert json.loads(client.get('/api/content').data)['data']['texts'] == {}
+    
+    def test_update_images_and_videos(self, client):
+        """Test bulk image paths and video metadata updates."""
+        from models import insert_default_content
+        insert_default_content()
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        
+        response = client.post('/api/admin/update_images', json=[
+            {'image_key': 'hero_banner', 'file_path': '/static/uploads/new-banner.jpg'}
+        ])
+        assert response.status_code == 200
+        response = client.post('/api/admin/update_videos', json=[
+            {'video_key': 'safety_tips', 'title': '安全要点', 'duration': 120}
+        ])
+        assert response.status_code == 200
+        
+        content = json.loads(client.get('/api/content').data)['data']
+        assert content['images']['hero_banner'] == '/static/uploads/new-banner.jpg'
+        assert content['videos']['safety_tips']['title'] == '安全要点'
+        assert content['videos']['safety_tips']['duration'] == 120
+        assert content['videos']['safety_tips']['description'] == '了解家庭环境中的安全防护措施'
+    
+    def test_update_videos_unknown_key_rolls_back(self, client):
+        """Test that a missing video aborts the whole batch."""
+        from models import insert_default_content
+        insert_default_content()
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        
+        response = client.post('/api/admin/update_videos', json=[
+            {'video_key': 'safety_tips', 'title': '不会保存'},
+            {'video_key': 'missing', 'title': '不存在'}
+        ])
+        assert response.status_code == 404
+        videos = json.loads(client.get('/api/content').data)['data']['videos']
+        assert videos['safety_tips']['title'] == '儿童安全防护要点'
+
+class TestAdminUnitOfWork:
+    """Test admin write paths that use the request-scoped session."""
+    
+    def test_upload_image_streams_to_disk(self, client, monkeypatch, tmp_path):
+        """Test that a valid image is stored and an invalid one leaves nothing on disk."""
+        import io
+        monkeypatch.setattr(config, 'UPLOAD_FOLDER', str(tmp_path))
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        
+        png = b'\x89PNG\r\n\x1a\n' + b'\x00' * 1024
+        response = client.post('/api/admin/upload_image', data={
+            'image_key': 'hero_banner', 'file': (io.BytesIO(png), 'banner.png')
+        })
+        assert response.status_code == 200
+        file_path = json.loads(response.data)['file_path']
+        assert (tmp_path / os.path.basename(file_path)).read_bytes() == png
+        
+        response = client.post('/api/admin/upload_image', data={
+            'image_key': 'hero_banner', 'file': (io.BytesIO(b'<html>not an image</html>'), 'banner.png')
+        })
+        assert response.status_code == 400
+        assert os.listdir(tmp_path) == [os.path.basename(file_path)]
+    
+    def test_upload_deduplicated_by_hash(self, client, monkeypatch, tmp_path):
+        """Test that identical uploads share one file, referenced by hash and reclaimed when unused."""
+        import hashlib
+        import io
+        monkeypatch.setattr(config, 'UPLOAD_FOLDER', str(tmp_path))
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        video = b'\x00\x00\x00\x18ftypmp42' + b'\x01' * 2048
+        sha256 = hashlib.sha256(video).hexdigest()
+        
+        preflight = json.loads(client.post('/api/admin/upload_preflight', json={'sha256': sha256}).data)
+        assert preflight['stored'] is False
+        first = json.loads(client.post('/api/admin/upload_video', data={
+            'video_key': 'intro', 'file': (io.BytesIO(video), 'intro.mp4')
+        }).data)
+        assert first['file_path'] == f'/static/uploads/{sha256}.mp4'
+        assert first['deduplicated'] is False
+        
+        second = json.loads(client.post('/api/admin/upload_video', data={
+            'video_key': 'outro', 'file': (io.BytesIO(video), 'outro.mp4')
+        }).data)
+        assert second['deduplicated'] is True
+        preflight = json.loads(client.post('/api/admin/upload_preflight', json={'sha256': sha256}).data)
+        assert preflight['stored'] is True
+        
+        # 已保存的文件只需提交sha256
+        response = client.post('/api/admin/upload_video', data={'video_key': 'recap', 'sha256': sha256})
+        assert json.loads(response.data)['file_path'] == first['file_path']
+        assert client.post('/api/admin/upload_image', data={'image_key': 'hero_banner', 'sha256': sha256}).status_code == 400
+        assert client.post('/api/admin/upload_video', data={'video_key': 'x', 'sha256': 'f' * 64}).status_code == 404
+        assert os.listdir(tmp_path) == [f'{sha256}.mp4']
+        
+        # 最后一个引用删除后文件被回收
+        for key in ('intro', 'outro'):
+            client.post('/api/admin/delete_video', json={'video_key': key})
+        assert os.listdir(tmp_path) == [f'{sha256}.mp4']
+        client.post('/api/admin/delete_video', json={'video_key': 'recap'})
+        assert os.listdir(tmp_path) == []
+        assert json.loads(client.post('/api/admin/upload_preflight', json={'sha256': sha256}).data)['stored'] is False
+    
+    def test_unreferenced_upload_kept_until_commit(self, app, client, app_context, monkeypatch, tmp_path):
+        """Test that a reclaimed file survives a rollback and is removed only after commit."""
+        import io
+        from models import ImageContent, UploadBlob
+        from services.database import get_db_session
+        monkeypatch.setattr(config, 'UPLOAD_FOLDER', str(tmp_path))
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        png = b'\x89PNG\r\n\x1a\n' + b'\x02' * 512
+        file_path = json.loads(client.post('/api/admin/upload_image', data={
+            'image_key': 'hero', 'file': (io.BytesIO(png), 'hero.png')
+        }).data)['file_path']
+        stored = tmp_path / os.path.basename(file_path)
+        
+        with app.test_request_context():
+            session = get_db_session()
+            ImageContent.update('hero', '/static/uploads/legacy.png')
+            session.rollback()
+        assert stored.exists()
+        assert ImageContent.get_by_key('hero')['file_path'] == file_path
+        assert UploadBlob.get(os.path.basename(file_path)[:64]) is not None
+        
+        with app.test_request_context():
+            session = get_db_session()
+            ImageContent.update('hero', '/static/uploads/legacy.png')
+            assert stored.exists()
+            session.commit()
+        assert not stored.exists()
+    
+    def test_delete_video_removes_record_then_file(self, client, app_context, monkeypatch, tmp_path):
+        """Test that the video row and its file are both removed."""
+        from models import VideoContent
+        monkeypatch.setattr(config, 'UPLOAD_FOLDER', str(tmp_path))
+        (tmp_path / 'clip.mp4').write_bytes(b'video')
+        VideoContent.update('clip', '/static/uploads/clip.mp4', 'clip.mp4', '片段')
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        
+        response = client.post('/api/admin/delete_video', json={'video_key': 'clip'})
+        assert response.status_code == 200
+        assert not (tmp_path / 'clip.mp4').exists()
+        assert 'clip' not in json.loads(client.get('/api/content').data)['data']['videos']
+        
+        response = client.post('/api/admin/delete_video', json={'video_key': 'clip'})
+        assert response.status_code == 404
+
+@pytest.mark.usefixtures('app_context')
+class TestContentExport:
+    """Test the static content snapshot export."""
+    
+    def test_export_content_command(self, runner, tmp_path):
+        """Test that the CLI writes versioned and latest files with a gzip variant."""
+        import gzip
+        from models import insert_default_content
+        insert_default_content()
+        
+        result = runner.invoke(args=['export-content', '--output-dir', str(tmp_path)])
+        assert result.exit_code == 0
+        
+        latest = json.loads((tmp_path / 'content.json').read_bytes())
+        assert latest['data']['texts']['main_title'] == '智护童行'
+        assert (tmp_path / f"content.v{latest['version']}.json").exists()
+        assert gzip.decompress((tmp_path / 'content.json.gz').read_bytes()) == (tmp_path / 'content.json').read_bytes()
+    
+    def test_export_after_admin_write(self, app, client, tmp_path):
+        """Test that an admin write regenerates the exported snapshot."""
+        app.config['CONTENT_EXPORT_DIR'] = str(tmp_path)
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        client.post('/api/admin/update_text', json={'element_key': 'main_title', 'content': '新标题'})
+        
+        latest = json.loads((tmp_path / 'content.json').read_bytes())
+        assert latest['data']['texts']['main_title'] == '新标题'
+    
+    def test_export_skips_stale_snapshot(self, app, client, monkeypatch, tmp_path):
+        """Test that the export reflects the write even when stale-while-revalidate is on."""
+        from models import insert_default_content
+        from services.content_cache import get_content_cache
+        insert_default_content()
+        monkeypatch.setattr(get_content_cache(), 'stale_while_revalidate', True)
+        app.config['CONTENT_EXPORT_DIR'] = str(tmp_path)
+        client.get('/api/content')
+        client.post('/api/admin/login', json={'username': 'admin', 'password': 'admin123'})
+        client.post('/api/admin/update_text', json={'element_key': 'main_title', 'content': '新标题'})
+        
+        latest = json.loads((tmp_path / 'content.json').read_bytes())
+        assert latest['data']['texts']['main_title'] == '新标题'
+
 class TestStaticFiles:
     """Test static file serving."""
     
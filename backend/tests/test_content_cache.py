@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import pytest
+from models import init_database
+from services.content_cache import ContentCache, ContentVersionWatcher
+from services.database import close_database_pool
+
+class TestContentCache:
+    """Test the versioned content snapshot cache."""
+    
+    def test_loader_called_once_per_version(self):
+        """Test that cached entries are reused until invalidated."""
+        cache = ContentCache()
+        calls = []
+        loader = lambda: calls.append(1) or {'texts': {}}
+        
+        cache.get_or_load('public', loader)
+        cache.get_or_load('public', loader)
+        assert len(calls) == 1
+        
+        cache.invalidate()
+        cache.get_or_load('public', loader)
+        assert len(calls) == 2
+    
+    def test_invalidate_bumps_version(self):
+        """Test that invalidation bumps the version and drops entries."""
+        cache = ContentCache()
+        cache.get_or_load('public', dict)
+        assert cache.invalidate() == 1
+        assert cache.get_stats()['version'] == 1
+        assert cache.get_stats()['entries'] == 0
+    
+    def test_stale_load_not_stored(self):
+        """Test that a load racing with an invalidation is not cached."""
+        cache = ContentCache()
+        
+        def loader():
+            cache.invalidate()
+            return 'stale'
+        
+        assert cache.get_or_load('public', loader) == 'stale'
+        assert cache.get_or_load('public', lambda: 'fresh') == 'fresh'
+    
+    def test_max_entries_evicts_least_recently_used(self):
+        """Test that the cache stays within max_entries."""
+        cache = ContentCache(max_entries=2)
+        cache.get_or_load('a', lambda: 1)
+        cache.get_or_load('b', lambda: 2)
+        cache.get_or_load('a', lambda: 0)
+        cache.get_or_load('c', lambda: 3)
+        
+        assert cache.get_or_load('a', lambda: 0) == 1
+        assert cache.get_or_load('b', lambda: 0) == 0
+    
+    def test_concurrent_misses_are_coalesced(self):
+        """Test that concurrent misses for one key run the loader once."""
+        cache = ContentCache()
+        calls = []
+        
+        def loader():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+        
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('public', loader))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert results == ['value'] * 8
+        assert len(calls) == 1
+        assert cache.get_stats()['coalesced'] == 7
+    
+    def test_waiters_respect_deadline(self):
+        """Test that coalesced waiters report their own deadline, whether they time out or the loader did."""
+        from services.database import DeadlineExceeded, set_deadline, clear_deadline, deadline_expired
+        cache = ContentCache()
+        started = threading.Event()
+        release = threading.Event()
+        
+        def loader():
+            started.set()
+            release.wait(5)
+            raise DeadlineExceeded()
+        
+        leader = threading.Thread(target=lambda: pytest.raises(DeadlineExceeded, cache.get_or_load, 'public', loader))
+        leader.start()
+        started.wait(5)
+        
+        results = []
+        
+        def waiter(seconds):
+            set_deadline(seconds)
+            try:
+                cache.get_or_load('public', loader)
+            except DeadlineExceeded:
+                results.append((seconds, deadline_expired()))
+            finally:
+                clear_deadline()
+        
+        # 截止时间很短的等待方不必等到加载结束
+        short = threading.Thread(target=waiter, args=(0.05,))
+        short.start()
+        short.join(1)
+        assert results == [(0.05, True)]
+        
+        patient = threading.Thread(target=waiter, args=(10,))
+        patient.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in (patient, leader):
+            thread.join(5)
+        assert results[1] == (10, True)
+    
+    def test_loader_error_reaches_waiters(self):
+        """Test that a failed load is not cached."""
+        cache = ContentCache()
+        
+        def loader():
+            raise RuntimeError('db down')
+        
+        with pytest.raises(RuntimeError):
+            cache.get_or_load('public', loader)
+        assert cache.get_or_load('public', lambda: 'ok') == 'ok'
+    
+    def test_stale_while_revalidate(self):
+        """Test that stale entries are served while a background refresh runs."""
+        cache = ContentCache(stale_while_revalidate=True)
+        cache.get_or_load('public', lambda: 'old')
+        cache.invalidate()
+        
+        refreshed = threading.Event()
+        
+        def loader():
+            refreshed.wait(5)
+            return 'new'
+        
+        assert cache.get_or_load('public', loader) == 'old'
+        assert cache.get_or_load('public', loader) == 'old'
+        refreshed.set()
+        
+        for _ in range(100):
+            if cache.get_or_load('public', loader) == 'new':
+                break
+            time.sleep(0.01)
+        assert cache.get_or_load('public', loader) == 'new'
+    
+    def test_stale_not_allowed(self):
+        """Test that allow_stale=False waits for the current version instead of serving stale."""
+        cache = ContentCache(stale_while_revalidate=True)
+        cache.get_or_load('public', lambda: 'old')
+        cache.invalidate()
+        
+        assert cache.get_or_load('public', lambda: 'new', allow_stale=False) == 'new'
+        assert cache.get_or_load('public', lambda: 'newer') == 'new'
+
+class TestContentVersionWatcher:
+    """Test cross-process change detection via PRAGMA data_version."""
+    
+    @pytest.fixture
+    def db_path(self):
+        db_fd, db_path = tempfile.mkstemp()
+        init_database(db_path)
+        yield db_path
+        close_database_pool()
+        os.close(db_fd)
+        os.unlink(db_path)
+    
+    def _write_change(self, db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO content_changes (content_type, content_key, action) VALUES ('texts', 'a', 'upsert')")
+        conn.commit()
+        conn.close()
+    
+    def test_detects_other_connection_writes(self, db_path):
+        """Test that a commit from another connection is reported once."""
+        watcher = ContentVersionWatcher(db_path)
+        assert watcher.check() is None
+        
+        self._write_change(db_path)
+        assert watcher.check() == 1
+        assert watcher.check() is None
+        watcher.close()
+    
+    def test_mark_seen_skips_own_writes(self, db_path):
+        """Test that versions written by this process are not reported again."""
+        watcher = ContentVersionWatcher(db_path)
+        watcher.check()
+        
+        self._write_change(db_path)
+        watcher.mark_seen(1)
+        assert watcher.check() is None
+        watcher.close()
@@ -0,0 +1,30 @@
+import threading
+import pytest
+from services.content_events import ContentEventBroadcaster, TooManySubscribers
+
+class TestContentEventBroadcaster:
+    """Test the content version broadcaster."""
+    
+    def test_wait_returns_published_version(self):
+        """Test that a waiting subscriber is woken by publish."""
+        broadcaster = ContentEventBroadcaster()
+        with broadcaster.subscribe() as subscription:
+            threading.Timer(0.05, broadcaster.publish, args=(7,)).start()
+            assert subscription.wait(timeout=5) == 7
+    
+    def test_wait_times_out(self):
+        """Test that wait returns None when nothing is published."""
+        broadcaster = ContentEventBroadcaster()
+        with broadcaster.subscribe() as subscription:
+            assert subscription.wait(timeout=0.01) is None
+    
+    def test_subscriber_limit(self):
+        """Test that the subscriber limit is enforced and released on close."""
+        broadcaster = ContentEventBroadcaster(max_subscribers=1)
+        subscription = broadcaster.subscribe()
+        with pytest.raises(TooManySubscribers):
+            broadcaster.subscribe()
+        
+        subscription.close()
+        subscription.close()
+        assert broadcaster.get_stats()['subscribers'] == 0
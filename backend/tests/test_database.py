@@ -0,0 +1,509 @@
+import os
+import tempfile
+import pytest
+from app import create_app
+from models import init_database, TextContent
+from services.database import DatabasePool, DatabaseWriter, get_db_pool, close_database_pool
+
+@pytest.fixture
+def db_path():
+    """Create a temporary database with the application schema."""
+    db_fd, db_path = tempfile.mkstemp()
+    yield db_path
+    close_database_pool()
+    os.close(db_fd)
+    os.unlink(db_path)
+
+class TestDatabasePool:
+    """Test the SQLite connection pool."""
+    
+    def test_connections_are_reused(self, db_path):
+        """Test that checkouts reuse pooled connections."""
+        pool = DatabasePool(db_path, max_connections=2)
+        with pool.get_connection() as conn:
+            first = conn
+        with pool.get_connection() as conn:
+            assert conn is first
+        assert pool.get_stats()['created_connections'] == 1
+        pool.close_all()
+    
+    def test_wal_mode_enabled(self, db_path):
+        """Test that pooled connections use WAL journaling."""
+        pool = DatabasePool(db_path, max_connections=1)
+        with pool.get_connection() as conn:
+            assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        pool.close_all()
+
+class TestPoolMetrics:
+    """Test connection pool instrumentation."""
+    
+    def test_wait_and_hold_histograms(self, db_path):
+        """Test that checkouts record wait and hold times."""
+        pool = DatabasePool(db_path, max_connections=2)
+        for _ in range(3):
+            with pool.get_connection() as conn:
+                conn.execute('SELECT 1')
+        
+        metrics = pool.get_stats()['metrics']
+        assert metrics['checkouts'] == 3
+        assert metrics['wait_time']['count'] == 3
+        assert metrics['hold_time']['count'] == 3
+        assert metrics['in_use'] == 0
+        pool.close_all()
+    
+    def test_timeout_counted(self, db_path):
+        """Test that an exhausted pool raises PoolTimeout and counts it."""
+        from services.database import PoolTimeout
+        pool = DatabasePool(db_path, max_connections=1, timeout=0.01)
+        with pool.get_connection():
+            with pytest.raises(PoolTimeout):
+                with pool.get_connection():
+                    pass
+        assert pool.get_stats()['metrics']['timeouts'] == 1
+        pool.close_all()
+    
+    def test_long_held_connection_records_stack(self, db_path):
+        """Test that connections held past the threshold are reported with a stack."""
+        import time
+        pool = DatabasePool(db_path, max_connections=1, leak_threshold=0.01)
+        with pool.get_connection():
+            time.sleep(0.02)
+            assert len(pool.metrics.get_leaks()) == 1
+        
+        metrics = pool.get_stats()['metrics']
+        assert metrics['long_held'] == 1
+        assert any('test_long_held_connection_records_stack' in line for line in metrics['long_held_history'][0]['stack'])
+        pool.close_all()
+
+class TestAdaptivePool:
+    """Test adaptive pool sizing."""
+    
+    def test_min_connections_precreated(self, db_path):
+        """Test that only min_connections are opened up front."""
+        pool = DatabasePool(db_path, max_connections=8, min_connections=1)
+        stats = pool.get_stats()
+        assert stats['created_connections'] == 1
+        assert stats['connection_limit'] == 8
+        pool.close_all()
+    
+    def test_grows_when_checkouts_wait(self, db_path):
+        """Test that the limit rises instead of queueing past the wait threshold."""
+        pool = DatabasePool(db_path, max_connections=3, min_connections=1, adaptive=True, wait_threshold=0.01)
+        with pool.get_connection():
+            with pool.get_connection():
+                with pool.get_connection():
+                    from services.database import PoolTimeout
+                    pool.timeout = 0.01
+                    with pytest.raises(PoolTimeout):
+                        with pool.get_connection():
+                            pass
+        
+        stats = pool.get_stats()
+        assert stats['created_connections'] == 3
+        assert stats['connection_limit'] == 3
+        assert stats['metrics']['grows'] == 2
+        pool.close_all()
+    
+    def test_shrinks_idle_connections(self, db_path):
+        """Test that idle connections are closed down to min_connections."""
+        import time
+        pool = DatabasePool(db_path, max_connections=3, min_connections=1, adaptive=True,
+                            idle_timeout=0.01, wait_threshold=0.01)
+        with pool.get_connection():
+            with pool.get_connection():
+                pass
+        assert pool.get_stats()['created_connections'] == 2
+        
+        time.sleep(0.02)
+        assert pool.shrink_idle() == 1
+        stats = pool.get_stats()
+        assert stats['created_connections'] == 1
+        assert stats['connection_limit'] == 1
+        assert stats['metrics']['shrinks'] == 1
+        with pool.get_connection() as conn:
+            conn.execute('SELECT 1')
+        pool.close_all()
+    
+    def test_pool_limits_from_app_config(self, db_path):
+        """Test that pool limits are read from the application config."""
+        app = create_app({
+            'TESTING': True,
+            'DATABASE_PATH': db_path,
+            'DATABASE_POOL_MAX_CONNECTIONS': 4,
+            'DATABASE_POOL_MIN_CONNECTIONS': 2,
+            'DATABASE_POOL_ADAPTIVE': True
+        })
+        stats = app.extensions['db_pool'].get_stats()
+        assert stats['max_connections'] == 4
+        assert stats['min_connections'] == 2
+        assert stats['adaptive'] is True
+        close_database_pool(app)
+
+class TestThreadAffinePool:
+    """Test the thread-affine pool mode."""
+    
+    def test_one_connection_per_thread(self, db_path):
+        """Test that a thread keeps its connection and other threads get their own."""
+        import threading
+        pool = DatabasePool(db_path, mode='thread')
+        with pool.get_connection() as conn:
+            first = conn
+        with pool.get_connection() as conn:
+            assert conn is first
+        
+        seen = []
+        def worker():
+            with pool.get_connection() as conn:
+                seen.append(conn)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        
+        assert seen[0] is not first
+        assert pool.get_stats()['created_connections'] == 2
+        pool.close_all()
+    
+    def test_uncommitted_transaction_rolled_back(self, db_path):
+        """Test that an open transaction is rolled back on return."""
+        pool = DatabasePool(db_path, mode='thread')
+        with pool.get_connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+            conn.execute('INSERT INTO t VALUES (1)')
+            assert conn.in_transaction
+        with pool.get_connection() as conn:
+            assert not conn.in_transaction
+            assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+        pool.close_all()
+    
+    def test_broken_connection_replaced_after_error(self, db_path):
+        """Test that a closed connection is detected lazily and rebuilt."""
+        import sqlite3
+        pool = DatabasePool(db_path, mode='thread')
+        with pool.get_connection() as conn:
+            broken = conn
+        broken.close()
+        
+        with pytest.raises(sqlite3.ProgrammingError):
+            with pool.get_connection() as conn:
+                conn.execute('SELECT 1')
+        with pool.get_connection() as conn:
+            assert conn is not broken
+            assert conn.execute('SELECT 1').fetchone()[0] == 1
+        pool.close_all()
+
+class TestReadWriteSplit:
+    """Test read-only connections and the serialized writer."""
+    
+    def test_read_only_pool_rejects_writes(self, db_path):
+        """Test that read-only connections cannot write."""
+        import sqlite3
+        writer = DatabasePool(db_path, max_connections=1)
+        with writer.get_connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+            conn.commit()
+        
+        pool = DatabasePool(db_path, max_connections=1, read_only=True)
+        with pool.get_connection() as conn:
+            assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+            with pytest.raises(sqlite3.OperationalError):
+                conn.execute('INSERT INTO t VALUES (1)')
+        pool.close_all()
+        writer.close_all()
+    
+    def test_failed_write_rolls_back_only_itself(self, db_path):
+        """Test that a failing write does not undo other writes in the batch."""
+        writer = DatabaseWriter(db_path)
+        writer.execute(lambda conn: conn.execute('CREATE TABLE t (x INTEGER UNIQUE)'))
+        writer.execute(lambda conn: conn.execute('INSERT INTO t VALUES (1)'))
+        
+        def failing(conn):
+            conn.execute('INSERT INTO t VALUES (2)')
+            conn.execute('INSERT INTO t VALUES (1)')
+        
+        import sqlite3
+        with pytest.raises(sqlite3.IntegrityError):
+            writer.execute(failing)
+        rows = writer.execute(lambda conn: conn.execute('SELECT x FROM t').fetchall())
+        assert [row['x'] for row in rows] == [1]
+        assert writer.get_stats()['failed'] == 1
+        writer.close()
+    
+    def test_concurrent_writes_are_group_committed(self, db_path):
+        """Test that queued writes share commits."""
+        import threading
+        writer = DatabaseWriter(db_path, batch_window=0.05)
+        writer.execute(lambda conn: conn.execute('CREATE TABLE t (x INTEGER)'))
+        
+        threads = [
+            threading.Thread(target=writer.execute, args=(lambda conn, i=i: conn.execute('INSERT INTO t VALUES (?)', (i,)),))
+            for i in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        stats = writer.get_stats()
+        assert stats['writes'] == 11
+        assert stats['commits'] < 11
+        assert writer.execute(lambda conn: conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]) == 10
+        writer.close()
+
+class TestAppDatabasePool:
+    """Test that each app gets its own pool."""
+    
+    def test_each_app_has_own_pool(self, db_path):
+        """Test that models use the pool of the active app."""
+        other_fd, other_path = tempfile.mkstemp()
+        app = create_app({'TESTING': True, 'DATABASE_PATH': db_path})
+        other_app = create_app({'TESTING': True, 'DATABASE_PATH': other_path})
+        
+        try:
+            assert app.extensions['db_pool'] is not other_app.extensions['db_pool']
+            
+            with app.app_context():
+                assert get_db_pool() is app.extensions['db_pool']
+                init_database()
+                TextContent.update('main_title', 'app')
+            with other_app.app_context():
+                init_database()
+                assert TextContent.get_by_key('main_title') is None
+            with app.app_context():
+                assert TextContent.get_by_key('main_title')['content'] == 'app'
+        finally:
+            close_database_pool(app)
+            close_database_pool(other_app)
+            os.close(other_fd)
+            os.unlink(other_path)
+
+class TestDatabaseSession:
+    """Test the request-scoped unit of work."""
+    
+    @pytest.fixture
+    def app(self, db_path):
+        app = create_app({'TESTING': True, 'DATABASE_PATH': db_path})
+        with app.app_context():
+            init_database()
+        yield app
+        close_database_pool(app)
+    
+    def test_writes_committed_after_request(self, app):
+        """Test that session writes and callbacks are applied only on commit."""
+        from flask import make_response
+        from services.database import get_db_session
+        committed = []
+        
+        with app.test_request_context():
+            session = get_db_session()
+            TextContent.update('main_title', 'session')
+            session.on_commit(lambda: committed.append(True))
+            assert session.active
+            assert committed == []
+            app.process_response(make_response('ok'))
+            assert committed == [True]
+        
+        with app.app_context():
+            assert TextContent.get_by_key('main_title')['content'] == 'session'
+    
+    def test_error_response_rolls_back(self, app):
+        """Test that an error response discards every write in the session."""
+        from flask import make_response
+        from services.database import get_db_session
+        rolled_back = []
+        
+        with app.test_request_context():
+            session = get_db_session()
+            session.on_rollback(lambda: rolled_back.append(True))
+            TextContent.update('main_title', 'discarded')
+            TextContent.update('main_subtitle', 'discarded')
+            app.process_response(make_response('error', 500))
+        
+        assert rolled_back == [True]
+        with app.app_context():
+            assert TextContent.get_all() == []
+            # 写锁已释放，后续写入不会阻塞
+            TextContent.update('main_title', 'after')
+            assert TextContent.get_by_key('main_title')['content'] == 'after'
+
+class TestDatabaseMaintenance:
+    """Test the background maintenance scheduler."""
+    
+    def test_checkpoint_truncates_wal(self, db_path):
+        """Test that a WAL above the threshold is checkpointed and truncated."""
+        from services.database import DatabaseMaintenance
+        writer = DatabaseWriter(db_path)
+        writer.execute(lambda conn: conn.execute('CREATE TABLE t (x BLOB)'))
+        writer.execute(lambda conn: conn.executemany('INSERT INTO t VALUES (zeroblob(4000))', [()] * 50))
+        
+        maintenance = DatabaseMaintenance(db_path, writer, interval=0, wal_threshold=1024)
+        assert maintenance.wal_size() > 1024
+        assert 'checkpoint' in maintenance.run_once()
+        assert maintenance.wal_size() == 0
+        
+        stats = maintenance.get_stats()['tasks']['checkpoint']
+        assert stats['runs'] == 1
+        assert stats['duration']['count'] == 1
+        maintenance.close()
+        writer.close()
+    
+    def test_vacuum_only_when_idle(self, db_path):
+        """Test that incremental vacuum waits for an idle window and frees pages."""
+        from services.database import DatabaseMaintenance
+        writer = DatabaseWriter(db_path)
+        writer.execute(lambda conn: conn.execute('CREATE TABLE t (x BLOB)'))
+        writer.execute(lambda conn: conn.executemany('INSERT INTO t VALUES (zeroblob(4000))', [()] * 50))
+        writer.execute(lambda conn: conn.execute('DELETE FROM t'))
+        
+        maintenance = DatabaseMaintenance(db_path, writer, interval=0, vacuum_idle=60)
+        assert 'vacuum' not in maintenance.run_once()
+        
+        maintenance.vacuum_idle = 0
+        assert 'vacuum' in maintenance.run_once()
+        assert maintenance.get_stats()['tasks']['vacuum']['last_result'] > 0
+        maintenance.close()
+        writer.close()
+    
+    def test_enable_incremental_vacuum(self, tmp_path):
+        """Test that an existing database without auto_vacuum can be converted once."""
+        import sqlite3
+        from services.database import DatabaseMaintenance
+        path = str(tmp_path / 'legacy.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE t (x BLOB)')
+        conn.executemany('INSERT INTO t VALUES (zeroblob(4000))', [()] * 50)
+        conn.execute('DELETE FROM t')
+        conn.commit()
+        conn.close()
+        
+        writer = DatabaseWriter(path)
+        maintenance = DatabaseMaintenance(path, writer, interval=0, vacuum_idle=0)
+        assert maintenance.get_stats()['vacuum_available'] is False
+        assert 'vacuum' not in maintenance.run_once()
+        
+        assert maintenance.enable_incremental_vacuum() == ('none', 'incremental')
+        stats = maintenance.get_stats()
+        assert stats['auto_vacuum'] == 'incremental'
+        assert stats['vacuum_available'] is True
+        assert maintenance.enable_incremental_vacuum() == ('incremental', 'incremental')
+        maintenance.close()
+        writer.close()
+    
+    def test_skipped_while_writer_busy(self, db_path):
+        """Test that maintenance does not wait behind a long write."""
+        from services.database import DatabaseMaintenance
+        writer = DatabaseWriter(db_path)
+        maintenance = DatabaseMaintenance(db_path, writer, interval=0)
+        maintenance.lock_timeout = 0.01
+        with writer.write_lock:
+            assert maintenance.run_once(force=True) == []
+        assert maintenance.get_stats()['tasks']['checkpoint']['skipped'] == 1
+        maintenance.close()
+        writer.close()
+
+class TestQueryTracing:
+    """Test statement tracing and the slow-query log."""
+    
+    def test_normalize_sql(self):
+        """Test that literals and IN lists are folded into one template."""
+        from services.query_trace import normalize_sql
+        assert normalize_sql("SELECT *  FROM t\n WHERE a = 'x' AND b IN (?, ?, ?) LIMIT 10") == \
+            'SELECT * FROM t WHERE a = ? AND b IN (?, ...) LIMIT ?'
+    
+    def test_traced_pool_records_statements(self, db_path):
+        """Test that traced connections record duration, rows and VM steps per statement."""
+        from services.query_trace import get_query_tracer
+        tracer = get_query_tracer()
+        tracer.reset()
+        pool = DatabasePool(db_path, max_connections=1, trace=True)
+        with pool.get_connection() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+            conn.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(50)])
+            conn.commit()
+            for _ in range(2):
+                assert len(conn.execute('SELECT x FROM t WHERE x >= ?', (10,)).fetchall()) == 40
+        
+        stats = {item['sql']: item for item in tracer.top(order_by='count')}
+        select = stats['SELECT x FROM t WHERE x >= ?']
+        assert select['count'] == 2
+        assert select['rows'] == 80
+        assert stats['INSERT INTO t VALUES (?)']['rows'] == 50
+        assert stats['COMMIT']['count'] == 1
+        assert all(route == 'MainThread' for route in select['routes'])
+        pool.close_all()
+        tracer.reset()
+    
+    def test_slow_query_log(self, db_path):
+        """Test that statements over the threshold are kept in the slow-query log."""
+        from services.query_trace import get_query_tracer
+        tracer = get_query_tracer()
+        tracer.reset()
+        threshold, tracer.slow_threshold = tracer.slow_threshold, 1e-9
+        pool = DatabasePool(db_path, max_connections=1, trace=True)
+        try:
+            with pool.get_connection() as conn:
+                conn.execute('SELECT 1').fetchone()
+            slow = tracer.slow_queries()
+            assert slow[0]['sql'] == 'SELECT ?'
+            assert slow[0]['rows'] == 1
+        finally:
+            tracer.slow_threshold = threshold
+            pool.close_all()
+            tracer.reset()
+
+class TestRequestDeadline:
+    """Test that request deadlines abort database work."""
+    
+    # 递归CTE执行足够多的虚拟机指令，进度回调会在执行期间被多次调用
+    SLOW_QUERY = 'WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) SELECT COUNT(*) FROM n'
+    
+    def test_long_query_interrupted(self, db_path):
+        """Test that a running statement is interrupted once the deadline passes."""
+        from services.database import DeadlineExceeded, set_deadline, clear_deadline, deadline_expired
+        pool = DatabasePool(db_path, max_connections=1, timeout=5)
+        try:
+            set_deadline(0.05)
+            with pytest.raises(DeadlineExceeded):
+                with pool.get_connection() as conn:
+                    conn.execute(self.SLOW_QUERY).fetchone()
+            assert deadline_expired()
+            
+            # 签出时缩短的busy_timeout在归还时恢复，连接可以继续使用
+            clear_deadline()
+            with pool.get_connection() as conn:
+                assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+                assert conn.execute('SELECT 1').fetchone()[0] == 1
+        finally:
+            clear_deadline()
+            pool.close_all()
+    
+    def test_expired_deadline_fails_fast(self, db_path):
+        """Test that checkout fails immediately when the budget is already spent."""
+        from services.database import DeadlineExceeded, set_deadline, clear_deadline
+        pool = DatabasePool(db_path, max_connections=1)
+        try:
+            set_deadline(1e-9)
+            with pytest.raises(DeadlineExceeded):
+                with pool.get_connection():
+                    pass
+        finally:
+            clear_deadline()
+            pool.close_all()
+    
+    def test_queued_write_cancelled(self, db_path):
+        """Test that a write still queued at the deadline is cancelled and never applied."""
+        from services.database import DeadlineExceeded, set_deadline, clear_deadline
+        writer = DatabaseWriter(db_path)
+        writer.execute(lambda conn: conn.execute('CREATE TABLE t (x INTEGER)'))
+        try:
+            # 持有写锁模拟写入线程正忙
+            with writer.write_lock:
+                set_deadline(0.05)
+                with pytest.raises(DeadlineExceeded):
+                    writer.execute(lambda conn: conn.execute('INSERT INTO t VALUES (1)'))
+                clear_deadline()
+            
+            assert writer.execute(lambda conn: conn.execute('SELECT COUNT(*) FROM t').fetchone()[0]) == 0
+            assert writer.get_stats()['cancelled'] == 1
+        finally:
+            clear_deadline()
+            writer.close()
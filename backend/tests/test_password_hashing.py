@@ -0,0 +1,94 @@
+import threading
+import pytest
+from services.password_hashing import PasswordHashingPool, PasswordHashingBusy
+
+class TestPasswordHashingPool:
+    """Test the bounded password hashing pool."""
+    
+    def test_hash_and_verify(self):
+        """Test that hashing and verification run on the pool."""
+        pool = PasswordHashingPool(max_workers=1, max_queue=0, rounds=4)
+        try:
+            hashed = pool.hash_password('secret')
+            assert pool.verify_password('secret', hashed) is True
+            assert pool.verify_password('wrong', hashed) is False
+            assert pool.get_stats()['completed'] == 3
+        finally:
+            pool.close()
+    
+    def test_rejects_when_full(self):
+        """Test that work beyond workers plus queue is rejected immediately."""
+        pool = PasswordHashingPool(max_workers=1, max_queue=0)
+        release = threading.Event()
+        worker = threading.Thread(target=pool.run, args=(release.wait,))
+        worker.start()
+        try:
+            while pool.get_stats()['in_flight'] == 0:
+                pass
+            with pytest.raises(PasswordHashingBusy):
+                pool.run(lambda: None)
+            assert pool.get_stats()['rejected'] == 1
+        finally:
+            release.set()
+            worker.join()
+            pool.close()
+        assert pool.get_stats()['in_flight'] == 0
+    
+    def test_queued_work_times_out(self):
+        """Test that work still queued when the wait times out is cancelled."""
+        pool = PasswordHashingPool(max_workers=1, max_queue=1, timeout=0.05)
+        release = threading.Event()
+        
+        def occupy():
+            # 占住唯一的工作线程，自身的等待同样会超时
+            with pytest.raises(PasswordHashingBusy):
+                pool.run(release.wait)
+        worker = threading.Thread(target=occupy)
+        worker.start()
+        try:
+            while pool.get_stats()['in_flight'] == 0:
+                pass
+            ran = []
+            with pytest.raises(PasswordHashingBusy):
+                pool.run(ran.append, 1)
+        finally:
+            release.set()
+            worker.join()
+            pool.close()
+        assert ran == []
+        assert pool.get_stats()['timeouts'] >= 1
+    
+    def test_calibrate_rounds(self):
+        """Test that calibration picks the largest cost within the target latency."""
+        from security import PasswordManager
+        rounds, timings = PasswordManager.calibrate_rounds(target_ms=1e-6, min_rounds=4, max_rounds=6)
+        assert rounds == 4
+        assert list(timings) == [4]
+        
+        rounds, timings = PasswordManager.calibrate_rounds(target_ms=1e6, min_rounds=4, max_rounds=6)
+        assert rounds == 6
+        assert list(timings) == [4, 5, 6]
+    
+    def test_needs_rehash(self):
+        """Test that hashes with a different cost factor are flagged for rehashing."""
+        pool = PasswordHashingPool(rounds=5)
+        try:
+            assert pool.needs_rehash(pool.hash_password('secret')) is False
+            pool._rounds = 4
+            from security import PasswordManager
+            assert pool.needs_rehash(PasswordManager.hash_password('secret', 5)) is True
+            assert pool.get_stats()['calibration']['source'] == 'configured'
+        finally:
+            pool.close()
+    
+    def test_calibrated_rounds_tolerance(self):
+        """Test that calibrated costs only rehash hashes outside the tolerance band."""
+        from security import PasswordManager
+        pool = PasswordHashingPool(target_ms=1e6, min_rounds=5, max_rounds=5)
+        try:
+            assert pool.needs_rehash(PasswordManager.hash_password('secret', 4)) is False
+            assert pool.needs_rehash(PasswordManager.hash_password('secret', 6)) is False
+            pool._rounds = 7
+            assert pool.needs_rehash(PasswordManager.hash_password('secret', 5)) is True
+        finally:
+            pool.close()
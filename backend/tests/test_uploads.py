@@ -0,0 +1,56 @@
+import hashlib
+import os
+from security import detect_file_type
+from services.uploads import UploadIngestStream
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 64
+
+class TestFileSignatures:
+    """Test the file signature registry."""
+    
+    def test_detect_file_type(self):
+        """Test that multi-part and offset signatures are recognised."""
+        assert detect_file_type(PNG[:16]) == 'image/png'
+        assert detect_file_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+        assert detect_file_type(b'RIFF\x00\x00\x00\x00AVI LIST') == 'video/x-msvideo'
+        assert detect_file_type(b'\x00\x00\x00\x18ftypmp42') == 'video/mp4'
+        assert detect_file_type(b'\x00\x00\x00\x14ftypqt  ') == 'video/quicktime'
+        assert detect_file_type(b'plain text file.') is None
+
+class TestUploadIngestStream:
+    """Test streaming upload validation."""
+    
+    def test_accepted_file_hashed_and_saved(self, tmp_path):
+        """Test that an accepted file is written once, hashed and moved into place."""
+        stream = UploadIngestStream(str(tmp_path), {'image/png'})
+        for i in range(0, len(PNG), 5):
+            stream.write(PNG[i:i + 5])
+        stream.seek(0)
+        assert stream.accepted
+        assert stream.size == len(PNG)
+        assert stream.hexdigest() == hashlib.sha256(PNG).hexdigest()
+        
+        stream.save(str(tmp_path / 'banner.png'))
+        stream.close()
+        assert os.listdir(tmp_path) == ['banner.png']
+        assert (tmp_path / 'banner.png').read_bytes() == PNG
+    
+    def test_rejected_file_never_touches_disk(self, tmp_path):
+        """Test that a disallowed file is rejected on its first chunk and discarded."""
+        stream = UploadIngestStream(str(tmp_path), {'image/png'})
+        stream.write(b'GIF89a' + b'\x00' * 10)
+        assert stream.rejected
+        stream.write(b'\x00' * 1024)
+        stream.seek(0)
+        assert not stream.accepted
+        assert stream.size == 0
+        assert stream.read() == b''
+        assert os.listdir(tmp_path) == []
+    
+    def test_unsaved_file_removed_on_close(self, tmp_path):
+        """Test that the temp file of an upload that is never saved is deleted."""
+        stream = UploadIngestStream(str(tmp_path), {'image/png'})
+        stream.write(PNG)
+        assert len(os.listdir(tmp_path)) == 1
+        stream.close()
+        assert os.listdir(tmp_path) == []
@@ -0,0 +1,42 @@
+import time
+from services.user_cache import UserCache
+
+class TestUserCache:
+    """Test the admin user cache."""
+    
+    def test_hit_until_expired(self):
+        """Test that a cached user is reused until its TTL passes."""
+        cache = UserCache(ttl=0.05)
+        calls = []
+        loader = lambda: calls.append(1) or 'admin'
+        assert cache.get_or_load('db', 1, loader) == 'admin'
+        assert cache.get_or_load('db', '1', loader) == 'admin'
+        assert len(calls) == 1
+        
+        time.sleep(0.06)
+        cache.get_or_load('db', 1, loader)
+        assert len(calls) == 2
+        assert cache.get_stats()['hits'] == 1
+    
+    def test_missing_user_not_cached(self):
+        """Test that unknown ids are looked up every time."""
+        cache = UserCache()
+        calls = []
+        for _ in range(2):
+            assert cache.get_or_load('db', 1, lambda: calls.append(1)) is None
+        assert len(calls) == 2
+    
+    def test_size_limit_and_invalidate(self):
+        """Test LRU eviction and invalidation by user and by database."""
+        cache = UserCache(max_entries=2)
+        cache.get_or_load('db', 1, lambda: 'one')
+        cache.get_or_load('db', 2, lambda: 'two')
+        cache.get_or_load('db', 1, lambda: 'unused')
+        cache.get_or_load('other', 1, lambda: 'three')
+        assert cache.get_stats()['entries'] == 2
+        assert cache.get_or_load('db', 2, lambda: 'reloaded') == 'reloaded'
+        
+        cache.invalidate('db', 2)
+        assert cache.get_or_load('db', 2, lambda: 'again') == 'again'
+        cache.invalidate('db')
+        assert cache.get_or_load('db', 2, lambda: 'cleared') == 'cleared'